@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+QualityDetector.detect must give the same flags as searching the regular
+expressions of maps, for every supported language (see
+wikidat.bench.templates for the corpus and timings).
+"""
+import unittest
+from wikidat.retrieval.templates import QualityDetector, get_detector
+from wikidat.bench.templates import LANGS, build_corpus
+
+
+class TestQualityDetector(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.corpus = build_corpus(seed=1, texts=50)
+
+    def test_same_flags_as_regexes(self):
+        for lang in LANGS:
+            detector = QualityDetector(lang)
+            for text in self.corpus:
+                self.assertEqual(detector.detect(text),
+                                 detector.detect_regex(text),
+                                 '%s: %r' % (lang, text[:200]))
+
+    def test_all_flags_in_one_text(self):
+        detector = QualityDetector('enwiki')
+        text = 'a {{Featured list}} b {{Good article}} c {{featured article}}'
+        self.assertEqual(detector.detect(text), (True, True, True))
+        self.assertEqual(detector.detect('{{Good article}}'),
+                         (False, False, True))
+        self.assertEqual(detector.detect('Featured article}}'),
+                         (False, False, False))
+
+    def test_nested_braces(self):
+        # Templates starting at the second brace of '{{{'
+        detector = QualityDetector('enwiki')
+        self.assertEqual(detector.detect('{{{Featured article}}'),
+                         (True, False, False))
+        detector = QualityDetector('dewiki')
+        text = '{{Exzellent|x|1}} {{{Lesenswert|y|2}}'
+        self.assertEqual(detector.detect(text), detector.detect_regex(text))
+        self.assertEqual(detector.detect(text), (True, False, True))
+
+    def test_alternatives(self):
+        detector = QualityDetector('cawiki')
+        for text in ('{{Article de qualitat}}', '{{1000+AdQ|x}}'):
+            self.assertEqual(detector.detect(text), (True, False, False))
+        self.assertEqual(detector.detect('{{1000+AdQ\n}}'),
+                         (False, False, False))
+
+    def test_languages_without_templates(self):
+        detector = get_detector('furwiki')
+        self.assertEqual(detector.detect('{{Featured article}}'),
+                         (False, False, False))
+
+    def test_unsupported_language(self):
+        self.assertRaises(RuntimeError, QualityDetector, 'xxwiki')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,14 @@
+"""
+wikidat.bench
+
+Benchmarks to track the performance of the different stages of WikiDAT
+data retrieval workflows:
+
+    - synth: generator of synthetic dump files
+    - parsers: comparison of XML parser engines
+    - stages: microbenchmarks of every stage function, with null sinks
+    - templates: correctness and speed of detection of quality templates
+    - e2e: end-to-end run of RevisionHistoryETL (MariaDB or SQLite)
+    - profiles: bulk-load profiles of each DB engine (MariaDB)
+    - results: JSON results and comparison with a baseline
+"""
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+"""
+End-to-end benchmark of RevisionHistoryETL.
+
+Runs a complete ETL line (XML readers, page and revision workers and DB
+consumers) on a dump file, and reports elapsed time and throughput, along
+with the per-stage metrics published by the line. User info is then
+exported from the user store (memory by default, so no Redis server is
+needed). Data are loaded either in a local MariaDB/MySQL database or in a
+SQLite stand-in, which emulates LOAD DATA INFILE by reading the CSV files
+written by consumers (loaded by background threads of consumers, each
+with its own connection), or streamed through named pipes (--load_mode
+fifo). With MariaDB/MySQL or PostgreSQL (postgresql backend, loaded with
+binary COPY, see pgutils), primary keys and indexes are then built
+(e2e[indexes], with the time of each index). The parquet backend writes
+Parquet datasets instead (see columnar, requires pyarrow), reporting
+their size on disk. Example:
+
+    python -m wikidat.bench.e2e --pages 2000 --rev_fan 2 \\
+        --output e2e.json --baseline baseline-e2e.json
+
+@author: jfelipe
+"""
+import argparse
+import csv
+import multiprocessing as mp
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from wikidat.retrieval import etl
+from wikidat.retrieval.db import pg_schema
+from wikidat.utils.comutils import Transport
+from wikidat.utils.dbutils import MySQLDB, get_db_class
+from wikidat.utils.metrics import metrics_path
+from wikidat.utils.loader import BulkLoad, LOAD_MODES
+from wikidat.utils.columnar import (ParquetSink, PARQUET_COMPRESSIONS,
+                                    dataset_files, dataset_rows)
+from wikidat.utils.profiling import Profiling, PROFILERS
+from wikidat.bench.synth import HistoryGenerator
+from wikidat.retrieval.revision import users_file_to_db
+from wikidat.retrieval.userstore import UserStore, USER_STORES
+from wikidat.bench import results as bench_results
+
+LOAD_DATA_RE = re.compile(r"LOAD DATA (?:LOCAL )?INFILE '(.+?)'\s+"
+                          r"INTO TABLE (\w+)")
+
+# Tables filled by RevisionHistoryETL and users_file_to_db
+TABLES = ('page', 'revision', 'revision_hash', 'user', 'revision_IP',
+          'revision_diff', 'revision_user_zero')
+
+
+class SQLiteDB(object):
+    """
+    Stand-in for MySQLDB connections storing data in a SQLite file.
+    LOAD DATA INFILE queries are emulated by inserting the rows of the CSV
+    file in the table (created on first load, with one column for every
+    field). Other queries are ignored.
+
+    The SQLite connection is opened on first use, in the process actually
+    using it (DB connections are created by ETL lines before forking their
+    consumers).
+    """
+    def __init__(self, path, *args, **kwargs):
+        self.path = path
+        self.con = None
+        self.tables = set()
+
+    def clone(self, local_infile=None, load_profile=None):
+        return SQLiteDB(self.path)
+
+    # LOAD DATA queries of CSV chunks, as MySQLDB sends them
+    load_chunk = MySQLDB.load_chunk
+    chunk_encoder = MySQLDB.chunk_encoder
+
+    def load_query(self, query):
+        self.send_query(query)
+
+    def connect(self):
+        pass
+
+    def begin_load(self):
+        pass
+
+    def end_load(self):
+        pass
+
+    def _connect(self):
+        if self.con is None:
+            self.con = sqlite3.connect(self.path, timeout=600)
+
+    def close(self):
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+
+    def send_query(self, query):
+        match = LOAD_DATA_RE.search(query)
+        if match is None:
+            return
+        path, table = match.groups()
+        self._connect()
+        with open(path, newline='') as in_file:
+            rows = list(csv.reader(in_file, dialect='excel-tab'))
+        if not rows:
+            return
+        if table not in self.tables:
+            self.con.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (
+                table, ', '.join('c%s' % n for n in range(len(rows[0])))))
+            self.tables.add(table)
+        self.con.executemany('INSERT INTO %s VALUES (%s)' % (
+            table, ', '.join('?' * len(rows[0]))), rows)
+        self.con.commit()
+
+    def insert_namespaces(self, nsdict):
+        pass
+
+    def count(self, table):
+        self._connect()
+        try:
+            return self.con.execute('SELECT COUNT(*) FROM %s' %
+                                    table).fetchone()[0]
+        except sqlite3.OperationalError:
+            return 0
+
+
+def run_etl(path, db_factory, page_fan=1, rev_fan=1, xml_shards=1,
+            xml_parser='expat', hash_mode='sha256', transport=None,
+            lang='enwiki', base_port=18000, control_port=18100,
+            profiling=None, user_store=None, text_cache=64, rev_diff=False,
+            bulk_load=None, file_rows=1000000):
+    """
+    Run one RevisionHistoryETL line on path, creating its DB connections
+    with db_factory. Processes are profiled if profiling is given. Returns
+    elapsed time.
+    """
+    paths_queue = mp.JoinableQueue()
+    paths_queue.put(path)
+    paths_queue.put('STOP')
+    original = etl.get_db_class
+    etl.get_db_class = lambda name: db_factory
+    try:
+        line = etl.RevisionHistoryETL(
+            name='bench', paths_queue=paths_queue, lang=lang,
+            page_fan=page_fan, rev_fan=rev_fan, xml_shards=xml_shards,
+            xml_parser=xml_parser, hash_mode=hash_mode,
+            base_port=base_port, control_port=control_port,
+            transport=transport, metrics_interval=1, profiling=profiling,
+            user_store=user_store, text_cache=text_cache,
+            rev_diff=rev_diff, bulk_load=bulk_load,
+            page_cache_size=file_rows, rev_cache_size=file_rows)
+        start = time.time()
+        line.start()
+        line.join()
+        elapsed = time.time() - start
+    finally:
+        etl.get_db_class = original
+    if line.exitcode != 0:
+        raise RuntimeError('ETL line failed with exit code %s' %
+                           line.exitcode)
+    return elapsed
+
+
+def export_users(con, lang, user_store, data_dir, bulk_load=None):
+    """
+    Export user info from user_store to DB. Returns elapsed time.
+    """
+    tmp_dir = os.path.join(data_dir, 'users-tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    start = time.time()
+    users_file_to_db(con=con, lang=lang,
+                     log_file=os.path.join(tmp_dir, 'users.log'),
+                     tmp_dir=tmp_dir, user_store=user_store,
+                     bulk_load=bulk_load)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('--history', metavar='FILE',
+                        help='pages-meta-history dump file')
+    parser.add_argument('--pages', type=int, default=1000,
+                        help='Pages of synthetic history dump')
+    parser.add_argument('--backend', choices=['sqlite', 'mariadb',
+                                              'postgresql', 'parquet'],
+                        default='sqlite')
+    parser.add_argument('--db_name', default='wikidat_bench')
+    parser.add_argument('--db_user')
+    parser.add_argument('--db_passw')
+    parser.add_argument('--index_workers', type=int, default=4,
+                        help='Tables whose indexes are built at once after '
+                             'loading (mariadb and postgresql backends)')
+    parser.add_argument('--index_combine', action='store_true',
+                        help='Build all indexes of each table in a single '
+                             'ALTER TABLE')
+    parser.add_argument('--lang', default='enwiki')
+    parser.add_argument('--page_fan', type=int, default=1)
+    parser.add_argument('--rev_fan', type=int, default=1)
+    parser.add_argument('--xml_shards', type=int, default=1)
+    parser.add_argument('--xml_parser', choices=['lxml', 'expat'],
+                        default='expat')
+    parser.add_argument('--hash_mode', default='sha256')
+    parser.add_argument('--transport', choices=['tcp', 'ipc', 'shm'],
+                        default='tcp')
+    parser.add_argument('--user_store', choices=USER_STORES,
+                        default='memory')
+    parser.add_argument('--text_cache', type=int, default=64,
+                        help='Distinct texts per page cached by revision '
+                             'workers (0 disables the cache)')
+    parser.add_argument('--rev_diff', action='store_true',
+                        help='Store diffs of revisions in revision_diff')
+    parser.add_argument('--parquet_compression', choices=PARQUET_COMPRESSIONS,
+                        default='zstd', help='Compression of Parquet files '
+                                             '(parquet backend)')
+    parser.add_argument('--load_mode', choices=LOAD_MODES, default='file',
+                        help='Bulk loading of chunks (see loader.BulkLoad)')
+    parser.add_argument('--load_dir', metavar='DIR',
+                        help='Staging dir of chunk files and named pipes')
+    parser.add_argument('--load_queue', type=int, default=1,
+                        help='Chunk files of each table waiting to be '
+                             'loaded (0 loads them synchronously)')
+    parser.add_argument('--file_rows', type=int, default=1000000,
+                        help='Rows of each chunk file')
+    parser.add_argument('--profile_dir', metavar='DIR',
+                        help='Profile all processes, writing one file per '
+                             'process to DIR (see tools.profmerge)')
+    parser.add_argument('--profiler', choices=PROFILERS, default='cprofile')
+    parser.add_argument('--output', metavar='FILE',
+                        help='Write results to FILE in JSON format')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='Compare results with baseline in FILE')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Max. drop of throughput before reporting a '
+                             'regression (0.1 is 10%%)')
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='wikidat-bench-')
+    try:
+        history = args.history
+        if history is None:
+            history = os.path.join(data_dir,
+                                   'synthwiki-pages-meta-history.xml.bz2')
+            HistoryGenerator(pages=args.pages).write(history)
+        transport = Transport(transport=args.transport,
+                              compression=('none' if args.transport == 'shm'
+                                           else 'zlib'))
+        run_args = dict(page_fan=args.page_fan, rev_fan=args.rev_fan,
+                        xml_shards=args.xml_shards,
+                        xml_parser=args.xml_parser,
+                        hash_mode=args.hash_mode, transport=transport,
+                        lang=args.lang, text_cache=args.text_cache,
+                        rev_diff=args.rev_diff, file_rows=args.file_rows)
+        bulk_load = BulkLoad(mode=args.load_mode, staging_dir=args.load_dir,
+                             max_pending=args.load_queue)
+        run_args['bulk_load'] = bulk_load
+        user_store = UserStore(args.user_store,
+                               path=os.path.join(data_dir, 'users'))
+        user_store.prepare(args.lang)
+        run_args['user_store'] = user_store
+        if args.profile_dir:
+            run_args['profiling'] = Profiling(
+                os.path.abspath(args.profile_dir), profiler=args.profiler)
+
+        index_timings = None
+        dataset_bytes = None
+        if args.backend == 'parquet':
+            out_dir = os.path.join(data_dir, 'parquet')
+            bulk_load = ParquetSink(out_dir=out_dir,
+                                    compression=args.parquet_compression)
+            run_args['bulk_load'] = bulk_load
+            elapsed = run_etl(history, None, **run_args)
+            users_elapsed = export_users(None, args.lang, user_store,
+                                         data_dir, bulk_load=bulk_load)
+            counts = {table: dataset_rows(out_dir, table)
+                      for table in TABLES}
+            dataset_bytes = {table: sum(os.path.getsize(path) for path in
+                                        dataset_files(out_dir, table))
+                             for table in TABLES}
+        elif args.backend == 'sqlite':
+            db_path = os.path.join(data_dir, 'bench.sqlite')
+
+            def db_factory(*factory_args, **kwargs):
+                return SQLiteDB(db_path)
+            elapsed = run_etl(history, db_factory, **run_args)
+            db = SQLiteDB(db_path)
+            users_elapsed = export_users(db, args.lang, user_store, data_dir,
+                                         bulk_load=bulk_load)
+            counts = {table: db.count(table) for table in TABLES}
+            db.close()
+        else:
+            db_class = get_db_class('postgresql' if args.backend ==
+                                    'postgresql' else 'mysql')
+
+            def db_factory(*factory_args, **kwargs):
+                return db_class(host='localhost', user=args.db_user,
+                                passwd=args.db_passw, db=args.db_name)
+            db = db_factory()
+            db.connect()
+            db.create_schema_revhist()
+            elapsed = run_etl(history, db_factory, **run_args)
+            users_elapsed = export_users(db, args.lang, user_store, data_dir,
+                                         bulk_load=bulk_load)
+            # "user" is a reserved word in PostgreSQL
+            counts = {table: db.execute_query('SELECT COUNT(*) FROM %s' % (
+                                              pg_schema.quote(table)
+                                              if args.backend == 'postgresql'
+                                              else table))[0][0]
+                      for table in TABLES}
+            start = time.time()
+            index_timings = db.create_pks_revhist(
+                workers=args.index_workers, combine=args.index_combine)
+            indexes_elapsed = time.time() - start
+            db.close()
+
+        log_dir = os.path.join(os.path.split(history)[0], 'logs')
+        with open(metrics_path(log_dir, 'bench') + '.json') as in_file:
+            stages = json.load(in_file)['stages']
+        # Keep tmp and logs dirs of dump files given by the user
+        if args.history is not None:
+            print("Metrics of pipeline stages in", log_dir)
+    finally:
+        shutil.rmtree(data_dir)
+
+    results = bench_results.new_results('e2e', params=vars(args))
+    bench_results.add_result(results, 'e2e[revisions]', counts['revision'],
+                             elapsed, stages=stages)
+    if dataset_bytes is not None:
+        results['results']['e2e[revisions]']['bytes'] = dataset_bytes
+        print("Parquet datasets: %s" % ', '.join(
+              '%s %.1f KiB' % (table, size / 1024.0)
+              for table, size in sorted(dataset_bytes.items())))
+    bench_results.add_result(results, 'e2e[pages]', counts['page'], elapsed)
+    bench_results.add_result(results, 'e2e[users]', counts['user'],
+                             users_elapsed)
+    if index_timings is not None:
+        bench_results.add_result(
+            results, 'e2e[indexes]', len(index_timings), indexes_elapsed,
+            timings=[[table, ', '.join(names), elapsed]
+                     for table, names, elapsed in index_timings])
+    if counts['revision'] != counts['revision_hash']:
+        print("Warning: %s revisions, %s revision hashes" % (
+              counts['revision'], counts['revision_hash']))
+    if args.rev_diff and counts['revision'] != counts['revision_diff']:
+        print("Warning: %s revisions, %s revision diffs" % (
+              counts['revision'], counts['revision_diff']))
+
+    if args.output:
+        bench_results.save(results, args.output)
+    if args.baseline:
+        regressions = bench_results.compare(
+            results, bench_results.load(args.baseline),
+            threshold=args.threshold)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of XML parser engines available in process_xml.
+
+Reads the same dump file with every engine, reporting elapsed time,
+throughput (items/s and decompressed MB/s) and whether both engines yield
+the same items. Example:
+
+    python -m wikidat.bench.parsers data/furwiki-pages-meta-history.xml.7z
+
+@author: jfelipe
+"""
+import argparse
+import json
+import time
+from wikidat.retrieval.dump import (DumpFile, process_xml, PAGE_FIELDS,
+                                    REV_FIELDS, LOG_FIELDS)
+
+ENGINES = ('lxml', 'expat')
+
+# Item keys used downstream, compared across engines
+ITEM_KEYS = set(PAGE_FIELDS + REV_FIELDS + LOG_FIELDS +
+                ('page_id', 'contrib_dict', 'rev_parent_id', 'item_type',
+                 'namespace'))
+
+
+class CountingStream(object):
+    """
+    Wraps a file-like object, counting bytes read from it. Other
+    attributes (close, bytes_in, bytes_out, tool) are those of the wrapped
+    stream.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class CountingDumpFile(DumpFile):
+    """
+    DumpFile reporting the size of the decompressed XML stream
+    """
+    def open_dump(self, byte_range=None):
+        self.stream = CountingStream(
+            super(CountingDumpFile, self).open_dump(byte_range=byte_range))
+        return self.stream
+
+
+def bench_engine(path, engine, repeat=1):
+    """
+    Parse dump file in path with the given engine. Returns a dict with the
+    best timing out of repeat runs and the list of items found.
+    """
+    best = None
+    for run in range(repeat):
+        dump_file = CountingDumpFile(path)
+        counts = {'page': 0, 'revision': 0, 'logitem': 0}
+        items = []
+        start = time.time()
+        for item in process_xml(dump_file=dump_file, parser=engine):
+            counts[item.get('item_type', 'logitem')] += 1
+            items.append(item)
+        elapsed = time.time() - start
+        if best is None or elapsed < best['elapsed']:
+            best = {'engine': engine, 'elapsed': elapsed,
+                    'bytes': dump_file.stream.bytes_read,
+                    'items': sum(counts.values())}
+            best.update(counts)
+    best['items_sec'] = best['items'] / best['elapsed']
+    best['mb_sec'] = best['bytes'] / best['elapsed'] / 1e6
+    return best, items
+
+
+def _item_keys(item):
+    return {k: v for k, v in item.items() if k in ITEM_KEYS}
+
+
+def run(path, engines=ENGINES, repeat=1):
+    """
+    Run benchmark for all engines on dump file in path
+    """
+    results = []
+    reference = None
+    for engine in engines:
+        result, items = bench_engine(path, engine, repeat=repeat)
+        if reference is None:
+            reference = items
+        result['same_items'] = ([_item_keys(i) for i in items] ==
+                                [_item_keys(i) for i in reference])
+        results.append(result)
+        print("{engine:>6}: {elapsed:8.3f} sec. {items:>9} items "
+              "({page} pages, {revision} revisions, {logitem} logitems) "
+              "{items_sec:10.1f} items/s {mb_sec:7.2f} MB/s "
+              "same items: {same_items}".format(**result))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='Path to dump file')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES),
+                        choices=ENGINES)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs per engine (best is reported)')
+    parser.add_argument('--output', metavar='FILE',
+                        help='Write results to FILE in JSON format')
+    args = parser.parse_args()
+    results = run(args.path, engines=args.engines, repeat=args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
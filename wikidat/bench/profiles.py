@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of bulk-load profiles (see dbutils.LOAD_PROFILES) in a local
+MariaDB/MySQL database.
+
+Rows of page, revision, revision_hash, revision_IP and revision_diff are
+extracted once from a synthetic dump (see synth) and kept in memory. Then,
+for every DB engine and load profile, the revision history schema is
+created again and the rows are loaded with pages_file_to_db and
+revs_file_to_db, with the global and session settings of the profile
+applied around the load (as tasks do). Results are named
+load[<engine>:<profile>], with the rows loaded in each table and the
+settings of the profile. Example:
+
+    python -m wikidat.bench.profiles --pages 2000 --engines ARIA InnoDB \\
+        --db_user auser --db_passw apassw --output profiles.json
+
+Profiles with global settings (innodb) need a DB user with admin
+privileges, as well as sql_log_bin (turned off by every profile but
+none). Otherwise those settings are not changed, and errors are printed.
+
+@author: jfelipe
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from wikidat.retrieval.dump import DumpFile, process_xml
+from wikidat.retrieval.page import Page, pages_to_file, pages_file_to_db
+from wikidat.retrieval.revision import (Revision, revs_to_file,
+                                        revs_file_to_db)
+from wikidat.retrieval.userstore import UserStore
+from wikidat.utils.dbutils import MySQLDB, LOAD_PROFILES, get_load_profile
+from wikidat.utils.loader import BulkLoad, LOAD_MODES
+from wikidat.bench.synth import HistoryGenerator
+from wikidat.bench import results as bench_results
+
+ENGINES = ('ARIA', 'MyISAM', 'InnoDB')
+
+TABLES = ('page', 'revision', 'revision_hash', 'revision_IP',
+          'revision_diff')
+
+
+def synthetic_rows(pages, lang, tmp_dir, seed=0):
+    """
+    Return tuple (page_rows, rev_rows) of a synthetic dump of pages
+    """
+    path = os.path.join(tmp_dir, 'synthwiki-pages-meta-history.xml.bz2')
+    HistoryGenerator(pages=pages, seed=seed).write(path)
+    items = list(process_xml(dump_file=DumpFile(path)))
+    page_rows = list(pages_to_file(
+        [item for item in items if isinstance(item, Page)]))
+    user_store = UserStore('memory', path=tmp_dir)
+    user_store.prepare(lang)
+    rev_rows = list(revs_to_file(
+        [item for item in items if isinstance(item, Revision)], lang=lang,
+        user_store=user_store))
+    return page_rows, rev_rows
+
+
+def bench_profile(results, db, engine, profile, page_rows, rev_rows,
+                  tmp_dir, bulk_load):
+    """
+    Load page_rows and rev_rows in DB tables of engine with load profile,
+    adding result load[<engine>:<profile>]. Returns row counts of TABLES.
+    """
+    db.create_schema_revhist(engine=engine)
+    con = db.clone(load_profile=profile)
+    con.connect()
+    con.begin_server_load()
+    log_file = os.path.join(tmp_dir, 'profiles.log')
+    try:
+        start = time.time()
+        pages_file_to_db(iter(page_rows), con=con, log_file=log_file,
+                         tmp_dir=tmp_dir, etl_prefix='bench',
+                         bulk_load=bulk_load)
+        revs_file_to_db(iter(rev_rows), con=con, log_file=log_file,
+                        tmp_dir=tmp_dir, etl_prefix='bench',
+                        bulk_load=bulk_load)
+        elapsed = time.time() - start
+    finally:
+        con.end_server_load()
+        con.close()
+    counts = {table: db.execute_query('SELECT COUNT(*) FROM %s' %
+                                      table)[0][0]
+              for table in TABLES}
+    bench_results.add_result(results, 'load[%s:%s]' % (engine, profile),
+                             len(page_rows) + len(rev_rows), elapsed,
+                             counts=counts,
+                             settings=repr(get_load_profile(profile)))
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=1000,
+                        help='Number of pages of synthetic dump')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--lang', default='enwiki')
+    parser.add_argument('--engines', nargs='+', default=['ARIA'],
+                        choices=ENGINES, metavar='ENGINE',
+                        help='DB engines of tables (default ARIA)')
+    parser.add_argument('--profiles', nargs='+',
+                        default=sorted(LOAD_PROFILES),
+                        choices=sorted(LOAD_PROFILES), metavar='PROFILE',
+                        help='Load profiles compared (default all)')
+    parser.add_argument('--db_name', default='wikidat_bench')
+    parser.add_argument('--db_user')
+    parser.add_argument('--db_passw')
+    parser.add_argument('--load_mode', choices=LOAD_MODES, default='file',
+                        help='Bulk load mode (see loader)')
+    parser.add_argument('--load_queue', type=int, default=1,
+                        help='Max. chunks of each table waiting to be '
+                             'loaded (0 loads them synchronously)')
+    parser.add_argument('--output', metavar='FILE',
+                        help='Write results to FILE in JSON format')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='Compare results with a previous run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Max. drop of throughput before reporting a '
+                             'regression (0.1 is 10%%)')
+    args = parser.parse_args()
+
+    results = bench_results.new_results('profiles', params=vars(args))
+    tmp_dir = tempfile.mkdtemp(prefix='wikidat-bench-')
+    mismatches = 0
+    try:
+        page_rows, rev_rows = synthetic_rows(args.pages, args.lang, tmp_dir,
+                                             seed=args.seed)
+        print("%s pages, %s revisions" % (len(page_rows), len(rev_rows)))
+        db = MySQLDB(host='localhost', port=3306, user=args.db_user,
+                     passwd=args.db_passw, db=args.db_name)
+        db.connect()
+        expected = None
+        for engine in args.engines:
+            for profile in args.profiles:
+                bulk_load = BulkLoad(mode=args.load_mode,
+                                     max_pending=args.load_queue,
+                                     profile=profile)
+                counts = bench_profile(results, db, engine, profile,
+                                       page_rows, rev_rows, tmp_dir,
+                                       bulk_load)
+                if expected is None:
+                    expected = counts
+                elif counts != expected:
+                    mismatches += 1
+                    print("Warning: rows loaded with %s:%s %s, expected %s" %
+                          (engine, profile, counts, expected))
+        db.close()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if args.output:
+        bench_results.save(results, args.output)
+    if args.baseline:
+        regressions = bench_results.compare(
+            results, bench_results.load(args.baseline),
+            threshold=args.threshold)
+        if regressions:
+            sys.exit(1)
+    if mismatches:
+        sys.exit(1)
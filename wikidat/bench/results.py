@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Machine-readable results of benchmarks and comparison with a baseline.
+
+Results are stored as JSON documents:
+
+    {"suite": "stages", "time": "...", "host": "...", "python": "...",
+     "params": {...},
+     "results": {"revs_to_file[sha256]": {"items": 1000, "elapsed": 0.5,
+                                          "items_sec": 2000.0}, ...}}
+
+@author: jfelipe
+"""
+import json
+import platform
+import time
+
+
+def new_results(suite, params=None):
+    """
+    Return empty results document for a benchmark suite
+    """
+    return {'suite': suite,
+            'time': time.strftime("%Y-%m-%d %H:%M:%S %Z", time.localtime()),
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'params': params if params is not None else {},
+            'results': {}}
+
+
+def add_result(results, name, items, elapsed, **extra):
+    """
+    Add timing of a benchmark to results document
+    """
+    result = {'items': items, 'elapsed': elapsed,
+              'items_sec': items / elapsed if elapsed else 0.0}
+    result.update(extra)
+    results['results'][name] = result
+    print("{0:>28}: {1:9.3f} sec. {2:>10} items {3:12.1f} items/s".format(
+          name, elapsed, items, result['items_sec']))
+    return result
+
+
+def save(results, path):
+    with open(path, 'w') as out:
+        json.dump(results, out, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as in_file:
+        return json.load(in_file)
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Compare throughput (items/s) of results with a baseline. Prints the
+    ratio for every benchmark found in both of them.
+
+    Returns list of names of benchmarks whose throughput dropped more than
+    threshold (e.g. 0.1 for 10%) with respect to the baseline.
+    """
+    regressions = []
+    print("Comparison with baseline from %s (%s):" % (
+          baseline.get('time'), baseline.get('host')))
+    for name, result in sorted(results['results'].items()):
+        base = baseline['results'].get(name)
+        if base is None or not base.get('items_sec'):
+            continue
+        ratio = result['items_sec'] / base['items_sec']
+        flag = ''
+        if ratio < 1.0 - threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        print("{0:>28}: {1:12.1f} vs {2:12.1f} items/s ({3:6.2f}x) {4}".format(
+              name, result['items_sec'], base['items_sec'], ratio, flag))
+    return regressions
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks of every stage of ETL workflows, with null sinks.
+
+Items are first extracted from dump files and kept in memory, then each
+stage function is timed separately over copies of them:
+
+    - process_xml (with every parser engine)
+    - pages_to_file, revs_to_file (with every hash mode, and without text
+      cache), revs_meta_to_file
+    - pages_file_to_db, revs_file_to_db (CSV writers, with a null DB
+      connection: LOAD DATA queries are counted but not sent), with
+      background and synchronous loading of chunk files, with every
+      load mode and to Parquet datasets (if pyarrow is installed)
+    - process_logitem, logitem_to_file, logitem_file_to_db
+    - codec (serialization and compression of batches sent between
+      processes)
+
+Revision workers keep user info in the memory user store, so timings do
+not depend on a Redis server. User stores are also timed separately
+(revs_to_file with each store and export with users_file_to_db). If no
+dump files are given, synthetic ones are generated (see synth). Example:
+
+    python -m wikidat.bench.stages --pages 2000 --output stages.json \\
+        --baseline baseline-stages.json
+
+@author: jfelipe
+"""
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from wikidat.retrieval.dump import DumpFile, process_xml
+from wikidat.retrieval.page import Page, pages_to_file, pages_file_to_db
+from wikidat.retrieval.revision import (Revision, revs_to_file,
+                                        revs_meta_to_file, revs_file_to_db,
+                                        users_file_to_db, HASH_MODES)
+from wikidat.retrieval.userstore import UserStore, USER_STORES
+from wikidat.retrieval.logitem import (LogItem, process_logitem,
+                                       logitem_to_file, logitem_file_to_db)
+from wikidat.utils.comutils import get_serializer, get_compressor
+from wikidat.utils.dbutils import MySQLDB
+from wikidat.utils.loader import BulkLoad, LOAD_MODES
+from wikidat.utils import columnar
+from wikidat.bench.synth import HistoryGenerator, LoggingGenerator
+from wikidat.bench import results as bench_results
+
+ENGINES = ('lxml', 'expat')
+
+LOAD_LOCAL_RE = re.compile(r"LOAD DATA LOCAL INFILE '(.+?)'")
+
+
+class NullDB(object):
+    """
+    Stand-in for MySQLDB connections, counting queries without sending them.
+    Files of LOAD DATA LOCAL INFILE queries are read, as the client would
+    stream them to the server.
+    """
+    def __init__(self, *args, **kwargs):
+        self.queries = 0
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+    def send_query(self, query):
+        self.queries += 1
+        match = LOAD_LOCAL_RE.search(query)
+        if match is not None:
+            with open(match.group(1), 'rb') as in_file:
+                while in_file.read(1 << 16):
+                    pass
+
+    def insert_many(self, query_template, values):
+        self.queries += 1
+
+    def clone(self, local_infile=None, load_profile=None):
+        return NullDB()
+
+    # LOAD DATA queries of CSV chunks, as MySQLDB sends them
+    load_chunk = MySQLDB.load_chunk
+    chunk_encoder = MySQLDB.chunk_encoder
+
+    def load_query(self, query):
+        self.send_query(query)
+
+    def begin_load(self):
+        pass
+
+    def end_load(self):
+        pass
+
+
+def _copies(items):
+    # Stage functions modify their input items, so every run takes copies
+    return [type(item)(item) for item in items]
+
+
+def _timed(func, make_input, repeat):
+    """
+    Return (number of output items, best elapsed time of repeat runs)
+    """
+    best = None
+    count = 0
+    for run in range(repeat):
+        data = make_input()
+        start = time.time()
+        count = 0
+        for out in func(data):
+            count += 1
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count, best
+
+
+def _timed_sink(func, data, repeat, **kwargs):
+    """
+    Return best elapsed time of repeat runs of a sink function (DB loader)
+    """
+    best = None
+    for run in range(repeat):
+        start = time.time()
+        func(iter(data), **kwargs)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_history(results, path, lang, repeat, tmp_dir, engines=ENGINES):
+    """
+    Benchmark stages of RevisionHistoryETL on a pages-meta-history dump
+    """
+    for engine in engines:
+        count, elapsed = _timed(
+            lambda data: process_xml(dump_file=DumpFile(path),
+                                     parser=engine),
+            lambda: None, repeat)
+        bench_results.add_result(results, 'process_xml[%s]' % engine,
+                                 count, elapsed)
+
+    items = list(process_xml(dump_file=DumpFile(path), parser=engines[-1]))
+    pages = [item for item in items if isinstance(item, Page)]
+    revs = [item for item in items if isinstance(item, Revision)]
+
+    count, elapsed = _timed(pages_to_file, lambda: _copies(pages), repeat)
+    bench_results.add_result(results, 'pages_to_file', count, elapsed)
+
+    user_store = UserStore('memory', path=tmp_dir)
+    for hash_mode in HASH_MODES:
+        count, elapsed = _timed(
+            lambda data: revs_to_file(data, lang=lang, hash_mode=hash_mode,
+                                      user_store=user_store),
+            lambda: _copies(revs), repeat)
+        bench_results.add_result(results, 'revs_to_file[%s]' % hash_mode,
+                                 count, elapsed)
+    count, elapsed = _timed(
+        lambda data: revs_to_file(data, lang=lang, user_store=user_store,
+                                  text_cache=0),
+        lambda: _copies(revs), repeat)
+    bench_results.add_result(results, 'revs_to_file[no_text_cache]',
+                             count, elapsed)
+    count, elapsed = _timed(
+        lambda data: revs_meta_to_file(data, lang=lang,
+                                       user_store=user_store),
+        lambda: _copies(revs), repeat)
+    bench_results.add_result(results, 'revs_meta_to_file', count, elapsed)
+    rev_rows = list(revs_to_file(_copies(revs), lang=lang,
+                                 user_store=user_store))
+    page_rows = list(pages_to_file(_copies(pages)))
+
+    log_file = os.path.join(tmp_dir, 'bench.log')
+    elapsed = _timed_sink(pages_file_to_db, page_rows, repeat,
+                          con=NullDB(), log_file=log_file, tmp_dir=tmp_dir,
+                          etl_prefix='bench')
+    bench_results.add_result(results, 'pages_file_to_db', len(page_rows),
+                             elapsed)
+    elapsed = _timed_sink(revs_file_to_db, rev_rows, repeat,
+                          con=NullDB(), log_file=log_file, tmp_dir=tmp_dir,
+                          etl_prefix='bench')
+    bench_results.add_result(results, 'revs_file_to_db', len(rev_rows),
+                             elapsed)
+    elapsed = _timed_sink(revs_file_to_db, rev_rows, repeat,
+                          con=NullDB(), log_file=log_file, tmp_dir=tmp_dir,
+                          etl_prefix='bench',
+                          bulk_load=BulkLoad(max_pending=0))
+    bench_results.add_result(results, 'revs_file_to_db[sync]',
+                             len(rev_rows), elapsed)
+    for mode in LOAD_MODES[1:]:
+        elapsed = _timed_sink(revs_file_to_db, rev_rows, repeat,
+                              con=NullDB(), log_file=log_file,
+                              tmp_dir=tmp_dir, etl_prefix='bench',
+                              bulk_load=BulkLoad(mode=mode))
+        bench_results.add_result(results, 'revs_file_to_db[%s]' % mode,
+                                 len(rev_rows), elapsed)
+    if columnar.pa is not None:
+        elapsed = _timed_sink(revs_file_to_db, rev_rows, repeat,
+                              con=None, log_file=log_file, tmp_dir=tmp_dir,
+                              etl_prefix='bench',
+                              bulk_load=columnar.ParquetSink(
+                                  out_dir=os.path.join(tmp_dir, 'parquet')))
+        bench_results.add_result(results, 'revs_file_to_db[parquet]',
+                                 len(rev_rows), elapsed)
+    return rev_rows, revs
+
+
+def bench_users(results, revs, lang, repeat, tmp_dir, stores=('memory',
+                                                              'sqlite')):
+    """
+    Benchmark user stores: revs_to_file recording user info in each store,
+    and export of user info to data files (users_file_to_db, null DB).
+    Throughput of both is given in revisions per second.
+    """
+    for backend in stores:
+        user_store = UserStore(backend, path=os.path.join(tmp_dir, backend))
+
+        def run(data):
+            user_store.prepare(lang)
+            return revs_to_file(data, lang=lang, user_store=user_store)
+        count, elapsed = _timed(run, lambda: _copies(revs), repeat)
+        bench_results.add_result(results, 'user_store[%s]' % backend,
+                                 count, elapsed)
+        con = NullDB()
+        start = time.time()
+        users_file_to_db(con=con, lang=lang,
+                         log_file=os.path.join(tmp_dir, 'bench.log'),
+                         tmp_dir=tmp_dir, user_store=user_store)
+        bench_results.add_result(results, 'users_export[%s]' % backend,
+                                 len(revs), time.time() - start)
+
+
+def bench_logging(results, path, repeat, tmp_dir, engine='expat'):
+    """
+    Benchmark stages of LoggingETL on a pages-logging dump
+    """
+    logitems = [item for item in
+                process_xml(dump_file=DumpFile(path), parser=engine)
+                if isinstance(item, LogItem)]
+    count, elapsed = _timed(process_logitem, lambda: _copies(logitems),
+                            repeat)
+    bench_results.add_result(results, 'process_logitem', count, elapsed)
+    count, elapsed = _timed(logitem_to_file, lambda: _copies(logitems),
+                            repeat)
+    bench_results.add_result(results, 'logitem_to_file', count, elapsed)
+
+    log_rows = list(logitem_to_file(_copies(logitems)))
+    elapsed = _timed_sink(logitem_file_to_db, log_rows, repeat,
+                          con=NullDB(),
+                          log_file=os.path.join(tmp_dir, 'bench.log'),
+                          tmp_dir=tmp_dir, etl_prefix='bench')
+    bench_results.add_result(results, 'logitem_file_to_db', len(log_rows),
+                             elapsed)
+
+
+def bench_codec(results, rows, repeat, serializer='ujson',
+                compression='zlib', batch_size=100):
+    """
+    Benchmark encoding and decoding of batches of rows sent between
+    processes, with the given serializer and compression
+    """
+    dumps, loads = get_serializer(serializer)
+    compress, decompress = get_compressor(compression)
+    batches = [rows[pos:pos + batch_size]
+               for pos in range(0, len(rows), batch_size)]
+
+    def codec(data):
+        for batch in data:
+            payload = dumps(batch)
+            if compress is not None:
+                payload = compress(payload)
+            if decompress is not None:
+                payload = decompress(payload)
+            for item in loads(payload):
+                yield item
+
+    count, elapsed = _timed(codec, lambda: batches, repeat)
+    bench_results.add_result(results, 'codec[%s/%s]' % (serializer,
+                                                        compression),
+                             count, elapsed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('--history', metavar='FILE',
+                        help='pages-meta-history dump file')
+    parser.add_argument('--logging', metavar='FILE',
+                        help='pages-logging dump file')
+    parser.add_argument('--pages', type=int, default=1000,
+                        help='Pages of synthetic history dump')
+    parser.add_argument('--logitems', type=int, default=20000,
+                        help='Log items of synthetic logging dump')
+    parser.add_argument('--lang', default='enwiki')
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES),
+                        choices=ENGINES)
+    parser.add_argument('--user_stores', nargs='+',
+                        default=['memory', 'sqlite'], choices=USER_STORES,
+                        help='User stores to benchmark (redis needs a '
+                             'server on localhost)')
+    parser.add_argument('--serializer', default='ujson')
+    parser.add_argument('--compression', default='zlib')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs per stage (best is reported)')
+    parser.add_argument('--output', metavar='FILE',
+                        help='Write results to FILE in JSON format')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='Compare results with baseline in FILE')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Max. drop of throughput before reporting a '
+                             'regression (0.1 is 10%%)')
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp(prefix='wikidat-bench-')
+    try:
+        history = args.history
+        logging_path = args.logging
+        if history is None:
+            history = os.path.join(tmp_dir,
+                                   'synthwiki-pages-meta-history.xml.bz2')
+            HistoryGenerator(pages=args.pages).write(history)
+        if logging_path is None:
+            logging_path = os.path.join(tmp_dir,
+                                        'synthwiki-pages-logging.xml.gz')
+            LoggingGenerator(items=args.logitems).write(logging_path)
+
+        results = bench_results.new_results('stages', params=vars(args))
+        rev_rows, revs = bench_history(results, history, args.lang,
+                                       args.repeat, tmp_dir,
+                                       engines=args.engines)
+        bench_users(results, revs, args.lang, args.repeat, tmp_dir,
+                    stores=args.user_stores)
+        bench_logging(results, logging_path, args.repeat, tmp_dir)
+        bench_codec(results, rev_rows, args.repeat,
+                    serializer=args.serializer,
+                    compression=args.compression)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    if args.output:
+        bench_results.save(results, args.output)
+    if args.baseline:
+        regressions = bench_results.compare(
+            results, bench_results.load(args.baseline),
+            threshold=args.threshold)
+        if regressions:
+            sys.exit(1)
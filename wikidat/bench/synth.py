@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Generator of synthetic dump files for benchmarks.
+
+Creates pages-meta-history XML files with a long-tailed distribution of
+revisions per page (Pareto) and of text sizes (log-normal), like real
+Wikipedia dumps: most pages have a handful of revisions and short texts,
+while a few of them concentrate most of the revisions and bytes. It can
+also create pages-logging XML files with a mix of the log actions handled
+by process_logitem (blocks, new users, rights changes, reviews, etc.).
+
+Output is compressed according to the file extension (.xml, .bz2 or
+.gz). History files can also be written as bz2 multistream files with
+their offsets index (use a name like *-multistream.xml.bz2). Examples:
+
+    python -m wikidat.bench.synth history \\
+        data/synthwiki-pages-meta-history.xml.bz2 --pages 2000
+    python -m wikidat.bench.synth logging \\
+        data/synthwiki-pages-logging.xml.gz --items 50000
+
+@author: jfelipe
+"""
+import argparse
+import bz2
+import gzip
+import hashlib
+import random
+import time
+from xml.sax.saxutils import escape
+from wikidat.retrieval.revision import sha1_to_base36
+from wikidat.utils import maps
+
+NAMESPACES = {-2: 'Media', -1: 'Special', 0: '', 1: 'Talk', 2: 'User',
+              3: 'User talk', 4: 'Wikipedia', 10: 'Template',
+              14: 'Category'}
+
+# Share of pages in each namespace
+NS_WEIGHTS = {0: 0.6, 1: 0.15, 2: 0.1, 3: 0.1, 4: 0.02, 10: 0.02, 14: 0.01}
+
+WORDS = ('the', 'of', 'and', 'in', 'to', 'was', 'is', 'for', 'on', 'as',
+         'with', 'by', 'he', 'at', 'from', 'his', 'an', 'were', 'are',
+         'which', 'this', 'also', 'be', 'has', 'or', 'had', 'first', 'one',
+         'their', 'its', 'new', 'after', 'who', 'they', 'two', 'her', 'she',
+         'been', 'other', 'when', 'time', 'during', 'there', 'into',
+         'school', 'more', 'may', 'years', 'over', 'only', 'year', 'most',
+         'would', 'world', 'city', 'some', 'where', 'between', 'later',
+         'three', 'state', 'such', 'then', 'national', 'used', 'made',
+         'known', 'under', 'many', 'university', 'united', 'while', 'part',
+         'season', 'team', 'these', 'american', 'than', 'film', 'second')
+
+# Templates detected by revs_to_file for lang (FA, FLIST and GA), added
+# to a small share of revisions of articles
+TEMPLATES = ('{{Featured article}}', '{{Featured list}}', '{{Good article}}')
+
+HEADER = (u'<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" '
+          u'version="0.10" xml:lang="en">\n'
+          u'  <siteinfo>\n'
+          u'    <sitename>Synthetic Wikipedia</sitename>\n'
+          u'    <dbname>{dbname}</dbname>\n'
+          u'    <namespaces>\n{namespaces}'
+          u'    </namespaces>\n'
+          u'  </siteinfo>\n')
+FOOTER = u'</mediawiki>\n'
+
+
+def _open(path):
+    """
+    Open output file, compressed according to its extension
+    """
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'wb')
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wb')
+    return open(path, 'wb')
+
+
+def _header(dbname):
+    namespaces = u''.join(
+        u'      <namespace key="%s" case="first-letter">%s</namespace>\n' %
+        (key, escape(name)) if name else
+        u'      <namespace key="%s" case="first-letter" />\n' % key
+        for key, name in sorted(NAMESPACES.items()))
+    return HEADER.format(dbname=dbname, namespaces=namespaces)
+
+
+def _timestamp(rnd, start=1104537600, span=347155200):
+    """
+    Random ISO timestamp between 2005 and 2016
+    """
+    return time.strftime(u'%Y-%m-%dT%H:%M:%SZ',
+                         time.gmtime(start + rnd.randrange(span)))
+
+
+class HistoryGenerator(object):
+    """
+    Generates synthetic pages-meta-history dumps.
+
+    Arguments:
+        - pages = Number of pages
+        - alpha = Shape of Pareto distribution of revisions per page
+          (lower values mean longer tails)
+        - max_revs = Max. number of revisions per page
+        - text_median = Median size of revision texts (characters)
+        - text_sigma = Sigma of log-normal distribution of text sizes
+        - max_text = Max. size of revision texts (characters)
+        - anon_share = Share of revisions by anonymous editors (IPs)
+        - revert_share = Share of revisions reverting the page to the text
+          of a previous revision (reverts and vandalism cycles)
+        - users = Number of registered users
+        - seed = Seed of random generator (same seed, same dump)
+    """
+    def __init__(self, pages=1000, alpha=1.2, max_revs=5000,
+                 text_median=2000, text_sigma=1.2, max_text=500000,
+                 anon_share=0.3, revert_share=0.1, users=10000, seed=0):
+        self.pages = pages
+        self.alpha = alpha
+        self.max_revs = max_revs
+        self.text_median = text_median
+        self.text_sigma = text_sigma
+        self.max_text = max_text
+        self.anon_share = anon_share
+        self.revert_share = revert_share
+        self.users = users
+        self.rnd = random.Random(seed)
+        self.namespaces = sorted(NS_WEIGHTS)
+        self.ns_weights = [NS_WEIGHTS[ns] for ns in self.namespaces]
+        self.rev_id = 0
+
+    def num_revisions(self):
+        return min(int(self.rnd.paretovariate(self.alpha)), self.max_revs)
+
+    def text(self):
+        """
+        Random wiki text, with log-normal size
+        """
+        rnd = self.rnd
+        size = min(int(rnd.lognormvariate(0, self.text_sigma) *
+                       self.text_median), self.max_text)
+        if rnd.random() < 0.02:
+            return u'#REDIRECT [[%s]]' % rnd.choice(WORDS).title()
+        # Average word length (with separator) is about 5 characters
+        words = rnd.choices(WORDS, k=max(size // 5, 1))
+        for pos in range(0, len(words), 20):
+            words[pos] = u'[[%s]]' % words[pos]
+        if rnd.random() < 0.05:
+            words.append(rnd.choice(TEMPLATES))
+        return u' '.join(words)
+
+    def contributor(self):
+        rnd = self.rnd
+        if rnd.random() < self.anon_share:
+            return (u'<contributor><ip>%d.%d.%d.%d</ip></contributor>' %
+                    tuple(rnd.randrange(1, 255) for x in range(4)))
+        # Few users make most of the edits
+        user = min(int(rnd.paretovariate(1.0)), self.users)
+        return (u'<contributor><username>User%d</username><id>%d</id>'
+                u'</contributor>' % (user, user))
+
+    def revision(self, parent_id, text=None):
+        self.rev_id += 1
+        if text is None:
+            text = self.text()
+        encoded = text.encode('utf-8')
+        sha1 = sha1_to_base36(hashlib.sha1(encoded).hexdigest())
+        parent = (u'<parentid>%s</parentid>' % parent_id
+                  if parent_id is not None else u'')
+        minor = u'<minor />' if self.rnd.random() < 0.2 else u''
+        comment = (u'<comment>%s</comment>' % u' '.join(
+                   self.rnd.choice(WORDS) for x in range(5))
+                   if self.rnd.random() < 0.7 else u'')
+        return (u'    <revision><id>%s</id>%s<timestamp>%s</timestamp>'
+                u'%s%s%s<model>wikitext</model><format>text/x-wiki</format>'
+                u'<text xml:space="preserve" bytes="%s">%s</text>'
+                u'<sha1>%s</sha1></revision>\n' % (
+                    self.rev_id, parent, _timestamp(self.rnd),
+                    self.contributor(), minor, comment, len(encoded),
+                    escape(text), sha1))
+
+    def page(self, page_id):
+        ns = self.rnd.choices(self.namespaces, self.ns_weights)[0]
+        prefix = NAMESPACES[ns] + u':' if ns else u''
+        parts = [u'  <page><title>%sPage %s</title><ns>%s</ns><id>%s</id>\n'
+                 % (escape(prefix), page_id, ns, page_id)]
+        parent_id = None
+        texts = []
+        for rev in range(self.num_revisions()):
+            # Revert to the text before the last edit, or to one of the
+            # last 20 texts
+            if len(texts) >= 2 and self.rnd.random() < self.revert_share:
+                texts.append(texts[-2 if self.rnd.random() < 0.8 else
+                                   self.rnd.randrange(len(texts))])
+            else:
+                texts.append(self.text())
+            parts.append(self.revision(parent_id, text=texts[-1]))
+            del texts[:-20]
+            parent_id = self.rev_id
+        parts.append(u'  </page>\n')
+        return u''.join(parts)
+
+    def write(self, path, dbname='synthwiki', stream_pages=100):
+        """
+        Write dump to path. Files named *-multistream.xml.bz2 are written
+        as multistream files (stream_pages pages per bz2 stream) with
+        their offsets index. Returns number of pages and revisions.
+        """
+        if maps.MULTISTREAM_RE.search(path) is not None:
+            self._write_multistream(path, dbname, stream_pages)
+        else:
+            with _open(path) as out:
+                out.write(_header(dbname).encode('utf-8'))
+                for page_id in range(1, self.pages + 1):
+                    out.write(self.page(page_id).encode('utf-8'))
+                out.write(FOOTER.encode('utf-8'))
+        return self.pages, self.rev_id
+
+    def _write_multistream(self, path, dbname, stream_pages):
+        index = []
+        with open(path, 'wb') as out:
+            offset = out.write(bz2.compress(_header(dbname).encode('utf-8')))
+            for first in range(1, self.pages + 1, stream_pages):
+                chunk = []
+                for page_id in range(first, min(first + stream_pages,
+                                                self.pages + 1)):
+                    index.append(u'%s:%s:Page %s' % (offset, page_id,
+                                                     page_id))
+                    chunk.append(self.page(page_id))
+                offset += out.write(bz2.compress(
+                    u''.join(chunk).encode('utf-8')))
+            out.write(bz2.compress(FOOTER.encode('utf-8')))
+        index_path = maps.MULTISTREAM_RE.sub(maps.MULTISTREAM_INDEX, path)
+        with bz2.open(index_path, 'wt', encoding='utf-8') as out:
+            out.write(u'\n'.join(index) + u'\n')
+
+
+# Log actions (type, action, params) and their share of log items
+LOG_ACTIONS = [(('block', 'block', '1 week'), 0.08),
+               (('block', 'block', 'infinite'), 0.04),
+               (('block', 'unblock', ''), 0.02),
+               (('newusers', 'create', ''), 0.25),
+               (('newusers', 'autocreate', ''), 0.15),
+               (('rights', 'rights', 'autoconfirmed\nautoconfirmed,sysop'),
+                0.02),
+               (('review', 'approve', '1000\n999'), 0.04),
+               (('delete', 'delete', ''), 0.15),
+               (('protect', 'protect', ''), 0.05),
+               (('move', 'move', ''), 0.1),
+               (('upload', 'upload', ''), 0.1)]
+
+
+class LoggingGenerator(object):
+    """
+    Generates synthetic pages-logging dumps.
+
+    Arguments:
+        - items = Number of log items
+        - users = Number of registered users
+        - seed = Seed of random generator (same seed, same dump)
+    """
+    def __init__(self, items=10000, users=10000, seed=0):
+        self.items = items
+        self.users = users
+        self.rnd = random.Random(seed)
+        self.actions = [action for action, weight in LOG_ACTIONS]
+        self.weights = [weight for action, weight in LOG_ACTIONS]
+
+    def logitem(self, log_id):
+        rnd = self.rnd
+        log_type, action, params = rnd.choices(self.actions,
+                                               self.weights)[0]
+        user = min(int(rnd.paretovariate(1.0)), self.users)
+        if log_type == 'block' and rnd.random() < 0.5:
+            title = u'User:%d.%d.%d.%d' % tuple(rnd.randrange(1, 255)
+                                               for x in range(4))
+        elif log_type in ('block', 'rights', 'newusers'):
+            title = u'User:User%d' % rnd.randrange(1, self.users)
+        else:
+            title = u'Page %d' % rnd.randrange(1, 100000)
+        comment = u' '.join(rnd.choice(WORDS) for x in range(4))
+        return (u'  <logitem><id>%s</id><timestamp>%s</timestamp>'
+                u'<contributor><username>User%d</username><id>%d</id>'
+                u'</contributor><comment>%s</comment><type>%s</type>'
+                u'<action>%s</action><logtitle>%s</logtitle>'
+                u'<params xml:space="preserve">%s</params></logitem>\n' % (
+                    log_id, _timestamp(rnd), user, user, comment, log_type,
+                    action, escape(title), escape(params)))
+
+    def write(self, path, dbname='synthwiki'):
+        """
+        Write dump to path. Returns number of log items.
+        """
+        with _open(path) as out:
+            out.write(_header(dbname).encode('utf-8'))
+            for log_id in range(1, self.items + 1):
+                out.write(self.logitem(log_id).encode('utf-8'))
+            out.write(FOOTER.encode('utf-8'))
+        return self.items
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('kind', choices=['history', 'logging'])
+    parser.add_argument('path', help='Path to output dump file')
+    parser.add_argument('--pages', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=10000,
+                        help='Number of log items (logging dumps)')
+    parser.add_argument('--alpha', type=float, default=1.2,
+                        help='Shape of distribution of revisions per page')
+    parser.add_argument('--text_median', type=int, default=2000)
+    parser.add_argument('--revert_share', type=float, default=0.1,
+                        help='Share of revisions reverting to previous texts')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.kind == 'history':
+        pages, revisions = HistoryGenerator(
+            pages=args.pages, alpha=args.alpha,
+            text_median=args.text_median, revert_share=args.revert_share,
+            seed=args.seed).write(args.path)
+        print("%s: %s pages, %s revisions" % (args.path, pages, revisions))
+    else:
+        items = LoggingGenerator(items=args.items,
+                                 seed=args.seed).write(args.path)
+        print("%s: %s log items" % (args.path, items))
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Correctness check and benchmark of detection of quality templates.
+
+For every supported language, QualityDetector.detect (one scanner of all
+templates, see wikidat.retrieval.templates) must give the same FA, FLIST and GA flags
+as searching the regular expressions of maps. Both are compared on a
+corpus of texts built from the templates of all languages:
+
+    - texts with sample matches of every pattern (generated from the
+      regex itself), embedded in random text, at the start and at the end
+    - samples broken by newlines, in upper and lower case, and truncated
+    - samples without their opening or closing braces
+    - all templates of a language in the same text
+    - templates of the other languages
+    - random texts without templates (see synth), and revision texts
+      from a dump file if given
+
+Mismatches are printed and the script exits with status 1 if any is
+found. Elapsed time of both methods over the whole corpus is reported
+per language. Example:
+
+    python -m wikidat.bench.templates --history \\
+        data/furwiki-pages-meta-history.xml.7z --output templates.json
+
+@author: jfelipe
+"""
+import argparse
+import random
+import sys
+import time
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+from wikidat.utils import maps
+from wikidat.retrieval.dump import DumpFile, process_xml
+from wikidat.retrieval.templates import QualityDetector
+from wikidat.bench.synth import HistoryGenerator
+from wikidat.bench import results as bench_results
+
+LANGS = sorted(set(maps.FA_RE) & set(maps.FLIST_RE) & set(maps.GA_RE))
+
+_CATEGORIES = {sre_parse.CATEGORY_DIGIT: u'7',
+               sre_parse.CATEGORY_SPACE: u' ',
+               sre_parse.CATEGORY_WORD: u'w'}
+
+
+def _sample_class(items, rnd):
+    """
+    Return a character of a parsed character class
+    """
+    chars = []
+    for op, arg in items:
+        if op == sre_parse.NEGATE:
+            return u'\x01'
+        if op == sre_parse.LITERAL:
+            chars.append(chr(arg))
+        elif op == sre_parse.RANGE:
+            chars.append(chr(rnd.randint(arg[0], arg[1])))
+        elif op == sre_parse.CATEGORY:
+            chars.append(_CATEGORIES.get(arg, u'w'))
+    return rnd.choice(chars)
+
+
+def _sample(parsed, rnd, filler):
+    """
+    Return a string matched by a parsed regex
+    """
+    out = []
+    for op, arg in parsed:
+        if op == sre_parse.LITERAL:
+            out.append(chr(arg))
+        elif op == sre_parse.NOT_LITERAL:
+            out.append(u'\x01' if arg != 1 else u'\x02')
+        elif op == sre_parse.ANY:
+            out.append(rnd.choice(filler))
+        elif op == sre_parse.IN:
+            out.append(_sample_class(arg, rnd))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            low, high, sub = arg
+            times = rnd.randint(low, min(high, low + 3))
+            out.extend(_sample(sub, rnd, filler) for i in range(times))
+        elif op == sre_parse.SUBPATTERN:
+            out.append(_sample(arg[-1], rnd, filler))
+        elif op == sre_parse.BRANCH:
+            out.append(_sample(rnd.choice(arg[1]), rnd, filler))
+    return u''.join(out)
+
+
+def pattern_samples(pattern, rnd, count=5):
+    """
+    Return list of count strings matched by compiled regex pattern (one
+    for each alternative at least)
+    """
+    parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    fillers = (u'abc xyz', u'Q|1|2', u'{{x}} |')
+    samples = [_sample(parsed, rnd, rnd.choice(fillers))
+               for i in range(count)]
+    for op, arg in parsed:
+        if op == sre_parse.BRANCH:
+            samples.extend(_sample(alt, rnd, u'abc')
+                           for alt in arg[1])
+    return samples
+
+
+def build_corpus(seed=1, texts=200):
+    """
+    Return list of test texts for all languages
+    """
+    rnd = random.Random(seed)
+    generator = HistoryGenerator(seed=seed)
+    samples = {}
+    corpus = []
+    for lang in LANGS:
+        samples[lang] = []
+        for pattern in QualityDetector(lang).patterns:
+            if pattern is None:
+                continue
+            found = pattern_samples(pattern, rnd)
+            samples[lang].extend(found)
+            for sample in found:
+                text = generator.text()
+                middle = len(text) // 2
+                half = len(sample) // 2
+                corpus.extend([
+                    sample,
+                    u' '.join([text[:middle], sample, text[middle:]]),
+                    u'\n'.join([sample, text]),
+                    u'\n'.join([text, sample]),
+                    u'\n'.join([sample[:half], sample[half:]]),
+                    sample.upper(),
+                    sample.lower(),
+                    sample[:-1],
+                    sample[1:],
+                    u' '.join([generator.text(), sample[2:]]),
+                    u'{{ ' + sample[2:],
+                    u'{' + sample,
+                ])
+    # Templates of all patterns of a language, and of several languages
+    for lang in LANGS:
+        corpus.append(u'\n'.join([generator.text()] + samples[lang]))
+    all_samples = [s for lang in LANGS for s in samples[lang]]
+    for i in range(texts):
+        found = rnd.sample(all_samples, 3)
+        corpus.append(u' '.join([generator.text()] + found))
+        corpus.append(generator.text())
+    return corpus
+
+
+def dump_texts(path, limit=None):
+    """
+    Return list of texts of revisions in main namespace of dump file
+    """
+    texts = []
+    for item in process_xml(dump_file=DumpFile(path)):
+        if (item.get('item_type') == 'revision' and item['ns'] == '0' and
+                item['text'] is not None):
+            texts.append(item['text'])
+            if limit is not None and len(texts) >= limit:
+                break
+    return texts
+
+
+def check(corpus, langs=LANGS, results=None):
+    """
+    Compare detect and detect_regex on texts of corpus for every language.
+    Returns number of mismatches.
+    """
+    mismatches = 0
+    for lang in langs:
+        detector = QualityDetector(lang)
+        start = time.time()
+        fast = [detector.detect(text) for text in corpus]
+        fast_time = time.time() - start
+        start = time.time()
+        reference = [detector.detect_regex(text) for text in corpus]
+        regex_time = time.time() - start
+        found = 0
+        for text, flags, ref_flags in zip(corpus, fast, reference):
+            if flags != ref_flags:
+                found += 1
+                print("MISMATCH %s: detect %s, regex %s, text %r" % (
+                      lang, flags, ref_flags, text[:200]))
+        flagged = sum(any(flags) for flags in reference)
+        if results is not None:
+            bench_results.add_result(results, 'detect[%s]' % lang,
+                                     len(corpus), fast_time,
+                                     flagged=flagged, mismatches=found)
+            bench_results.add_result(results, 'regex[%s]' % lang,
+                                     len(corpus), regex_time,
+                                     flagged=flagged)
+        mismatches += found
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('--langs', nargs='+', default=LANGS, choices=LANGS,
+                        metavar='LANG', help='Languages to check (default '
+                                             'all supported languages)')
+    parser.add_argument('--history', metavar='FILE',
+                        help='Also check texts of revisions of this '
+                             'pages-meta-history dump file')
+    parser.add_argument('--limit', type=int,
+                        help='Max. number of revisions read from --history')
+    parser.add_argument('--texts', type=int, default=200,
+                        help='Number of random texts in corpus')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', metavar='FILE',
+                        help='Write results to FILE in JSON format')
+    args = parser.parse_args()
+
+    corpus = build_corpus(seed=args.seed, texts=args.texts)
+    if args.history:
+        corpus.extend(dump_texts(args.history, limit=args.limit))
+    print("Corpus of %s texts" % len(corpus))
+    results = bench_results.new_results('templates', params=vars(args))
+    mismatches = check(corpus, langs=args.langs, results=results)
+    print("%s mismatches" % mismatches)
+    if args.output:
+        bench_results.save(results, args.output)
+    if mismatches:
+        sys.exit(1)
@@ -20,6 +20,12 @@ import sys
 import time
 import json
 from wikidat.tasks import tasks
+from wikidat.utils.comutils import Transport
+from wikidat.utils.profiling import Profiling, PROFILERS
+from wikidat.retrieval.userstore import UserStore, USER_STORES
+from wikidat.utils.loader import BulkLoad, LOAD_MODES
+from wikidat.utils.dbutils import LOAD_PROFILES, get_load_profile
+from wikidat.utils.columnar import ParquetSink, PARQUET_COMPRESSIONS
 
 
 def get_config(filename='config.ini'):
@@ -63,21 +69,59 @@ def get_config(filename='config.ini'):
         opts['download_files'] = config.getboolean('General', 'download_files')
     if config.has_option('General', 'debug'):
         opts['debug'] = config.getboolean('General', 'debug')
+    if config.has_option('General', 'decomp_threads'):
+        opts['decomp_threads'] = config.getint('General', 'decomp_threads')
+    if config.has_option('General', 'batch_size'):
+        opts['batch_size'] = config.getint('General', 'batch_size')
+    if config.has_option('General', 'ring_size'):
+        opts['ring_size'] = config.getint('General', 'ring_size')
+    if config.has_option('General', 'hwm_items'):
+        opts['hwm_items'] = config.getint('General', 'hwm_items')
+    if config.has_option('General', 'sock_buffer'):
+        opts['sock_buffer'] = config.getint('General', 'sock_buffer')
+    if config.has_option('General', 'memory_budget'):
+        opts['memory_budget'] = config.getint('General', 'memory_budget')
+    if config.has_option('General', 'metrics_interval'):
+        opts['metrics_interval'] = config.getint('General', 'metrics_interval')
 
     opts_database = dict(config.items('Database'))
     if config.has_option('Database', 'port'):
         opts_database['port'] = config.getint('Database', 'port')
+    if config.has_option('Database', 'load_queue'):
+        opts_database['load_queue'] = config.getint('Database', 'load_queue')
+    if config.has_option('Database', 'load_profile'):
+        opts_database['load_profile'] = config.get('Database', 'load_profile').lower()
+    if config.has_option('Database', 'index_workers'):
+        opts_database['index_workers'] = config.getint('Database', 'index_workers')
+    if config.has_option('Database', 'index_combine'):
+        opts_database['index_combine'] = config.getboolean('Database', 'index_combine')
     opts.update(opts_database)
 
-    if config.has_section('ETL:RevHistory'):
+    # Stub-meta-history dumps (RevMeta) share options with RevHistory
+    for sec in ('ETL:RevHistory', 'ETL:RevMeta'):
+        if not config.has_section(sec):
+            continue
         opts_etl_revhist = dict()
-        sec = 'ETL:RevHistory'
         if config.has_option(sec, 'etl_lines'):
             opts_etl_revhist['etl_lines'] = config.getint(sec, 'etl_lines')
         if config.has_option(sec, 'page_fan'):
             opts_etl_revhist['page_fan'] = config.getint(sec, 'page_fan')
         if config.has_option(sec, 'rev_fan'):
             opts_etl_revhist['rev_fan'] = config.getint(sec, 'rev_fan')
+        if config.has_option(sec, 'xml_shards'):
+            opts_etl_revhist['xml_shards'] = config.getint(sec, 'xml_shards')
+        if config.has_option(sec, 'xml_parser'):
+            opts_etl_revhist['xml_parser'] = config.get(sec, 'xml_parser')
+        if config.has_option(sec, 'hash_mode'):
+            opts_etl_revhist['hash_mode'] = config.get(sec, 'hash_mode')
+        if config.has_option(sec, 'text_cache'):
+            opts_etl_revhist['text_cache'] = config.getint(sec, 'text_cache')
+        if config.has_option(sec, 'schedule'):
+            opts_etl_revhist['schedule'] = config.get(sec, 'schedule')
+        if config.has_option(sec, 'schedule_cost'):
+            opts_etl_revhist['schedule_cost'] = config.get(sec, 'schedule_cost')
+        if config.has_option(sec, 'split_size'):
+            opts_etl_revhist['split_size'] = config.getint(sec, 'split_size')
         if config.has_option(sec, 'page_cache_size'):
             opts_etl_revhist['page_cache_size'] = config.getint(sec, 'page_cache_size')
         if config.has_option(sec, 'rev_cache_size'):
@@ -92,6 +136,8 @@ def get_config(filename='config.ini'):
             opts_etl_revhist['detect_FLIST'] = config.getboolean(sec, 'detect_FLIST')
         if config.has_option(sec, 'detect_GA'):
             opts_etl_revhist['detect_GA'] = config.getboolean(sec, 'detect_GA')
+        if config.has_option(sec, 'rev_diff'):
+            opts_etl_revhist['rev_diff'] = config.getboolean(sec, 'rev_diff')
         opts.update(opts_etl_revhist)
 
     if config.has_section('ETL:PagesLogging'):
@@ -103,6 +149,8 @@ def get_config(filename='config.ini'):
             opts_etl_logging['log_fan'] = config.getint(sec, 'log_fan')
         if config.has_option(sec, 'log_cache_size'):
             opts_etl_logging['log_cache_size'] = config.getint(sec, 'log_cache_size')
+        if config.has_option(sec, 'xml_parser'):
+            opts_etl_logging['xml_parser'] = config.get(sec, 'xml_parser')
         if config.has_option(sec, 'base_ports'):
             opts_etl_logging['base_ports'] = json.loads(config.get(sec, 'base_ports'))
         if config.has_option(sec, 'control_ports'):
@@ -140,21 +188,53 @@ if __name__ == '__main__':
             'download_files': True,
             'dumps_dir': None,
             'debug': False,
+            'decompressor': 'auto',
+            'decomp_threads': None,
+            'serializer': 'ujson',
+            'compression': 'zlib',
+            'batch_size': 100,
+            'transport': 'tcp',
+            'ring_size': 64,
+            'hwm_items': 0,
+            'sock_buffer': 0,
+            'memory_budget': 0,
+            'metrics_interval': 0,
+            'profile_dir': None,
+            'user_store': 'redis',
+            'user_store_path': None,
+            'profiler': 'cprofile',
             'etl_lines': 1,
             'page_fan': 1,
             'rev_fan': 1,
             'log_fan': 1,
+            'xml_shards': 1,
+            'xml_parser': 'lxml',
+            'hash_mode': 'sha256',
+            'text_cache': 64,
+            'schedule': 'lpt',
+            'schedule_cost': 'size',
+            'split_size': 0,
             'page_cache_size': 200000,
             'rev_cache_size': 1000000,
             'log_cache_size': 1000000,
             'db_user': 'auser',
             'db_passw': 'apassw',
             'db_engine': 'ARIA',
+            'load_mode': 'file',
+            'load_dir': None,
+            'load_queue': 1,
+            'load_profile': 'none',
+            'sink': 'mysql',
+            'parquet_dir': None,
+            'parquet_compression': 'zstd',
+            'index_workers': 4,
+            'index_combine': False,
             'base_ports': 10000,
             'control_ports': 11000,
             'detect_FA': True,
             'detect_FLIST': True,
-            'detect_GA': True
+            'detect_GA': True,
+            'rev_diff': False
             }
     # If some options are overridden by config file, update them
     if args.conf_file:
@@ -202,6 +282,92 @@ if __name__ == '__main__':
     parser.add_argument('--no_download_files', dest='download_files',
                         action='store_false',
                         help=''.join(['Skip download of dump files.']))
+    parser.add_argument('--decompressor', metavar='TOOL',
+                        help=''.join(['Tool to decompress dump files: ',
+                                      '"auto" (parallel tools like lbzip2, ',
+                                      'pbzip2, pigz or xz if installed), ',
+                                      '"python" (in-process) or the name ',
+                                      'of an installed tool.'])
+                        )
+    parser.add_argument('--decomp_threads', type=int, metavar='NUM_THREADS',
+                        help=''.join(['Number of threads for parallel ',
+                                      'decompression tools (defaults to ',
+                                      'number of CPUs).'])
+                        )
+    parser.add_argument('--serializer', choices=['ujson', 'msgpack', 'pickle'],
+                        help=''.join(['Serializer of items sent between ',
+                                      'processes.'])
+                        )
+    parser.add_argument('--compression',
+                        choices=['zlib', 'lz4', 'zstd', 'none'],
+                        help=''.join(['Compression of data frames sent ',
+                                      'between processes. Use "none" ',
+                                      'for local runs.'])
+                        )
+    parser.add_argument('--batch_size', type=int, metavar='NUM_ITEMS',
+                        help=''.join(['Max. number of items sent in each ',
+                                      'data frame between processes.'])
+                        )
+    parser.add_argument('--transport', choices=['tcp', 'ipc', 'shm'],
+                        help=''.join(['Transport of channels between ',
+                                      'processes: TCP on localhost, ',
+                                      'Unix domain sockets (ipc) or shared ',
+                                      'memory ring buffers (shm).'])
+                        )
+    parser.add_argument('--ring_size', type=int, metavar='MB',
+                        help=''.join(['Size in MB of each shared memory ',
+                                      'ring buffer (shm transport).'])
+                        )
+    parser.add_argument('--hwm_items', type=int, metavar='ITEMS',
+                        help=''.join(['Max. number of items queued on each ',
+                                      'side of channels between processes ',
+                                      '(tcp and ipc transports). 0 keeps ',
+                                      'ZMQ default.'])
+                        )
+    parser.add_argument('--sock_buffer', type=int, metavar='BYTES',
+                        help=''.join(['Size of kernel socket buffers of ',
+                                      'channels between processes (tcp and ',
+                                      'ipc transports). It does not bound ',
+                                      'items queued by ZMQ. 0 keeps OS ',
+                                      'default.'])
+                        )
+    parser.add_argument('--memory_budget', type=int, metavar='MB',
+                        help=''.join(['Memory budget of all processes of ',
+                                      'each task. XML readers are paused ',
+                                      'while it is exceeded. 0 disables ',
+                                      'the memory governor.'])
+                        )
+    parser.add_argument('--metrics_interval', type=int, metavar='SECONDS',
+                        help=''.join(['Seconds between updates of metrics ',
+                                      'of all processes in ETL lines ',
+                                      '(items/s, bytes/s, queued items, ',
+                                      'stall time), written as JSON and ',
+                                      'Prometheus text files in the logs ',
+                                      'dir. 0 disables metrics.'])
+                        )
+    parser.add_argument('--user_store', choices=USER_STORES,
+                        help=''.join(['Store of user info collected from ',
+                                      'revisions: Redis server on ',
+                                      'localhost, in-process memory of ',
+                                      'each worker (merged at the end) or ',
+                                      'embedded SQLite file.'])
+                        )
+    parser.add_argument('--user_store_path', metavar='DIR',
+                        help=''.join(['Directory of files of memory and ',
+                                      'sqlite user stores (defaults to tmp ',
+                                      'dir of dump files).'])
+                        )
+    parser.add_argument('--profile_dir', metavar='DIR',
+                        help=''.join(['Profile all processes in ETL lines, ',
+                                      'writing one file per process to DIR ',
+                                      '(combine them per stage with ',
+                                      'wikidat.tools.profmerge).'])
+                        )
+    parser.add_argument('--profiler', choices=PROFILERS,
+                        help=''.join(['Profiler of processes: cprofile ',
+                                      '(pstats files) or sample (collapsed ',
+                                      'stacks, for flame graphs).'])
+                        )
     parser.add_argument('--etl_lines', type=int, metavar='NUM_ETL_LINES',
                         help=''.join(['Number of ETL processing lines to be ',
                                       'executed. More lines could be added ',
@@ -216,6 +382,49 @@ if __name__ == '__main__':
                         help=''.join(['Number of worker processes to deal with ',
                                       'revision elements in each ETL line.'])
                         )
+    parser.add_argument('--xml_shards', type=int, metavar='NUM_XML_READERS',
+                        help=''.join(['Number of XML reader processes to ',
+                                      'decompress and parse each bz2 ',
+                                      'multistream dump file in parallel ',
+                                      '(requires its -index.txt.bz2 file). ',
+                                      'Up to 9 readers per ETL line.'])
+                        )
+    parser.add_argument('--xml_parser', choices=['lxml', 'expat'],
+                        help=''.join(['XML parser engine to read dump files. ',
+                                      'The expat engine is a faster path ',
+                                      'based on start/end callbacks.'])
+                        )
+    parser.add_argument('--hash_mode', choices=['sha256', 'sha1', 'sha1_hex'],
+                        help=''.join(['Hash of revision text stored in ',
+                                      'revision_hash. The sha1 modes reuse ',
+                                      'the SHA-1 provided by dump files ',
+                                      '(base36 or hex) instead of hashing ',
+                                      'every text.'])
+                        )
+    parser.add_argument('--text_cache', type=int,
+                        help=''.join(['Max. number of distinct texts of ',
+                                      'each page whose length, redirect, ',
+                                      'FA/FLIST/GA flags and hash are ',
+                                      'cached by revision workers ',
+                                      '(reverts). 0 disables the cache.'])
+                        )
+    parser.add_argument('--schedule', choices=['lpt', 'fifo'],
+                        help=''.join(['Order of dump files taken by ETL ',
+                                      'lines: lpt (largest first, avoids ',
+                                      'straggler lines) or fifo.'])
+                        )
+    parser.add_argument('--schedule_cost', choices=['size', 'index'],
+                        help=''.join(['Estimated cost of dump files for ',
+                                      'scheduling: compressed size or ',
+                                      'number of pages in the index of ',
+                                      'multistream files.'])
+                        )
+    parser.add_argument('--split_size', type=int, metavar='MB',
+                        help=''.join(['Split bz2 multistream dump files ',
+                                      'larger than this size (MB) in ',
+                                      'several work items. 0 disables ',
+                                      'splitting.'])
+                        )
     parser.add_argument('--log_fan', type=int, metavar='NUM_LOG_WORKERS',
                         help=''.join(['Number of worker processes to deal with ',
                                       'revision elements in each ETL line.'])
@@ -249,6 +458,69 @@ if __name__ == '__main__':
                                       'locally. Currently, only ARIA or ',
                                       'MyISAM engines are supported.'])
                         )
+    parser.add_argument('--load_mode', choices=LOAD_MODES,
+                        help=''.join(['Bulk loading of rows in local DB: ',
+                                      'chunk files read by the DB server, ',
+                                      'chunk files streamed by the client ',
+                                      '(local) or in-memory chunks streamed ',
+                                      'through named pipes (fifo). Local ',
+                                      'modes need local_infile enabled in ',
+                                      'the DB server.'])
+                        )
+    parser.add_argument('--load_dir', metavar='DIR',
+                        help=''.join(['Staging dir of chunk files and ',
+                                      'named pipes, e.g. a tmpfs such as ',
+                                      '/dev/shm (defaults to tmp dir of ',
+                                      'dump files).'])
+                        )
+    parser.add_argument('--load_queue', type=int,
+                        help=''.join(['Max. num. of chunk files of each ',
+                                      'table waiting to be loaded in local ',
+                                      'DB while the next ones are written. ',
+                                      '0 loads them synchronously.'])
+                        )
+    parser.add_argument('--sink', choices=['mysql', 'postgresql', 'parquet'],
+                        help=''.join(['Output of ETL workflows: tables in ',
+                                      'local DB (mysql, or postgresql with ',
+                                      'binary COPY, requires psycopg2) or ',
+                                      'Parquet datasets (parquet, requires ',
+                                      'pyarrow), with no DB server needed.'])
+                        )
+    parser.add_argument('--parquet_dir', metavar='DIR',
+                        help=''.join(['Directory of Parquet datasets, one ',
+                                      'per table (defaults to dir parquet ',
+                                      'in dir of dump files).'])
+                        )
+    parser.add_argument('--parquet_compression',
+                        choices=PARQUET_COMPRESSIONS,
+                        help=''.join(['Compression codec of Parquet ',
+                                      'files.'])
+                        )
+    parser.add_argument('--load_profile', choices=sorted(LOAD_PROFILES),
+                        type=str.lower,
+                        help=''.join(['Settings of DB sessions loading ',
+                                      'data (e.g. skip unique checks, larger ',
+                                      'sort buffers), restored afterwards. ',
+                                      'Use the profile of DB_ENGINE. Global ',
+                                      'settings of innodb need admin ',
+                                      'privileges. Binary logging is ',
+                                      'turned off if privileges allow it.'])
+                        )
+    parser.add_argument('--index_workers', type=int,
+                        help=''.join(['Num. of tables whose primary keys ',
+                                      'and indexes are built at once, on ',
+                                      'separate DB connections, after ',
+                                      'loading all data.'])
+                        )
+    parser.add_argument('--index_combine', dest='index_combine',
+                        action='store_true',
+                        help=''.join(['Build all indexes of each table in ',
+                                      'a single ALTER TABLE (tables are ',
+                                      'rebuilt once with ARIA or MyISAM).']))
+    parser.add_argument('--no_index_combine', dest='index_combine',
+                        action='store_false',
+                        help=''.join(['Build each index in its own ',
+                                      'ALTER TABLE, reporting its time.']))
     parser.add_argument('--base_ports', nargs='+', type=int,
                         help=''.join(['List of base port numbers to be ',
                                       'used by each ETL line. Communication ',
@@ -288,6 +560,16 @@ if __name__ == '__main__':
                         action='store_false',
                         help=''.join(['Skip detection of revisions of ',
                                       'Good Articles.']))
+    parser.add_argument('--rev_diff', dest='rev_diff', action='store_true',
+                        help=''.join(['Lines and bytes added and removed ',
+                                      'by every revision will be stored ',
+                                      'in revision_diff (off by default, ',
+                                      'it costs CPU time in revision ',
+                                      'workers and sends all revisions ',
+                                      'of a page to the same worker).']))
+    parser.add_argument('--no_rev_diff', dest='rev_diff',
+                        action='store_false',
+                        help=''.join(['Skip diffs of revisions.']))
     # Finally, any option directly specified on the command-line will
     # override previous values assigned to any argument
     args = parser.parse_args(remain_args)
@@ -300,6 +582,34 @@ if __name__ == '__main__':
 
     # TODO: Control for incompatible combinations of command-line arguments
 
+    # Settings of communication channels between processes in ETL lines
+    transport = Transport(serializer=args.serializer,
+                          compression=args.compression,
+                          batch_size=args.batch_size,
+                          transport=args.transport,
+                          ring_size=args.ring_size,
+                          hwm_items=args.hwm_items,
+                          sock_buffer=args.sock_buffer)
+
+    # Store of user info collected by revision workers
+    user_store = UserStore(backend=args.user_store,
+                           path=args.user_store_path)
+
+    # Bulk loading of rows in local DB, or Parquet datasets
+    db_backend = 'postgresql' if args.sink == 'postgresql' else 'mysql'
+    if args.sink == 'parquet':
+        bulk_load = ParquetSink(out_dir=args.parquet_dir,
+                                compression=args.parquet_compression)
+    else:
+        bulk_load = BulkLoad(mode=args.load_mode, staging_dir=args.load_dir,
+                             max_pending=args.load_queue,
+                             profile=get_load_profile(args.load_profile).name)
+
+    # Optional profiling of processes in ETL lines
+    profiling = None
+    if args.profile_dir:
+        profiling = Profiling(args.profile_dir, profiler=args.profiler)
+
     if 'ETL:RevHistory' in opts['tool_secs']:
         # Testing with default options:
         #   - lang: 'scowiki'
@@ -310,7 +620,8 @@ if __name__ == '__main__':
                                     host=args.host, port=args.port,
                                     db_name=args.db_name, db_user=args.db_user,
                                     db_passw=args.db_passw,
-                                    db_engine=args.db_engine)
+                                    db_engine=args.db_engine,
+                                    db_backend=db_backend)
 
         task.execute(page_fan=args.page_fan, rev_fan=args.rev_fan,
                      page_cache_size=args.page_cache_size,
@@ -319,10 +630,59 @@ if __name__ == '__main__':
                      base_ports=args.base_ports,
                      control_ports=args.control_ports,
                      dumps_dir=args.dumps_dir,
-                     debug=args.debug)
+                     debug=args.debug,
+                     xml_shards=args.xml_shards,
+                     xml_parser=args.xml_parser,
+                     decompressor=args.decompressor,
+                     decomp_threads=args.decomp_threads,
+                     hash_mode=args.hash_mode,
+                     transport=transport,
+                     schedule_policy=args.schedule,
+                     schedule_cost=args.schedule_cost,
+                     split_size=args.split_size * 1024 * 1024,
+                     metrics_interval=args.metrics_interval,
+                     profiling=profiling,
+                     memory_budget=args.memory_budget,
+                     user_store=user_store,
+                     text_cache=args.text_cache,
+                     rev_diff=args.rev_diff,
+                     bulk_load=bulk_load,
+                     index_workers=args.index_workers,
+                     index_combine=args.index_combine)
 
     if 'ETL:RevMeta' in opts['tool_secs']:
-        pass
+        task = tasks.RevMetaTask(lang=args.lang,
+                                 date=args.date,
+                                 etl_lines=args.etl_lines,
+                                 host=args.host, port=args.port,
+                                 db_name=args.db_name, db_user=args.db_user,
+                                 db_passw=args.db_passw,
+                                 db_engine=args.db_engine,
+                                 db_backend=db_backend)
+
+        task.execute(page_fan=args.page_fan, rev_fan=args.rev_fan,
+                     page_cache_size=args.page_cache_size,
+                     rev_cache_size=args.rev_cache_size,
+                     mirror=args.mirror, download_files=args.download_files,
+                     base_ports=args.base_ports,
+                     control_ports=args.control_ports,
+                     dumps_dir=args.dumps_dir,
+                     debug=args.debug,
+                     xml_parser=args.xml_parser,
+                     decompressor=args.decompressor,
+                     decomp_threads=args.decomp_threads,
+                     hash_mode=args.hash_mode,
+                     transport=transport,
+                     schedule_policy=args.schedule,
+                     schedule_cost=args.schedule_cost,
+                     split_size=args.split_size * 1024 * 1024,
+                     metrics_interval=args.metrics_interval,
+                     profiling=profiling,
+                     memory_budget=args.memory_budget,
+                     user_store=user_store,
+                     bulk_load=bulk_load,
+                     index_workers=args.index_workers,
+                     index_combine=args.index_combine)
 
     if 'ETL:PagesLogging' in opts['tool_secs']:
         # Testing with default options:
@@ -335,7 +695,8 @@ if __name__ == '__main__':
                                       db_name=args.db_name,
                                       db_user=args.db_user,
                                       db_passw=args.db_passw,
-                                      db_engine=args.db_engine)
+                                      db_engine=args.db_engine,
+                                      db_backend=db_backend)
 
         task.execute(log_fan=args.log_fan,
                      log_cache_size=args.log_cache_size,
@@ -343,7 +704,17 @@ if __name__ == '__main__':
                      base_ports=args.base_ports,
                      control_ports=args.control_ports,
                      dumps_dir=args.dumps_dir,
-                     debug=args.debug)
+                     debug=args.debug,
+                     xml_parser=args.xml_parser,
+                     decompressor=args.decompressor,
+                     decomp_threads=args.decomp_threads,
+                     transport=transport,
+                     metrics_interval=args.metrics_interval,
+                     profiling=profiling,
+                     memory_budget=args.memory_budget,
+                     bulk_load=bulk_load,
+                     index_workers=args.index_workers,
+                     index_combine=args.index_combine)
 
     if 'ETL:SQLDumps' in opts['tool_secs']:
         task = tasks.SQLDumpsTask(lang=args.lang, date=args.date,
@@ -351,7 +722,8 @@ if __name__ == '__main__':
                                   db_name=args.db_name,
                                   db_user=args.db_user,
                                   db_passw=args.db_passw,
-                                  db_engine=args.db_engine)
+                                  db_engine=args.db_engine,
+                                  db_backend=db_backend)
 
         task.execute(mirror=args.mirror, download_files=args.download_files,
                      dumps_dir=args.dumps_dir,
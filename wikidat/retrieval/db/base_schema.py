@@ -134,6 +134,39 @@ create_revision_hash = """CREATE TABLE revision_hash (
                           ENGINE {engine!s}
                           """
 
+# TABLE revision_diff: lines and bytes added and removed by every revision
+"""
+rev_id:
+  - Unique id for every revision
+
+rev_page:
+  -- Key to page_id. This should _never_ be invalid.
+
+rev_prev:
+  -- rev_id of the previous revision of the page in the dump, compared with
+  -- this one (0 for the first revision, compared with an empty text)
+
+lines_added, lines_removed:
+  -- Number of lines added and removed (lines moved within the text are
+  -- not counted)
+
+bytes_added, bytes_removed:
+  -- Size in bytes of lines added and removed, without line breaks
+
+"""
+drop_revision_diff = """DROP TABLE IF EXISTS revision_diff"""
+create_revision_diff = """CREATE TABLE revision_diff (
+                          rev_id INT UNSIGNED NOT NULL,
+                          rev_page INT UNSIGNED NOT NULL,
+                          rev_prev INT UNSIGNED NOT NULL default '0',
+                          lines_added INT UNSIGNED NOT NULL default '0',
+                          lines_removed INT UNSIGNED NOT NULL default '0',
+                          bytes_added INT UNSIGNED NOT NULL default '0',
+                          bytes_removed INT UNSIGNED NOT NULL default '0'
+                          ) MAX_ROWS=100000000000 AVG_ROW_LENGTH=32
+                          ENGINE {engine!s}
+                          """
+
 # TABLE namespaces: identifiers of MediaWiki namespaces
 # http://www.mediawiki.org/wiki/Namespaces
 """
@@ -283,17 +316,30 @@ create_IP_country = """CREATE TABLE IP_country (
                         """
 insert_namespaces = """INSERT INTO namespaces VALUES(%s, %s)"""
 
-pk_page = """ALTER TABLE page ADD PRIMARY KEY page_id(page_id)"""
-pk_revision = """ALTER TABLE revision ADD PRIMARY KEY rev_id(rev_id)"""
-pk_namespaces = """ALTER TABLE namespaces ADD PRIMARY KEY code(code)"""
-pk_user = """ALTER TABLE user ADD PRIMARY KEY user_id(user_id)"""
-pk_logging = """ALTER TABLE logging ADD PRIMARY KEY log_id(log_id)"""
-pk_block = """ALTER TABLE block ADD PRIMARY KEY block_id(block_id)"""
-pk_user_new = """ALTER TABLE user_new ADD PRIMARY KEY
-                 user_log_id(user_log_id)"""
-pk_user_level = """ALTER TABLE user_level ADD PRIMARY KEY
-                   level_log_id(level_log_id)"""
-pk_revision_IP = """ALTER TABLE revision_IP ADD PRIMARY KEY rev_id(rev_id)"""
-pk_revision_user_zero = """ALTER TABLE revision_user_zero
-                           ADD PRIMARY KEY rev_id(rev_id)"""
-pk_IP_country = """ALTER TABLE IP_country ADD PRIMARY KEY ip(ip)"""
+table_sizes = """SELECT table_name, data_length FROM information_schema.tables
+                 WHERE table_schema = DATABASE()"""
+
+# Index plans: indexes built after data loading, as tuples (table, index,
+# columns). Index PRIMARY is the primary key of the table. Tables are
+# built concurrently, largest first (see utils.indexes.IndexBuilder)
+index_plan_revhist = [
+    ('revision', 'PRIMARY', 'rev_id'),
+    ('revision', 'rev_page', 'rev_page'),
+    ('revision', 'rev_user', 'rev_user'),
+    ('revision', 'rev_timestamp', 'rev_timestamp'),
+    ('revision_hash', 'PRIMARY', 'rev_id'),
+    ('page', 'PRIMARY', 'page_id'),
+    ('page', 'page_namespace', 'page_namespace'),
+    ('revision_diff', 'PRIMARY', 'rev_id'),
+    ('revision_IP', 'PRIMARY', 'rev_id'),
+    ('user', 'PRIMARY', 'user_id'),
+    ('namespaces', 'PRIMARY', 'code'),
+    ('IP_country', 'PRIMARY', 'ip'),
+]
+
+index_plan_logitem = [
+    ('logging', 'PRIMARY', 'log_id'),
+    ('block', 'PRIMARY', 'block_id'),
+    ('user_new', 'PRIMARY', 'user_log_id'),
+    ('user_level', 'PRIMARY', 'level_log_id'),
+]
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+PostgreSQL equivalent of base_schema, with the same tables and columns
+(see base_schema for the description of every column).
+
+Tables are defined by their columns in TABLES, so that CREATE TABLE
+statements and encoders of binary COPY chunks (utils.pgutils.CopyEncoder)
+share the same types. MySQL types are mapped as follows:
+
+    - INT -> integer, INT UNSIGNED -> bigint (revision ids of large wikis
+      exceed the range of integer)
+    - SMALLINT and TINYINT -> smallint
+    - DATETIME -> timestamp (without time zone)
+    - DECIMAL -> double precision
+    - VARCHAR, TEXT, TINYBLOB and varbinary -> text
+
+Table names are always quoted in lower case ("user" is a reserved word),
+so revision_IP and IP_country become revision_ip and ip_country. Tables
+are created without indexes and NOT NULL columns take the default of
+their type (0 or ''), as MySQL does when loading NULL values in them.
+Timestamps are nullable, zero or missing dates are loaded as NULL.
+"""
+from wikidat.retrieval.db import base_schema as bs
+
+check_database = """SELECT datname FROM pg_database
+                    WHERE datname = '{dbname!s}'"""
+
+drop_database = """DROP DATABASE IF EXISTS "{dbname!s}" """
+create_database = """CREATE DATABASE "{dbname!s}"
+                     ENCODING 'UTF8' TEMPLATE template0
+                     """
+
+# Columns of every table, as (name, type, not null)
+TABLES = {
+    'page': [('page_id', 'bigint', True),
+             ('page_namespace', 'smallint', True),
+             ('page_title', 'text', True),
+             ('page_restrictions', 'text', True)],
+    'revision': [('rev_id', 'bigint', True),
+                 ('rev_page', 'bigint', True),
+                 ('rev_user', 'integer', True),
+                 ('rev_timestamp', 'timestamp', False),
+                 ('rev_len', 'bigint', True),
+                 ('rev_parent_id', 'bigint', False),
+                 ('rev_is_redirect', 'smallint', True),
+                 ('rev_minor_edit', 'smallint', True),
+                 ('rev_fa', 'smallint', True),
+                 ('rev_flist', 'smallint', True),
+                 ('rev_ga', 'smallint', True),
+                 ('rev_comment', 'text', True)],
+    'revision_hash': [('rev_id', 'bigint', True),
+                      ('rev_page', 'bigint', True),
+                      ('rev_user', 'integer', True),
+                      ('rev_hash', 'text', True)],
+    'revision_diff': [('rev_id', 'bigint', True),
+                      ('rev_page', 'bigint', True),
+                      ('rev_prev', 'bigint', True),
+                      ('lines_added', 'bigint', True),
+                      ('lines_removed', 'bigint', True),
+                      ('bytes_added', 'bigint', True),
+                      ('bytes_removed', 'bigint', True)],
+    'namespaces': [('code', 'smallint', True),
+                   ('name', 'text', True)],
+    'user': [('user_id', 'integer', True),
+             ('user_name', 'text', False)],
+    'logging': [('log_id', 'bigint', True),
+                ('log_type', 'text', True),
+                ('log_action', 'text', True),
+                ('log_timestamp', 'timestamp', False),
+                ('log_user', 'bigint', True),
+                ('log_username', 'text', True),
+                ('log_namespace', 'integer', True),
+                ('log_title', 'text', True),
+                ('log_comment', 'text', True),
+                ('log_params', 'text', True),
+                ('log_new_flag', 'bigint', True),
+                ('log_old_flag', 'bigint', True)],
+    'block': [('block_id', 'bigint', True),
+              ('block_action', 'text', True),
+              ('block_user', 'bigint', True),
+              ('block_timestamp', 'timestamp', False),
+              ('block_target', 'text', False),
+              ('block_ip', 'bigint', True),
+              ('block_duration', 'double precision', True)],
+    'user_new': [('user_log_id', 'bigint', True),
+                 ('user_id', 'bigint', True),
+                 ('user_name', 'text', True),
+                 ('user_timestamp', 'timestamp', False),
+                 ('user_action', 'text', True)],
+    'user_level': [('level_log_id', 'bigint', True),
+                   ('level_granter_id', 'bigint', True),
+                   ('level_username', 'text', True),
+                   ('level_timestamp', 'timestamp', False),
+                   ('level_old', 'text', True),
+                   ('level_new', 'text', True)],
+    'revision_IP': [('rev_id', 'bigint', True),
+                    ('ip', 'bigint', True)],
+    'revision_user_zero': [('rev_id', 'bigint', True),
+                           ('user_name', 'text', True)],
+    'IP_country': [('ip', 'bigint', True),
+                   ('country', 'text', True)],
+}
+
+# Tables created for each type of dump, in the same order as in MySQLDB
+TABLES_REVHIST = ['page', 'revision', 'revision_hash', 'revision_diff',
+                  'namespaces', 'user', 'revision_IP', 'revision_user_zero',
+                  'IP_country']
+TABLES_LOGITEM = ['logging', 'block', 'user_new', 'user_level']
+
+# Defaults of NOT NULL columns, by type
+DEFAULTS = {'smallint': "0", 'integer': "0", 'bigint': "0",
+            'double precision': "0", 'text': "''"}
+
+
+def quote(name):
+    """
+    Return quoted name of table, in lower case
+    """
+    return '"%s"' % name.lower()
+
+
+def drop_table(table):
+    return """DROP TABLE IF EXISTS %s""" % quote(table)
+
+
+def create_table(table):
+    columns = []
+    for name, kind, not_null in TABLES[table]:
+        if not_null:
+            columns.append('%s %s NOT NULL DEFAULT %s' % (name, kind,
+                                                           DEFAULTS[kind]))
+        else:
+            columns.append('%s %s' % (name, kind))
+    return """CREATE TABLE %s (
+              %s
+              )""" % (quote(table), ',\n              '.join(columns))
+
+
+copy_stdin = """COPY %s FROM STDIN WITH (FORMAT binary)"""
+copy_file = """COPY %s FROM '%s' WITH (FORMAT binary)"""
+
+insert_namespaces = bs.insert_namespaces
+
+table_sizes = """SELECT c.relname, pg_relation_size(c.oid)
+                 FROM pg_class c
+                 JOIN pg_namespace n ON n.oid = c.relnamespace
+                 WHERE c.relkind = 'r' AND n.nspname = current_schema()"""
+
+# Index plans are the same as in MySQL (base_schema.index_plan_revhist)
+index_plan_revhist = bs.index_plan_revhist
+index_plan_logitem = bs.index_plan_logitem
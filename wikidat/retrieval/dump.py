@@ -5,41 +5,152 @@ Created on Sat Mar 29 22:13:19 2014
 @author: jfelipe
 """
 from lxml import etree
+from xml.parsers import expat
 import subprocess
+import tempfile
+import logging
+import shutil
+import bz2
+import gzip
+import lzma
+import sys
 import os
 from .page import Page
 from .revision import Revision
 from .logitem import LogItem
-from wikidat.utils import maps
+from wikidat.utils import maps, misc
 
 
 class DumpFile(object):
     """
     Models dump files and associated methods to extract their data
+
+    decompressor selects how compressed files are read: 'auto' prefers
+    parallel tools (lbzip2, pbzip2, pigz, xz -T) if they are installed and
+    falls back to in-process streams, 'python' always decompresses
+    in-process and any other value names the tool to use. Threads sets the
+    number of threads for parallel tools (defaults to number of CPUs).
     """
-    def __init__(self, path):
+    def __init__(self, path, decompressor='auto', threads=None):
         self.path = path
+        self.decompressor = decompressor
+        self.threads = threads
+        self.index_path = self._find_index()
+        self._streams = None
+
+    def _find_index(self):
+        """
+        Return path to the offsets index of a bz2 multistream dump file,
+        or None if this is not a multistream file or the index is missing
+        """
+        if maps.MULTISTREAM_RE.search(self.path) is None:
+            return None
+        index_path = maps.MULTISTREAM_RE.sub(maps.MULTISTREAM_INDEX,
+                                             self.path)
+        if os.path.isfile(index_path):
+            return index_path
+        return None
+
+    def is_multistream(self):
+        """
+        True if this is a bz2 multistream dump file with an offsets index
+        """
+        return self.index_path is not None
+
+    def index_streams(self):
+        """
+        Read the offsets index of a multistream dump file. Each line in the
+        index has the form offset:page_id:title, and all pages packed in the
+        same bz2 stream share the same offset.
+
+        Returns list of (offset, num_pages) of every bz2 stream with page
+        elements, in file order. The index is read only once for each
+        DumpFile object (it is not kept when it is pickled).
+        """
+        if self._streams is None:
+            streams = []
+            with bz2.open(self.index_path, 'rt', encoding='utf-8') as index:
+                for line in index:
+                    offset = int(line.split(':', 1)[0])
+                    if streams and streams[-1][0] == offset:
+                        streams[-1][1] += 1
+                    else:
+                        streams.append([offset, 1])
+            self._streams = [tuple(stream) for stream in streams]
+        return self._streams
+
+    def stream_offsets(self):
+        """
+        Returns the sorted list of distinct byte offsets of all streams with
+        page elements (see index_streams).
+        """
+        return [offset for offset, pages in self.index_streams()]
 
-    def open_dump(self):
+    def header_end(self):
+        """
+        Return offset of the first stream with page elements, i.e. the end
+        of the stream with the siteinfo header, reading only the first line
+        of the offsets index if it was not read yet
+        """
+        if self._streams is not None:
+            return self._streams[0][0]
+        with bz2.open(self.index_path, 'rt', encoding='utf-8') as index:
+            return int(index.readline().split(':', 1)[0])
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_streams'] = None
+        return state
+
+    def get_shards(self, num_shards, byte_range=None):
+        """
+        Split a multistream dump file into (at most) num_shards byte ranges
+        of similar size, always cutting on bz2 stream boundaries.
+
+        Returns a list of (start, end) tuples. The last range extends up to
+        the end of file (end is None), so that it also includes the closing
+        stream of the dump.
+
+        If byte_range (start, end) is given, only that part of the file is
+        split, and the last range ends at its end.
+        """
+        offsets = self.stream_offsets()
+        range_end = None
+        if byte_range is not None:
+            range_start, range_end = byte_range
+            offsets = [offset for offset in offsets
+                       if offset >= range_start and
+                       (range_end is None or offset < range_end)]
+        if range_end is None:
+            range_end = os.path.getsize(self.path)
+        shard_size = (range_end - offsets[0]) / num_shards
+        shards = []
+        start = offsets[0]
+        for offset in offsets[1:]:
+            if len(shards) == num_shards - 1:
+                break
+            if offset - start >= shard_size:
+                shards.append((start, offset))
+                start = offset
+        shards.append((start, byte_range[1] if byte_range else None))
+        return shards
+
+    def open_dump(self, byte_range=None):
         """
         Turns a path to a dump file into a file-like object of (decompressed)
         XML data.
 
         :Parameters:
-            path : `str`
-                the path to the dump file to read
-        """
-        match = maps.EXT_RE.search(self.path)
-        ext = match.groups()[0]
-        p = subprocess.Popen(
-            "%s %s" % (maps.EXTENSIONS[ext], self.path),
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=open(os.devnull, "w")
-        )
-        # sys.stderr.write(p.stdout.read(1000))
-        # return False
-        return p.stdout
+            byte_range : `tuple`
+                (start, end) offsets of a range of bz2 streams to read from
+                a multistream dump file. If None, read the whole file.
+        """
+        if byte_range is not None:
+            return MultistreamReader(self.path, byte_range,
+                                     header_end=self.header_end())
+
+        return DecompressedStream(self.path, method=self.decompressor,
+                                  threads=self.threads)
 
     def get_namespaces(self):
         in_stream = self.open_dump()
@@ -55,11 +166,246 @@ class DumpFile(object):
                 return ns_dict
 
 
-def process_xml(dump_file=None):
+def find_decompressor(ext, method='auto', threads=None):
+    """
+    Return command line (list of args) of the preferred tool available to
+    decompress files with extension ext, or None to decompress in-process.
+    """
+    if ext == 'xml' or method == 'python':
+        return None
+    threads = str(threads or os.cpu_count() or 1)
+    for cmd in maps.DECOMPRESSORS.get(ext, []):
+        if method not in ('auto', cmd[0]):
+            continue
+        if shutil.which(cmd[0]) is not None:
+            return [arg.replace('{threads}', threads) for arg in cmd]
+    if method != 'auto':
+        raise RuntimeError('Decompressor %s not available for .%s files' % (
+                           method, ext))
+    return None
+
+
+class DecompressedStream(object):
+    """
+    File-like object with the decompressed data of a dump file, read either
+    from an external tool (see find_decompressor) or in-process with bz2,
+    gzip or lzma modules. Errors reported by external tools are logged.
+
+    Attributes bytes_in and bytes_out track the amount of compressed data
+    consumed and decompressed data produced so far.
+    """
+    def __init__(self, path, method='auto', threads=None):
+        self.path = path
+        self.ext = maps.EXT_RE.search(path).groups()[0]
+        self.bytes_out = 0
+        self.proc = None
+        self._bytes_in = 0
+        self._in_file = None
+
+        cmd = find_decompressor(self.ext, method=method, threads=threads)
+        if cmd is not None:
+            self.tool = cmd[0]
+            self._stderr = tempfile.TemporaryFile()
+            if '{path}' in cmd:
+                self.proc = subprocess.Popen(
+                    [arg.replace('{path}', path) for arg in cmd],
+                    stdout=subprocess.PIPE, stderr=self._stderr)
+            else:
+                # Child shares our file offset, so we can track its progress
+                self._in_file = open(path, 'rb')
+                self.proc = subprocess.Popen(cmd, stdin=self._in_file,
+                                             stdout=subprocess.PIPE,
+                                             stderr=self._stderr)
+            self.stream = self.proc.stdout
+        else:
+            self.tool = 'python'
+            self._in_file = open(path, 'rb')
+            if self.ext == 'xml':
+                self.stream = self._in_file
+            elif self.ext == 'bz2':
+                self.stream = bz2.BZ2File(self._in_file)
+            elif self.ext == 'gz':
+                self.stream = gzip.GzipFile(fileobj=self._in_file)
+            elif self.ext in ('xz', 'lzma'):
+                self.stream = lzma.LZMAFile(self._in_file)
+            else:
+                raise RuntimeError('No decompressor available for .%s '
+                                   'files' % self.ext)
+
+    @property
+    def bytes_in(self):
+        """
+        Compressed bytes consumed so far (estimated for tools reading the
+        dump file by path, from their I/O counters)
+        """
+        if self._in_file is not None and not self._in_file.closed:
+            self._bytes_in = os.lseek(self._in_file.fileno(), 0, os.SEEK_CUR)
+        elif self.proc is not None and self.proc.returncode is None:
+            try:
+                with open('/proc/%s/io' % self.proc.pid) as io:
+                    for line in io:
+                        if line.startswith('rchar:'):
+                            self._bytes_in = int(line.split()[1])
+            except (IOError, OSError):
+                pass
+        return self._bytes_in
+
+    def _update_bytes_in(self):
+        """
+        Record compressed bytes consumed so far, before the tool exits or
+        the input file is closed
+        """
+        return self.bytes_in
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_out += len(data)
+        if not data and self.proc is not None:
+            self._finish()
+        return data
+
+    def _finish(self):
+        """
+        Wait for external tool to exit and log any error reported by it
+        """
+        if self.proc.returncode is not None:
+            return
+        self._update_bytes_in()
+        self.proc.wait()
+        if self.proc.returncode != 0:
+            self._stderr.seek(0)
+            msg = "%s failed decompressing %s (exit code %s): %s" % (
+                self.tool, self.path, self.proc.returncode,
+                self._stderr.read().decode('utf-8', 'replace').strip())
+            print(msg)
+            logging.error(msg)
+
+    def close(self):
+        # Keep final count of compressed bytes read
+        self._update_bytes_in()
+        if self.proc is not None:
+            if self.proc.returncode is None:
+                self.proc.kill()
+                self.proc.wait()
+            self.proc.stdout.close()
+            self._stderr.close()
+        else:
+            self.stream.close()
+        if self._in_file is not None:
+            self._in_file.close()
+
+
+class MultistreamReader(object):
+    """
+    File-like object producing a complete XML document from a byte range of
+    a bz2 multistream dump file.
+
+    Every stream in the range is decompressed in-process. The first stream in
+    the file (XML header and siteinfo) is prepended to the output, and a
+    closing root tag is appended unless the range extends to the end of file.
+    Thus, each shard of the file can be parsed independently of the rest.
+    """
+    chunk_size = 1 << 20
+
+    def __init__(self, path, byte_range, header_end):
+        self.path = path
+        self.start, self.end = byte_range
+        self.header_end = header_end
+        self.tool = 'python'
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._buffer = bytearray()
+        self._chunks = self._iter_chunks()
+
+    def _iter_streams(self, dump, start, end):
+        """
+        Decompress consecutive bz2 streams in bytes [start, end) of dump
+        """
+        dump.seek(start)
+        remaining = end - start if end is not None else None
+        decomp = bz2.BZ2Decompressor()
+        while remaining is None or remaining > 0:
+            size = (self.chunk_size if remaining is None
+                    else min(self.chunk_size, remaining))
+            data = dump.read(size)
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            self.bytes_in += len(data)
+            while data:
+                yield decomp.decompress(data)
+                if decomp.eof:
+                    # Start of the next stream, if any
+                    data = decomp.unused_data
+                    decomp = bz2.BZ2Decompressor()
+                else:
+                    data = b''
+
+    def _iter_chunks(self):
+        with open(self.path, 'rb') as dump:
+            for chunk in self._iter_streams(dump, 0, self.header_end):
+                yield chunk
+            for chunk in self._iter_streams(dump, self.start, self.end):
+                yield chunk
+        if self.end is not None:
+            yield b'</mediawiki>\n'
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer.extend(chunk)
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.bytes_out += len(data)
+        return data
+
+    def close(self):
+        self._chunks.close()
+
+
+def process_xml(dump_file=None, byte_range=None, parser='lxml'):
+    """
+    Extract Page, Revision and LogItem elements from a dump file
+
+    :Parameters:
+        dump_file : `DumpFile`
+            the dump file to read
+        byte_range : `tuple`
+            optional range of streams to read from a multistream dump file
+        parser : `str`
+            XML parser engine, either 'lxml' (iterparse) or 'expat' (fast
+            path driven by start/end callbacks)
+    """
+    if parser == 'lxml':
+        engine = _iterparse_lxml
+    elif parser == 'expat':
+        engine = ExpatDumpParser().parse
+    else:
+        raise RuntimeError('Unsupported XML parser ' + str(parser))
+
+    in_stream = dump_file.open_dump(byte_range=byte_range)
+    try:
+        for item in engine(in_stream):
+            yield item
+    finally:
+        # Also stops decompression tools if the caller stops early
+        in_stream.close()
+    if hasattr(in_stream, 'bytes_in'):
+        print("%s: %s read, %s decompressed with %s" % (
+              os.path.split(dump_file.path)[1],
+              misc.hfile_size(in_stream.bytes_in),
+              misc.hfile_size(in_stream.bytes_out), in_stream.tool))
+
+
+def _iterparse_lxml(in_stream):
     rev_parent_id = None
     page_dict = None
 
-    in_stream = dump_file.open_dump()
     for event, elem in etree.iterparse(in_stream, recover=True,
                                        huge_tree=True):
         # Drop tag namespace
@@ -89,6 +435,10 @@ def process_xml(dump_file=None):
 
             # Build dict {tag:text} for all children of revision
             rev_dict = {x.tag.split('}')[1]: x.text for x in elem}
+            # Length of text, also available in stub-meta-history dumps
+            text_elem = elem.find('{*}text')
+            if text_elem is not None:
+                rev_dict['text_bytes'] = text_elem.get('bytes')
             # Embed page_id, contrib_dict and return item
             rev_dict['page_id'] = page_dict['id']
             # To skip pattern matching for non-articles
@@ -139,3 +489,212 @@ def process_xml(dump_file=None):
             elem.clear()
             while elem.getprevious() is not None:
                 del elem.getparent()[0]
+
+
+# Fixed layouts of the records filled by ExpatDumpParser. Each element name
+# is mapped to its slot position in the record of the enclosing element.
+PAGE_FIELDS = ('title', 'ns', 'id', 'redirect', 'restrictions')
+REV_FIELDS = ('id', 'parentid', 'timestamp', 'minor', 'comment', 'model',
+              'format', 'text', 'sha1')
+CONTRIB_FIELDS = ('username', 'id', 'ip')
+LOG_FIELDS = ('id', 'timestamp', 'comment', 'type', 'action', 'logtitle',
+              'params')
+
+# Pre-interned (qualified) names of all elements handled by the parser
+TAG_NAMES = {name: sys.intern(name) for name in
+             PAGE_FIELDS + REV_FIELDS + CONTRIB_FIELDS + LOG_FIELDS +
+             ('mediawiki', 'siteinfo', 'namespaces', 'namespace', 'page',
+              'revision', 'contributor', 'logitem')}
+
+# Marks record slots whose element was not present in the dump
+_MISSING = object()
+
+
+class ExpatDumpParser(object):
+    """
+    Fast path XML parser for dump files, driven by expat start/end callbacks.
+
+    Text and children of page, revision, contributor and logitem elements
+    are stored in fixed-layout records (lists indexed by slot), without
+    building an element tree, walking parents or creating per-element dicts.
+    Each record is turned into the same Page, Revision or LogItem object
+    yielded by the lxml iterparse engine once its element is closed.
+
+    Records are not emitted as bare tuples: items are encoded by the codec
+    of comutils and read by key in every later stage (pages_to_file,
+    revs_to_file, process_logitem), so they remain DataItem dicts. Only
+    the conversion of records is done here, once per item, with a dict
+    comprehension (_record_dict), which is faster than building each
+    DataItem from its (field, value) pairs.
+    """
+    read_size = 1 << 20
+
+    def __init__(self):
+        self._items = []
+        self._depth = 0
+        # Current context: (depth, slots, openers, closer, record)
+        # Top level elements are children of the root (depth 1)
+        self._context = (1, {}, {'page': self._open_page,
+                                 'logitem': self._open_logitem}, None, None)
+        self._stack = []
+        self._slot = None
+        self._text = []
+        self._ns_key = None
+        self.ns_names = {'': 0}
+        self.page = None
+        self.rev = None
+        self.logitem = None
+        self.contrib = None
+        self.rev_parent_id = None
+        self.text_bytes = None
+
+        self.parser = expat.ParserCreate(intern=dict(TAG_NAMES))
+        self.parser.buffer_text = True
+        self.parser.buffer_size = 1 << 16
+        self.parser.StartElementHandler = self._start
+        self.parser.EndElementHandler = self._end
+        self.parser.CharacterDataHandler = self._chars
+
+    def parse(self, in_stream):
+        """
+        Generator of Page, Revision and LogItem objects read from in_stream
+        """
+        parser = self.parser
+        try:
+            while True:
+                data = in_stream.read(self.read_size)
+                parser.Parse(data, not data)
+                if self._items:
+                    for item in self._items:
+                        yield item
+                    del self._items[:]
+                if not data:
+                    break
+        except expat.ExpatError as e:
+            # Keep items parsed so far, like lxml in recover mode
+            print("Error parsing XML dump file:", e)
+            for item in self._items:
+                yield item
+
+    def _push(self, slots, openers, closer, record):
+        self._stack.append(self._context)
+        self._context = (self._depth, slots, openers, closer, record)
+
+    def _start(self, name, attrs):
+        self._depth += 1
+        depth, slots, openers, closer, record = self._context
+        if self._depth != depth + 1:
+            return
+        slot = slots.get(name)
+        if slot is not None:
+            self._slot = slot
+            self._text = []
+            if name == 'text':
+                self.text_bytes = attrs.get('bytes')
+            return
+        opener = openers.get(name)
+        if opener is not None:
+            opener()
+        elif name == 'namespace':
+            self._ns_key = int(attrs.get('key'))
+            self._slot = -1
+            self._text = []
+        elif name == 'siteinfo' or name == 'namespaces':
+            # Namespaces are nested in siteinfo, follow them down
+            self._push({}, {}, None, None)
+
+    def _chars(self, data):
+        if self._slot is not None:
+            self._text.append(data)
+
+    def _end(self, name):
+        depth = self._context[0]
+        if self._slot is not None and self._depth == depth + 1:
+            text = ''.join(self._text) if self._text else None
+            if self._slot == -1:
+                self.ns_names[text] = self._ns_key
+            else:
+                self._context[4][self._slot] = text
+            self._slot = None
+        elif self._depth == depth and self._stack:
+            closer = self._context[3]
+            self._context = self._stack.pop()
+            if closer is not None:
+                closer()
+        self._depth -= 1
+
+    def _open_page(self):
+        self.page = [_MISSING] * len(PAGE_FIELDS)
+        self._push(PAGE_SLOTS, {'revision': self._open_revision},
+                   self._close_page, self.page)
+
+    def _open_revision(self):
+        self.rev = [_MISSING] * len(REV_FIELDS)
+        self.contrib = None
+        self.text_bytes = None
+        self._push(REV_SLOTS, {'contributor': self._open_contrib},
+                   self._close_revision, self.rev)
+
+    def _open_logitem(self):
+        self.logitem = [_MISSING] * len(LOG_FIELDS)
+        self.contrib = None
+        self._push(LOG_SLOTS, {'contributor': self._open_contrib},
+                   self._close_logitem, self.logitem)
+
+    def _open_contrib(self):
+        self.contrib = [_MISSING] * len(CONTRIB_FIELDS)
+        self._push(CONTRIB_SLOTS, {}, None, self.contrib)
+
+    def _close_page(self):
+        page_dict = _record_dict(PAGE_FIELDS, self.page)
+        page_dict['item_type'] = 'page'
+        self._items.append(Page(page_dict))
+        self.page = None
+        self.rev_parent_id = None
+
+    def _close_revision(self):
+        rev_dict = _record_dict(REV_FIELDS, self.rev)
+        rev_dict['page_id'] = self.page[PAGE_SLOTS['id']]
+        rev_dict['ns'] = self.page[PAGE_SLOTS['ns']]
+        rev_dict['contrib_dict'] = _record_dict(CONTRIB_FIELDS, self.contrib)
+        rev_dict['rev_parent_id'] = self.rev_parent_id
+        if self.text_bytes is not None:
+            rev_dict['text_bytes'] = self.text_bytes
+        rev_dict['item_type'] = 'revision'
+        self._items.append(Revision(rev_dict))
+        self.rev_parent_id = rev_dict.get('id')
+        self.rev = None
+        self.contrib = None
+
+    def _close_logitem(self):
+        log_dict = _record_dict(LOG_FIELDS, self.logitem)
+        log_dict['contrib_dict'] = _record_dict(CONTRIB_FIELDS, self.contrib)
+        # Get namespace for this log item from page title prefix
+        if log_dict.get('logtitle'):
+            ns_prefix = log_dict['logtitle'].split(':')
+            if (len(ns_prefix) == 2 and ns_prefix[0] in self.ns_names):
+                log_dict['namespace'] = self.ns_names[ns_prefix[0]]
+            else:
+                log_dict['namespace'] = 0
+        else:
+            log_dict['logtitle'] = ''
+            log_dict['namespace'] = -1000  # Fake namespace
+        self._items.append(LogItem(log_dict))
+        self.logitem = None
+        self.contrib = None
+
+
+PAGE_SLOTS = {TAG_NAMES[f]: i for i, f in enumerate(PAGE_FIELDS)}
+REV_SLOTS = {TAG_NAMES[f]: i for i, f in enumerate(REV_FIELDS)}
+CONTRIB_SLOTS = {TAG_NAMES[f]: i for i, f in enumerate(CONTRIB_FIELDS)}
+LOG_SLOTS = {TAG_NAMES[f]: i for i, f in enumerate(LOG_FIELDS)}
+
+
+def _record_dict(fields, record):
+    """
+    Build dict {tag: text} from a fixed-layout record, skipping elements
+    not present in the dump
+    """
+    if record is None:
+        return {}
+    return {f: v for f, v in zip(fields, record) if v is not _MISSING}
@@ -10,12 +10,17 @@ import os
 import time
 import multiprocessing as mp
 import subprocess
-from .processors import Producer, Processor, Consumer
+import zmq
+from .processors import (Producer, Processor, Consumer, READY, DONE, FILE,
+                         STOP)
 from .dump import DumpFile, process_xml
 from .page import pages_to_file, pages_file_to_db
-from .revision import revs_to_file, revs_file_to_db
+from .revision import revs_to_file, revs_meta_to_file, revs_file_to_db
 from .logitem import logitem_to_file, logitem_file_to_db
-from wikidat.utils.dbutils import MySQLDB
+from wikidat.utils.dbutils import get_db_class
+from wikidat.utils.comutils import Transport
+from wikidat.utils.metrics import MetricsAggregator, metrics_path
+from wikidat.utils.loader import BulkLoad
 
 
 class ETL(mp.Process):
@@ -26,9 +31,10 @@ class ETL(mp.Process):
 
     def __init__(self, group=None, target=None, name=None, args=None,
                  kwargs=None, lang=None, db_name=None, db_user=None,
-                 db_passw=None):
+                 db_passw=None, db_backend='mysql'):
         """
-        Initialize new worfklow
+        Initialize new worfklow. db_backend is the DB backend of
+        connections of consumers (one of dbutils.DB_BACKENDS).
         """
         super(ETL, self).__init__(name=name)
         self.target = target
@@ -39,6 +45,98 @@ class ETL(mp.Process):
         self.db_name = db_name
         self.db_user = db_user
         self.db_passw = db_passw
+        self.db_backend = db_backend
+        # Aggregator of metrics published by processes (if enabled)
+        self.metrics = None
+
+    # Each ETL line has 20 ports available from its base port: 2 for shared
+    # memory rings, 2 for consumers and the rest for input of workers
+    max_workers = 16
+
+    def worker_port(self, worker):
+        """
+        Return port of input channel for a worker of this ETL line
+        """
+        return self.base_port + 4 + worker
+
+    def control_channel(self):
+        """
+        Bind control channel of this ETL line, receiving READY and DONE
+        messages from its processes
+        """
+        context = zmq.Context.instance()
+        control = context.socket(zmq.PULL)
+        control.bind(self.transport.endpoint(self.control_port))
+        return control
+
+    def start_metrics(self, log_dir, channels):
+        """
+        Start aggregation of metrics published by processes of this line,
+        written to files in log_dir (see metrics.MetricsAggregator)
+        """
+        if self.metrics_interval:
+            self.metrics = MetricsAggregator(
+                self.name, metrics_path(log_dir, self.name),
+                channels=channels, interval=self.metrics_interval)
+
+    def wait_control(self, control, message, processes):
+        """
+        Wait for control message (READY or DONE) from all processes.
+        Returns dict {name: message} with messages received. If any of them
+        exits without sending its message, all processes are terminated
+        and None is returned. Metrics (STATS) received meanwhile are passed
+        on to the aggregator.
+        """
+        pending = {proc.name: proc for proc in processes}
+        received = {}
+        poller = zmq.Poller()
+        poller.register(control, zmq.POLLIN)
+        while pending:
+            if self.metrics is not None:
+                self.metrics.tick()
+            if poller.poll(1000):
+                msg = control.recv_json()
+                if self.metrics is not None:
+                    self.metrics.update(msg)
+                if msg['msg'] == message and msg['name'] in pending:
+                    del pending[msg['name']]
+                    received[msg['name']] = msg
+            elif any(proc.exitcode is not None
+                     for proc in pending.values()):
+                # Last chance for messages sent right before exiting
+                if poller.poll(1000):
+                    continue
+                print(self.name, "Processes exited before sending %s: %s" %
+                      (message, ', '.join(sorted(pending))))
+                for proc in processes:
+                    if proc.is_alive():
+                        proc.terminate()
+                return None
+        return received
+
+    def db_connection(self):
+        """
+        Return new connection to local DB, or None if the sink of this line
+        does not use a DB (e.g. columnar.ParquetSink)
+        """
+        if not self.bulk_load.uses_db():
+            return None
+        con = get_db_class(self.db_backend)(host='localhost',
+                                            user=self.db_user,
+                                            passwd=self.db_passw,
+                                            db=self.db_name)
+        con.connect()
+        return con
+
+    def check_counts(self, done, senders, receivers):
+        """
+        Check that all items sent by a stage were received by the next one
+        """
+        sent = sum(done[proc.name]['out'] for proc in senders)
+        received = sum(done[proc.name]['in'] for proc in receivers)
+        if sent != received:
+            print(self.name, "Warning: %s items sent, %s received" % (
+                  sent, received))
 
 
 class RevisionHistoryETL(ETL):
@@ -46,18 +144,74 @@ class RevisionHistoryETL(ETL):
     Models workflow to import page and revision history data from Wikipedia
     database dump files
     """
+    # Max. number of XML readers for each dump file
+    max_xml_shards = 9
+    # Target of revision workers, transforming revisions into DB rows
+    revs_target = staticmethod(revs_to_file)
+
     def __init__(self, group=None, target=None, name=None, args=None,
                  kwargs=None, paths_queue=None, lang=None, page_fan=1,
                  rev_fan=3, page_cache_size=1000000, rev_cache_size=1000000,
                  db_name=None, db_user=None, db_passw=None,
-                 base_port=None, control_port=None):
+                 base_port=None, control_port=None, xml_shards=1,
+                 xml_parser='lxml', decompressor='auto',
+                 decomp_threads=None, hash_mode='sha256', transport=None,
+                 metrics_interval=0, profiling=None, flow=None,
+                 user_store=None, text_cache=64, rev_diff=False,
+                 bulk_load=None, db_backend='mysql'):
         """
         Initialize new PageRevision workflow
+
+        xml_shards sets the number of parallel XML readers for bz2
+        multistream dump files with an offsets index. Other files are always
+        read by a single XML reader.
+
+        xml_parser selects the engine of XML readers ('lxml' or 'expat').
+
+        decompressor and decomp_threads select the tool used to decompress
+        dump files (see DumpFile).
+
+        hash_mode selects the hash of revision text stored in revision_hash
+        (see revision.HASH_MODES).
+
+        transport sets codecs, batching and endpoints of the communication
+        channels between processes (see comutils.Transport).
+
+        metrics_interval sets the seconds between updates of metrics of
+        all processes, written to the logs dir (0 disables them).
+
+        profiling (a profiling.Profiling object) enables profiling of all
+        processes of this line, with one output file per process.
+
+        flow (a multiprocessing.Event) lets a memory governor pause XML
+        readers while it is clear (see governor.MemoryGovernor).
+
+        user_store (a userstore.UserStore object) selects the store of user
+        info collected by revision workers (Redis by default).
+
+        text_cache sets the max. number of distinct texts of each page whose
+        derived fields are cached by revision workers (see
+        revision.TextCache, 0 disables it).
+
+        rev_diff enables diff statistics of revisions (see linediff), loaded
+        in revision_diff. It is off by default: every revision is hashed by
+        lines and compared, and revisions of each page must then be sent to
+        the same revision worker (page affinity) instead of the next free
+        one.
+
+        bulk_load (a loader.BulkLoad object) sets how consumers load chunks
+        of rows in DB (chunk files read by the server by default). With a
+        columnar.ParquetSink, rows are written to Parquet datasets instead
+        and no DB is used.
+
+        db_backend selects the DB loading rows of consumers, 'mysql' or
+        'postgresql' (see pgutils).
         """
         super(RevisionHistoryETL,
               self).__init__(group=None, target=None, name=name, args=None,
                              kwargs=None, lang=lang, db_name=db_name,
-                             db_user=db_user, db_passw=db_passw)
+                             db_user=db_user, db_passw=db_passw,
+                             db_backend=db_backend)
         self.page_fan = page_fan
         self.rev_fan = rev_fan
         self.paths_queue = paths_queue
@@ -65,6 +219,34 @@ class RevisionHistoryETL(ETL):
         self.rev_cache_size = rev_cache_size
         self.base_port = base_port
         self.control_port = control_port
+        self.xml_shards = xml_shards
+        self.xml_parser = xml_parser
+        self.decompressor = decompressor
+        self.decomp_threads = decomp_threads
+        self.transport = transport if transport is not None else Transport()
+        self.hash_mode = hash_mode
+        self.metrics_interval = metrics_interval
+        self.profiling = profiling
+        self.flow = flow
+        self.user_store = user_store
+        self.text_cache = text_cache
+        self.rev_diff = rev_diff
+        self.bulk_load = bulk_load if bulk_load is not None else BulkLoad()
+
+    def revs_kwargs(self):
+        """
+        Return keyword arguments of target of revision workers
+        """
+        return dict(lang=self.lang, hash_mode=self.hash_mode,
+                    user_store=self.user_store, text_cache=self.text_cache,
+                    rev_diff=self.rev_diff)
+
+    def revs_affinity(self):
+        """
+        Return field of revisions keeping them on the same revision worker
+        (None sends them to any worker)
+        """
+        return 'page_id' if self.rev_diff else None
 
     def run(self):
         """
@@ -78,24 +260,34 @@ class RevisionHistoryETL(ETL):
             - Consumer (C): insert db queue --> database (MySQL/MariaDB)
 
         In this case, the logical combination is usually N:N:1 (P, CP, C)
+
+        Workers and consumers are started once, and they stay connected
+        across all dump files processed by this ETL line (consumers also
+        keep their DB connection and chunk files). For every path,
+        producers (XML readers) are started and the line waits for their
+        DONE message. Workers are told about each new file (FILE) and about
+        the end of the work (STOP) through their input channel.
         """
         start = time.time()
         print(self.name, "Starting PageRevisionETL workflow at %s" % (
                          time.strftime("%Y-%m-%d %H:%M:%S %Z",
                                        time.localtime())))
+        if self.page_fan + self.rev_fan > self.max_workers:
+            raise RuntimeError('At most %s page and revision workers '
+                               'are supported per ETL line' %
+                               self.max_workers)
+
+        # Work items are paths or (path, byte_range) for parts of
+        # multistream dump files
+        path = self.paths_queue.get()
+        if path == 'STOP':
+            self.paths_queue.task_done()
+            print(self.name, "No dump files to process")
+            return
+        path, byte_range = path if isinstance(path, tuple) else (path, None)
 
-        db_ns = MySQLDB(host='localhost', port=3306, user=self.db_user,
-                        passwd=self.db_passw, db=self.db_name)
-        db_ns.connect()
-
-        db_pages = MySQLDB(host='localhost', port=3306,
-                           user=self.db_user, passwd=self.db_passw,
-                           db=self.db_name)
-        db_pages.connect()
-
-        db_revs = MySQLDB(host='localhost', port=3306, user=self.db_user,
-                          passwd=self.db_passw, db=self.db_name)
-        db_revs.connect()
+        db_pages = self.db_connection()
+        db_revs = self.db_connection()
 
         # DATA EXTRACTION
         # Use consistent naming for all child processes
@@ -105,106 +297,228 @@ class RevisionHistoryETL(ETL):
         page_insert_name = '-'.join([self.name, 'insert_page'])
         rev_insert_name = '-'.join([self.name, 'insert_revision'])
 
-        for path in iter(self.paths_queue.get, 'STOP'):
-            # Start subprocess to extract elements from revision dump file
-            dump_file = DumpFile(path)
-            xml_reader = Producer(name=xml_reader_name,
-                                  target=process_xml,
-                                  kwargs=dict(
-                                      dump_file=dump_file),
-                                  consumers=self.page_fan + self.rev_fan,
-                                  push_pages_port=self.base_port,
-                                  push_revs_port=self.base_port+1,
-                                  control_port=self.control_port)
-            xml_reader.start()
-            print(xml_reader_name, "started")
-            print(self.name, "Extracting data from XML revision history file:")
-            print(path)
-
-            # List to keep tracking of page and revision workers
-            workers = []
-            db_workers_revs = []
-            # Create and start page processes
-            for worker in range(self.page_fan):
-                page_worker_name = '-'.join([page_proc_name, str(worker)])
-                process_page = Processor(name=page_worker_name,
-                                         target=pages_to_file,
-                                         producers=1, consumers=1,
-                                         pull_port=self.base_port,
-                                         push_port=self.base_port+2,
-                                         control_port=self.control_port)
-                process_page.start()
-                workers.append(process_page)
-                print(page_worker_name, "started")
-
-            # Create and start revision processes
-            for worker in range(self.rev_fan):
-                rev_worker_name = '-'.join([rev_proc_name, str(worker)])
-
-                db_wrev = MySQLDB(host='localhost', port=3306,
-                                  user=self.db_user,
-                                  passwd=self.db_passw, db=self.db_name)
-                db_wrev.connect()
-
-                process_revision = Processor(name=rev_worker_name,
-                                             target=revs_to_file,
-                                             kwargs=dict(
-                                                 lang=self.lang),
-                                             producers=1, consumers=1,
-                                             pull_port=self.base_port+1,
-                                             push_port=self.base_port+3,
-                                             control_port=self.control_port)
-                process_revision.start()
-                workers.append(process_revision)
-                db_workers_revs.append(db_wrev)
-                print(rev_worker_name, "started")
-
-            # Create directory for logging files if it does not exist
-            log_dir = os.path.join(os.path.split(path)[0], 'logs')
-            tmp_dir = os.path.join(os.getcwd(), os.path.split(path)[0], 'tmp')
-            file_name = os.path.split(path)[1]
-
-            if not os.path.exists(log_dir):
-                os.makedirs(log_dir)
-            if not os.path.exists(tmp_dir):
-                os.makedirs(tmp_dir)
-            log_file = os.path.join(log_dir, file_name + '.log')
-
-            page_insert_db = Consumer(name=page_insert_name,
-                                      target=pages_file_to_db,
-                                      kwargs=dict(con=db_pages,
-                                                  log_file=log_file,
-                                                  tmp_dir=tmp_dir,
-                                                  file_rows=self.page_cache_size,
-                                                  etl_prefix=self.name),
-                                      producers=self.page_fan,
-                                      pull_port=self.base_port+2)
-
-            rev_insert_db = Consumer(name=rev_insert_name,
-                                     target=revs_file_to_db,
-                                     kwargs=dict(con=db_revs,
-                                                 log_file=log_file,
-                                                 tmp_dir=tmp_dir,
-                                                 file_rows=self.rev_cache_size,
-                                                 etl_prefix=self.name),
-                                     producers=self.rev_fan,
-                                     pull_port=self.base_port+3)
+        # Control channel receiving READY/DONE messages from all processes
+        control = self.control_channel()
+
+        # Input ports of page and revision workers. Shared memory rings are
+        # read by all workers of the same type. With page affinity,
+        # revisions of a page always go to the same worker, so every
+        # revision worker has its own ring
+        shm = self.transport.is_shm()
+        affinity = self.revs_affinity()
+        if shm:
+            self.transport.create_ring(self.base_port, readers=self.page_fan)
+            self.transport.create_ring(self.base_port+2)
+            self.transport.create_ring(self.base_port+3)
+            pages_ports = [self.base_port] * self.page_fan
+            if affinity is not None:
+                revs_ports = [self.worker_port(self.page_fan + worker)
+                              for worker in range(self.rev_fan)]
+                for port in revs_ports:
+                    self.transport.create_ring(port)
+            else:
+                self.transport.create_ring(self.base_port+1,
+                                           readers=self.rev_fan)
+                revs_ports = [self.base_port+1] * self.rev_fan
+        else:
+            pages_ports = [self.worker_port(worker)
+                           for worker in range(self.page_fan)]
+            revs_ports = [self.worker_port(self.page_fan + worker)
+                          for worker in range(self.rev_fan)]
+
+        # List to keep tracking of page and revision workers
+        workers = []
+        # Create and start page processes
+        for worker in range(self.page_fan):
+            page_worker_name = '-'.join([page_proc_name, str(worker)])
+            process_page = Processor(name=page_worker_name,
+                                     target=pages_to_file,
+                                     producers=None, consumers=1,
+                                     pull_port=pages_ports[worker],
+                                     push_port=self.base_port+2,
+                                     control_port=self.control_port,
+                                     transport=self.transport,
+                                     metrics_interval=self.metrics_interval,
+                                     profiling=self.profiling)
+            process_page.start()
+            workers.append(process_page)
+            print(page_worker_name, "started")
+
+        # Create and start revision processes
+        for worker in range(self.rev_fan):
+            rev_worker_name = '-'.join([rev_proc_name, str(worker)])
+            process_revision = Processor(name=rev_worker_name,
+                                         target=self.revs_target,
+                                         kwargs=self.revs_kwargs(),
+                                         producers=None, consumers=1,
+                                         pull_port=revs_ports[worker],
+                                         push_port=self.base_port+3,
+                                         control_port=self.control_port,
+                                         transport=self.transport,
+                                         metrics_interval=self.metrics_interval,
+                                         profiling=self.profiling)
+            process_revision.start()
+            workers.append(process_revision)
+            print(rev_worker_name, "started")
 
-            page_insert_db.start()
-            print(page_insert_name, "started")
-            rev_insert_db.start()
-            print(rev_insert_name, "started")
+        # Create directory for logging files if it does not exist
+        # Logging and temp files are located in the dir of the first path
+        log_dir = os.path.join(os.path.split(path)[0], 'logs')
+        tmp_dir = os.path.join(os.getcwd(), os.path.split(path)[0], 'tmp')
 
-            print(self.name, "Waiting for all processes to finish...")
-            print()
-            xml_reader.join()
-            for w in workers:
-                w.join()
-            page_insert_db.join()
-            rev_insert_db.join()
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        if not os.path.exists(tmp_dir):
+            os.makedirs(tmp_dir)
+        log_file = os.path.join(log_dir, self.name + '.log')
+        self.start_metrics(log_dir, channels=[
+            (['xml_reader'], ['process_page', 'process_revision']),
+            (['process_page'], ['insert_page']),
+            (['process_revision'], ['insert_revision'])])
+
+        page_insert_db = Consumer(name=page_insert_name,
+                                  target=pages_file_to_db,
+                                  kwargs=dict(con=db_pages,
+                                              log_file=log_file,
+                                              tmp_dir=tmp_dir,
+                                              file_rows=self.page_cache_size,
+                                              etl_prefix=self.name,
+                                              bulk_load=self.bulk_load),
+                                  producers=self.page_fan,
+                                  pull_port=self.base_port+2,
+                                  control_port=self.control_port,
+                                  transport=self.transport,
+                                  metrics_interval=self.metrics_interval,
+                                  profiling=self.profiling,
+                                  target_metrics=True)
+
+        rev_insert_db = Consumer(name=rev_insert_name,
+                                 target=revs_file_to_db,
+                                 kwargs=dict(con=db_revs,
+                                             log_file=log_file,
+                                             tmp_dir=tmp_dir,
+                                             file_rows=self.rev_cache_size,
+                                             etl_prefix=self.name,
+                                             bulk_load=self.bulk_load),
+                                 producers=self.rev_fan,
+                                 pull_port=self.base_port+3,
+                                 control_port=self.control_port,
+                                 transport=self.transport,
+                                 metrics_interval=self.metrics_interval,
+                                 profiling=self.profiling,
+                                 target_metrics=True)
+
+        page_insert_db.start()
+        print(page_insert_name, "started")
+        rev_insert_db.start()
+        print(rev_insert_name, "started")
+        consumers = [page_insert_db, rev_insert_db]
+
+        # Channel to send FILE and STOP messages to workers, through their
+        # own input channels
+        context = zmq.Context.instance()
+        if shm:
+            workers_control = [self.transport.sender(port) for port in
+                               [self.base_port] + sorted(set(revs_ports))]
+        else:
+            channels = []
+            for port in pages_ports + revs_ports:
+                channel = context.socket(zmq.PUSH)
+                channel.connect(self.transport.endpoint(port))
+                channels.append(channel)
+            workers_control = [self.transport.sender(channels)]
+
+        ok = self.wait_control(control, READY, workers + consumers)
+        # Total number of producers, sending end of stream to each worker
+        xml_readers_total = 0
+        producers_done = {}
+        xml_readers_all = []
+        while ok and path != 'STOP':
+            # Split multistream dump files in shards to be read in parallel
+            dump_file = DumpFile(path, decompressor=self.decompressor,
+                                 threads=self.decomp_threads)
+            if self.xml_shards > 1 and dump_file.is_multistream():
+                shards = dump_file.get_shards(min(self.xml_shards,
+                                                  self.max_xml_shards),
+                                              byte_range=byte_range)
+            else:
+                shards = [byte_range]
+            xml_readers_total += len(shards)
+
+            # Readers of shm rings compete for records, so they cannot be
+            # told about every file. They only get STOP, once all producers
+            # are done, and the ring keeps it behind all items.
+            if not shm:
+                for sender in workers_control:
+                    sender.send_control({'msg': FILE, 'file': path,
+                                         'eos': xml_readers_total})
+
+            # Start subprocesses to extract elements from revision dump file
+            xml_readers = []
+            for shard, byte_range in enumerate(shards):
+                xml_reader = Producer(name='-'.join([xml_reader_name,
+                                                     str(xml_readers_total),
+                                                     str(shard)]),
+                                      target=process_xml,
+                                      kwargs=dict(
+                                          dump_file=dump_file,
+                                          byte_range=byte_range,
+                                          parser=self.xml_parser),
+                                      consumers=(self.page_fan +
+                                                 self.rev_fan),
+                                      push_pages_port=pages_ports,
+                                      push_revs_port=revs_ports,
+                                      control_port=self.control_port,
+                                      transport=self.transport,
+                                      metrics_interval=self.metrics_interval,
+                                      profiling=self.profiling,
+                                      flow=self.flow,
+                                      revs_affinity=affinity)
+                xml_reader.start()
+                xml_readers.append(xml_reader)
+                print(xml_reader.name, "started")
+            print(self.name, "Extracting data from XML revision history file:")
+            if byte_range is None:
+                print(path)
+            else:
+                print(path, "bytes %s-%s" % (byte_range[0],
+                                             byte_range[1] or 'end'))
+
+            done = self.wait_control(control, DONE, xml_readers)
+            for proc in xml_readers:
+                proc.join()
+            if done is None:
+                ok = False
+                break
+            producers_done.update(done)
+            xml_readers_all.extend(xml_readers)
 
             # Mark this path as done
             self.paths_queue.task_done()
+            path = self.paths_queue.get()
+            path, byte_range = (path if isinstance(path, tuple)
+                                else (path, None))
+
+        if ok:
+            # In shm mode, STOP is read right after the last item
+            for sender in workers_control:
+                sender.send_control({'msg': STOP,
+                                     'eos': 0 if shm else xml_readers_total})
+            print(self.name, "Waiting for all processes to finish...")
+            print()
+            done = self.wait_control(control, DONE, workers + consumers)
+            ok = done is not None
+            if ok:
+                done.update(producers_done)
+                self.check_counts(done, xml_readers_all, workers)
+                self.check_counts(done, workers, consumers)
+        else:
+            for proc in workers + consumers:
+                if proc.is_alive():
+                    proc.terminate()
+
+        for proc in workers + consumers:
+            proc.join()
 
         # Mark STOP message as processed and finish
         self.paths_queue.task_done()
@@ -212,19 +526,42 @@ class RevisionHistoryETL(ETL):
         end = time.time()
         print(self.name, ": All tasks done in %.4f sec." % ((end-start)/1.))
         print()
-        db_ns.close()
-        db_pages.close()
-        db_revs.close()
-        for dbcon in db_workers_revs:
-            dbcon.close()
-
-
-class RevisionMetaETL(ETL):
+        for con in (db_pages, db_revs):
+            if con is not None:
+                con.close()
+        if self.metrics is not None:
+            self.metrics.write()
+        control.close()
+        if shm:
+            self.transport.close_rings()
+        else:
+            for channel in channels:
+                channel.close(linger=-1)
+        if not ok:
+            # Report failure to the task (exit code of this process)
+            print(self.name, "Error: ETL line failed, data are incomplete")
+            sys.exit(1)
+
+
+class RevisionMetaETL(RevisionHistoryETL):
     """
     Implements workflow to extract and store metadata for pages and
     revisions (stub-meta-history.xml files)
+
+    Follows the same workflow as RevisionHistoryETL, filling the same
+    tables, but revision workers skip all text processing. Length of
+    revisions and hashes are taken from the dump.
     """
-    pass
+    revs_target = staticmethod(revs_meta_to_file)
+
+    def revs_kwargs(self):
+        # No text to cache derived fields from
+        return dict(lang=self.lang, hash_mode=self.hash_mode,
+                    user_store=self.user_store)
+
+    def revs_affinity(self):
+        # No text to diff
+        return None
 
 
 class LoggingETL(ETL):
@@ -237,20 +574,32 @@ class LoggingETL(ETL):
                  kwargs=None, path=None, lang=None, log_fan=1,
                  log_cache_size=1000000,
                  db_name=None, db_user=None, db_passw=None,
-                 base_port=None, control_port=None):
+                 base_port=None, control_port=None, xml_parser='lxml',
+                 decompressor='auto', decomp_threads=None, transport=None,
+                 metrics_interval=0, profiling=None, flow=None,
+                 bulk_load=None, db_backend='mysql'):
         """
         Initialize new PageRevision workflow
         """
         super(LoggingETL,
               self).__init__(group=None, target=None, name=name, args=None,
                              kwargs=None, lang=lang, db_name=db_name,
-                             db_user=db_user, db_passw=db_passw)
+                             db_user=db_user, db_passw=db_passw,
+                             db_backend=db_backend)
 
         self.path = path
         self.log_fan = log_fan
         self.log_cache_size = log_cache_size
         self.base_port = base_port
         self.control_port = control_port
+        self.xml_parser = xml_parser
+        self.decompressor = decompressor
+        self.decomp_threads = decomp_threads
+        self.transport = transport if transport is not None else Transport()
+        self.metrics_interval = metrics_interval
+        self.profiling = profiling
+        self.flow = flow
+        self.bulk_load = bulk_load if bulk_load is not None else BulkLoad()
 
     def run(self):
         """
@@ -275,20 +624,19 @@ class LoggingETL(ETL):
         xml_reader_name = '-'.join([self.name, 'xml_reader'])
         logitem_proc_name = '-'.join([self.name, 'process_logitem'])
         logitem_insert_name = '-'.join([self.name, 'insert_logitem'])
-        # Start subprocess to extract elements from logging dump file
+        if self.log_fan > self.max_workers:
+            raise RuntimeError('At most %s logitem workers are supported '
+                               'per ETL line' % self.max_workers)
+        control = self.control_channel()
+        shm = self.transport.is_shm()
+        if shm:
+            self.transport.create_ring(self.base_port, readers=self.log_fan)
+            self.transport.create_ring(self.base_port+2)
+            logs_ports = [self.base_port] * self.log_fan
+        else:
+            logs_ports = [self.worker_port(worker)
+                          for worker in range(self.log_fan)]
         file_path = self.path[0]
-        dump_file = DumpFile(file_path)
-        xml_reader = Producer(name=xml_reader_name,
-                              target=process_xml,
-                              kwargs=dict(
-                                  dump_file=dump_file),
-                              consumers=self.log_fan,
-                              push_logs_port=self.base_port,
-                              control_port=self.control_port)
-        xml_reader.start()
-        print(xml_reader_name, "started")
-        print(self.name, "Extracting data from XML revision history file:")
-        print(str(self.path[0]))
 
         # List to keep tracking of logitem workers
         workers = []
@@ -298,9 +646,12 @@ class LoggingETL(ETL):
             process_logitems = Processor(name=worker_name,
                                          target=logitem_to_file,
                                          producers=1, consumers=1,
-                                         pull_port=self.base_port,
+                                         pull_port=logs_ports[worker],
                                          push_port=self.base_port+2,
-                                         control_port=self.control_port)
+                                         control_port=self.control_port,
+                                         transport=self.transport,
+                                         metrics_interval=self.metrics_interval,
+                                         profiling=self.profiling)
             process_logitems.start()
             workers.append(process_logitems)
             print(worker_name, "started")
@@ -315,35 +666,84 @@ class LoggingETL(ETL):
         if not os.path.exists(tmp_dir):
             os.makedirs(tmp_dir)
         log_file = os.path.join(log_dir, file_name + '.log')
+        self.start_metrics(log_dir, channels=[
+            (['xml_reader'], ['process_logitem']),
+            (['process_logitem'], ['insert_logitem'])])
 
-        db_log = MySQLDB(host='localhost', port=3306, user=self.db_user,
-                         passwd=self.db_passw, db=self.db_name)
-        db_log.connect()
+        db_log = self.db_connection()
         logitem_insert_db = Consumer(name=logitem_insert_name,
                                      target=logitem_file_to_db,
                                      kwargs=dict(con=db_log,
                                                  log_file=log_file,
                                                  tmp_dir=tmp_dir,
                                                  file_rows=self.log_cache_size,
-                                                 etl_prefix=self.name),
+                                                 etl_prefix=self.name,
+                                                 bulk_load=self.bulk_load),
                                      producers=self.log_fan,
-                                     pull_port=self.base_port+2)
+                                     pull_port=self.base_port+2,
+                                     control_port=self.control_port,
+                                     transport=self.transport,
+                                     metrics_interval=self.metrics_interval,
+                                     profiling=self.profiling,
+                                     target_metrics=True)
 
         print(logitem_insert_name, "started")
         logitem_insert_db.start()
 
-        print("Waiting for all processes to finish...")
-        print()
-        xml_reader.join()
+        # Start subprocess to extract elements from logging dump file
+        # once all workers are ready to receive items
+        xml_reader = None
+        ok = self.wait_control(control, READY,
+                               workers + [logitem_insert_db]) is not None
+        if ok:
+            dump_file = DumpFile(file_path, decompressor=self.decompressor,
+                                 threads=self.decomp_threads)
+            xml_reader = Producer(name=xml_reader_name,
+                                  target=process_xml,
+                                  kwargs=dict(
+                                      dump_file=dump_file,
+                                      parser=self.xml_parser),
+                                  consumers=self.log_fan,
+                                  push_logs_port=logs_ports,
+                                  control_port=self.control_port,
+                                  transport=self.transport,
+                                  metrics_interval=self.metrics_interval,
+                                  profiling=self.profiling,
+                                  flow=self.flow)
+            xml_reader.start()
+            print(xml_reader_name, "started")
+            print(self.name, "Extracting data from XML revision history file:")
+            print(str(self.path[0]))
+
+            print("Waiting for all processes to finish...")
+            print()
+            done = self.wait_control(control, DONE,
+                                     [xml_reader] + workers +
+                                     [logitem_insert_db])
+            ok = done is not None
+            if ok:
+                self.check_counts(done, [xml_reader], workers)
+                self.check_counts(done, workers, [logitem_insert_db])
+            xml_reader.join()
         for w in workers:
             w.join()
         logitem_insert_db.join()
+        if self.metrics is not None:
+            self.metrics.write()
+        control.close()
+        if shm:
+            self.transport.close_rings()
 
         # All operations finished
         end = time.time()
         print("All tasks done in %.4f sec." % ((end-start)/1.))
         print()
-        db_log.close()
+        if db_log is not None:
+            db_log.close()
+        if not ok:
+            # Report failure to the task (exit code of this process)
+            print(self.name, "Error: ETL line failed, data are incomplete")
+            sys.exit(1)
 
 
 class SQLDumpsETL(ETL):
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Diff statistics of revisions with respect to the previous revision of the
+same page (lines and bytes added and removed), computed by revision
+workers as revisions arrive.
+
+Texts are compared as sequences of line hashes. Lines common to the start
+and the end of both texts are skipped, and lines in between are compared
+as multisets: a line is added if the new text has more copies of it than
+the old one, and removed if it has fewer. This takes linear time on the
+number of lines, no matter how large pages or edits are, but lines moved
+to another place of the text are not counted as changes (unlike a
+line-by-line LCS diff). Bytes are the UTF-8 size of added or removed
+lines, without line breaks.
+
+Only the line hashes of the last revision of each page are kept, for a
+bounded number of pages and lines: revisions of pages read by different
+XML readers are interleaved in revision workers.
+
+@author: jfelipe
+"""
+import array
+import collections
+
+
+def line_hashes(text):
+    """
+    Return tuple (hashes, sizes) of text: arrays with hash and size in
+    bytes of each of its lines
+    """
+    lines = text.split('\n')
+    hashes = array.array('q', map(hash, lines))
+    if text.isascii():
+        sizes = array.array('L', map(len, lines))
+    else:
+        sizes = array.array('L', [len(line) if line.isascii() else
+                                  len(line.encode('utf-8'))
+                                  for line in lines])
+    return hashes, sizes
+
+
+EMPTY = (array.array('q'), array.array('L'))
+
+
+def diff_stats(old, new):
+    """
+    Return tuple (lines_added, lines_removed, bytes_added, bytes_removed)
+    between old and new, both tuples returned by line_hashes
+    """
+    old_hashes, old_sizes = old
+    new_hashes, new_sizes = new
+    # Skip common prefix and suffix
+    start = 0
+    end = min(len(old_hashes), len(new_hashes))
+    while start < end and old_hashes[start] == new_hashes[start]:
+        start += 1
+    old_end = len(old_hashes)
+    new_end = len(new_hashes)
+    while (old_end > start and new_end > start and
+           old_hashes[old_end - 1] == new_hashes[new_end - 1]):
+        old_end -= 1
+        new_end -= 1
+    if start == old_end:
+        return (new_end - start, 0, sum(new_sizes[start:new_end]), 0)
+    if start == new_end:
+        return (0, old_end - start, 0, sum(old_sizes[start:old_end]))
+
+    counts = collections.Counter(new_hashes[start:new_end])
+    counts.subtract(old_hashes[start:old_end])
+    sizes = dict(zip(old_hashes[start:old_end], old_sizes[start:old_end]))
+    sizes.update(zip(new_hashes[start:new_end], new_sizes[start:new_end]))
+    lines_added = lines_removed = bytes_added = bytes_removed = 0
+    for h, count in counts.items():
+        if count > 0:
+            lines_added += count
+            bytes_added += count * sizes[h]
+        elif count < 0:
+            lines_removed -= count
+            bytes_removed -= count * sizes[h]
+    return (lines_added, lines_removed, bytes_added, bytes_removed)
+
+
+class PageDiffer(object):
+    """
+    Computes diff statistics of revisions of pages, arriving in order for
+    each page. Line hashes of the last revision of least recently seen
+    pages are dropped beyond pages or max_lines.
+
+    Arguments:
+        - pages = Max. number of pages whose last revision is kept
+        - max_lines = Max. number of lines kept for all pages
+    """
+    def __init__(self, pages=10000, max_lines=4000000):
+        self.pages = pages
+        self.max_lines = max_lines
+        self.last = collections.OrderedDict()
+        self.lines = 0
+        self.missing = 0
+
+    def diff(self, rev, text):
+        """
+        Return tuple of revision_diff values (rev_id, page_id, id of
+        previous revision, lines_added, lines_removed, bytes_added,
+        bytes_removed) of revision rev with text (None if it has no text).
+        The first revision of a page is compared with an empty text
+        (previous revision 0). Returns None if the previous revision of the
+        page is no longer kept.
+        """
+        rev_id = int(rev['id'])
+        page_id = int(rev['page_id'])
+        current = line_hashes(text) if text else EMPTY
+        previous = self.last.pop(page_id, None)
+        if previous is not None:
+            self.lines -= len(previous[1][0])
+        self.last[page_id] = (rev_id, current)
+        self.lines += len(current[0])
+        while len(self.last) > 1 and (len(self.last) > self.pages or
+                                      self.lines > self.max_lines):
+            self.lines -= len(self.last.popitem(last=False)[1][1][0])
+
+        if previous is None:
+            if rev['rev_parent_id'] is not None:
+                self.missing += 1
+                return None
+            return (rev_id, page_id, 0) + diff_stats(EMPTY, current)
+        return (rev_id, page_id, previous[0]) + diff_stats(previous[1],
+                                                           current)
@@ -5,12 +5,11 @@ Created on Sat Mar 29 22:14:21 2014
 @author: jfelipe
 """
 from .data_item import DataItem
+from wikidat.utils.loader import BulkLoad
 import dateutil.parser
 import ipaddress
 import datetime
 import re
-import os
-import csv
 import time
 import logging
 
@@ -323,9 +322,17 @@ def logitem_to_file(log_iter):
 
 
 def logitem_file_to_db(log_iter, con=None, log_file=None,
-                       tmp_dir=None, file_rows=1000000, etl_prefix=None):
+                       tmp_dir=None, file_rows=1000000, etl_prefix=None,
+                       bulk_load=None, metrics=None):
     """
-    Store processed logitems in DB from intermediate tmp data files
+    Store processed logitems in DB from intermediate chunks (files or
+    in-memory buffers), loaded in the background while the next chunks are
+    written (see loader.BulkLoad).
+
+    Arguments:
+        - bulk_load: Settings of loading of chunks (loader.BulkLoad)
+        - metrics: ProcessMetrics of this process, reporting waits of
+          the loader
     """
     insert_rows = 0
     total_logs = 0
@@ -338,39 +345,17 @@ def logitem_file_to_db(log_iter, con=None, log_file=None,
                  time.strftime("%Y-%m-%d %H:%M:%S %Z",
                                time.localtime())))
 
-    insert_logitem = """LOAD DATA INFILE '%s' INTO TABLE logging
-                        FIELDS OPTIONALLY ENCLOSED BY '"'
-                        TERMINATED BY '\t' ESCAPED BY '"'
-                        LINES TERMINATED BY '\n'"""
-
-    insert_block = """LOAD DATA INFILE '%s' INTO TABLE block
-                      FIELDS OPTIONALLY ENCLOSED BY '"'
-                      TERMINATED BY '\t' ESCAPED BY '"'
-                      LINES TERMINATED BY '\n'"""
-
-    insert_newuser = """LOAD DATA INFILE '%s' INTO TABLE user_new
-                        FIELDS OPTIONALLY ENCLOSED BY '"'
-                        TERMINATED BY '\t' ESCAPED BY '"'
-                        LINES TERMINATED BY '\n'"""
-
-    insert_rights = """LOAD DATA INFILE '%s' INTO TABLE user_level
-                       FIELDS OPTIONALLY ENCLOSED BY '"'
-                       TERMINATED BY '\t' ESCAPED BY '"'
-                       LINES TERMINATED BY '\n'"""
-
-    path_file_logitem = os.path.join(tmp_dir, etl_prefix + '_logging.csv')
-    path_file_block = os.path.join(tmp_dir, etl_prefix + '_block.csv')
-    path_file_newuser = os.path.join(tmp_dir, etl_prefix + '_user_new.csv')
-    path_file_rights = os.path.join(tmp_dir, etl_prefix + '_user_level.csv')
-    # Delete previous versions of tmp files if present
-    if os.path.isfile(path_file_logitem):
-        os.remove(path_file_logitem)
-    if os.path.isfile(path_file_block):
-        os.remove(path_file_block)
-    if os.path.isfile(path_file_newuser):
-        os.remove(path_file_newuser)
-    if os.path.isfile(path_file_rights):
-        os.remove(path_file_rights)
+    if bulk_load is None:
+        bulk_load = BulkLoad()
+    loader = bulk_load.loader(con)
+    if metrics is not None:
+        metrics.loaders.append(loader)
+    writer = bulk_load.writer(loader, 'logging', tmp_dir, etl_prefix)
+    writer_block = bulk_load.writer(loader, 'block', tmp_dir, etl_prefix)
+    writer_new = bulk_load.writer(loader, 'user_new', tmp_dir, etl_prefix)
+    writer_rights = bulk_load.writer(loader, 'user_level', tmp_dir,
+                                     etl_prefix)
+    writers = (writer, writer_block, writer_new, writer_rights)
 
     for logdict in log_iter:
         total_logs += 1
@@ -380,36 +365,15 @@ def logitem_file_to_db(log_iter, con=None, log_file=None,
         newuser = logdict['newuser']
         rights = logdict['rights']
 
-        # Initialize new temp data file
-        if insert_rows == 0:
-            # In this case, buffer size to trigger data load only tracks
-            # num. of logitems already processed. We take the same mark to
-            # load data for all associated tables
-            file_logitem = open(path_file_logitem, 'w')
-            writer = csv.writer(file_logitem, dialect='excel-tab',
-                                lineterminator='\n')
-            file_block = open(path_file_block, 'w')
-            writer_block = csv.writer(file_block, dialect='excel-tab',
-                                      lineterminator='\n')
-            file_newuser = open(path_file_newuser, 'w')
-            writer_new = csv.writer(file_newuser, dialect='excel-tab',
-                                    lineterminator='\n')
-            file_rights = open(path_file_rights, 'w')
-            writer_rights = csv.writer(file_rights, dialect='excel-tab',
-                                       lineterminator='\n')
-        # Write data to tmp file
+        # Write data to chunks
         try:
-            writer.writerow([s if isinstance(s, str)
-                             else str(s) for s in logitem])
+            writer.writerow(logitem)
             if block:
-                writer_block.writerow([s if isinstance(s, str)
-                                       else str(s) for s in block])
+                writer_block.writerow(block)
             if newuser:
-                writer_new.writerow([s if isinstance(s, str)
-                                     else str(s) for s in newuser])
+                writer_new.writerow(newuser)
             if rights:
-                writer_rights.writerow([s if isinstance(s, str)
-                                        else str(s) for s in rights])
+                writer_rights.writerow(rights)
         except Exception as e:
             print("Error writing logitem temp files...")
             print(e)
@@ -417,17 +381,13 @@ def logitem_file_to_db(log_iter, con=None, log_file=None,
 
         insert_rows += 1
 
-        # Call MySQL to load data from file and reset rows counter
+        # Hand chunks to loader and reset rows counter
         if insert_rows == file_rows:
-            file_logitem.close()
-            con.send_query(insert_logitem % path_file_logitem)
-
-            file_block.close()
-            con.send_query(insert_block % path_file_block)
-            file_newuser.close()
-            con.send_query(insert_newuser % path_file_newuser)
-            file_rights.close()
-            con.send_query(insert_rights % path_file_rights)
+            # In this case, buffer size to trigger data load only tracks
+            # num. of logitems already processed. We take the same mark to
+            # load data for all associated tables
+            for chunk_writer in writers:
+                chunk_writer.rotate()
 
             logging.info("%s logitems %s." % (
                          total_logs,
@@ -435,21 +395,11 @@ def logitem_file_to_db(log_iter, con=None, log_file=None,
                                        time.localtime())))
             # Reset row counter
             insert_rows = 0
-            # No need to delete tmp files, as they are empty each time we
-            # open them again for writing
-
-    # Load remaining entries in last tmp files into DB
-    file_logitem.close()
-    file_block.close()
-    file_newuser.close()
-    file_rights.close()
-
-    con.send_query(insert_logitem % path_file_logitem)
-    con.send_query(insert_block % path_file_block)
-    con.send_query(insert_newuser % path_file_newuser)
-    con.send_query(insert_rights % path_file_rights)
-    # TODO: Clean tmp files, uncomment the following lines
-    # os.remove(path_file_logitem)
+
+    # Load remaining entries in last chunks into DB
+    for chunk_writer in writers:
+        chunk_writer.rotate()
+    loader.close()
 
     # Log end of tasks and exit
     logging.info("COMPLETED: %s logging records processed %s." % (
@@ -6,9 +6,8 @@ Created on Sat Mar 29 22:14:09 2014
 """
 import time
 from .data_item import DataItem
+from wikidat.utils.loader import BulkLoad
 import logging
-import csv
-import os
 
 
 class Page(DataItem):
@@ -69,10 +68,17 @@ def pages_to_file(pages_iter):
 
 
 def pages_file_to_db(pages_iter, con=None, log_file=None,
-                     tmp_dir=None, file_rows=1000000, etl_prefix=None):
+                     tmp_dir=None, file_rows=1000000, etl_prefix=None,
+                     bulk_load=None, metrics=None):
     """
     Process page insert items received from iterator. Page inserts are stored
-    in a temp file, then a bulk data load is triggered in MySQL.
+    in chunks of file_rows rows, loaded in MySQL in the background
+    while the next chunk is written (see loader.ChunkLoader).
+
+    Arguments:
+        - bulk_load: Settings of loading of chunks (loader.BulkLoad)
+        - metrics: ProcessMetrics of this process, reporting waits of
+          the loader
     """
     insert_rows = 0
     total_pages = 0
@@ -85,46 +91,32 @@ def pages_file_to_db(pages_iter, con=None, log_file=None,
                  time.strftime("%Y-%m-%d %H:%M:%S %Z",
                                time.localtime())))
 
-    insert_pages = """LOAD DATA INFILE '%s' INTO TABLE page
-                      FIELDS OPTIONALLY ENCLOSED BY '"'
-                      TERMINATED BY '\t' ESCAPED BY '"'
-                      LINES TERMINATED BY '\n'"""
-
-    path_file_page = os.path.join(tmp_dir, etl_prefix + '_page.csv')
-    # Delete previous versions of tmp files if present
-    if os.path.isfile(path_file_page):
-        os.remove(path_file_page)
+    if bulk_load is None:
+        bulk_load = BulkLoad()
+    loader = bulk_load.loader(con)
+    if metrics is not None:
+        metrics.loaders.append(loader)
+    writer = bulk_load.writer(loader, 'page', tmp_dir, etl_prefix)
 
     for page in pages_iter:
         total_pages += 1
 
-        if insert_rows == 0:
-            file_page = open(path_file_page, 'w')
-            writer = csv.writer(file_page, dialect='excel-tab',
-                                lineterminator='\n')
-        # Write data to tmp file
+        # Write data to chunk file
         try:
-            writer.writerow([s if isinstance(s, str)
-                             else str(s) for s in page])
+            writer.writerow(page)
         except Exception as e:
             print(e)
             print(page)
 
         insert_rows += 1
 
-        # Call MySQL to load data from file and reset rows counter
+        # Hand chunk to loader and reset rows counter
         if insert_rows == file_rows:
-            # Insert in DB
-            file_page.close()
-            con.send_query(insert_pages % path_file_page)
+            writer.rotate()
             insert_rows = 0
-            # No need to delete tmp files, as they are empty each time we
-            # open them again for writing
 
-    file_page.close()
-    con.send_query(insert_pages % path_file_page)
-    # Clean tmp files
-#    os.remove(path_file_page)
+    writer.rotate()
+    loader.close()
 
     logging.info("END: %s pages processed %s." % (
                  total_pages,
@@ -19,15 +19,48 @@ Example code for ZeroMQ patterns can be found in the official guide:
 http://zguide.zeromq.org/page:all
 """
 
-import time
 import multiprocessing as mp
+import time
 import zmq
-from wikidat.utils.comutils import send_ujson, recv_ujson
+from wikidat.utils.comutils import Transport, AffinitySender
+from wikidat.utils.metrics import ProcessMetrics
+from wikidat.utils.profiling import profiled
 from .page import Page
 from .revision import Revision
 from .logitem import LogItem
 # from user import User
 
+# Control messages sent by processes to the control channel of their ETL
+# line: READY (input channel set up), STATS (periodic metrics) and DONE
+# (all items processed, with final metrics)
+READY = 'READY'
+STATS = 'STATS'
+DONE = 'DONE'
+# Control messages sent by ETL lines to their persistent Processors: FILE
+# (new dump file) and STOP (no more files)
+FILE = 'FILE'
+STOP = 'STOP'
+
+
+def _as_list(ports):
+    """
+    Normalize a port number or a list of port numbers to a list
+    """
+    if isinstance(ports, (list, tuple)):
+        return list(ports)
+    return [ports]
+
+
+def _notify(control, name, message, stats=None):
+    """
+    Send control message to ETL line, with metrics of this process (number
+    of items received and sent, etc.)
+    """
+    msg = {'msg': message, 'name': name, 'in': 0, 'out': 0}
+    if stats is not None:
+        msg.update(stats)
+    control.send_json(msg)
+
 
 class Producer(mp.Process):
     """
@@ -39,11 +72,32 @@ class Producer(mp.Process):
 
     The example has been modified to support two output queues, one for
     page and another one for revision elements
+
+    Items are sent in batches, with the codecs and endpoints defined by
+    transport (a comutils.Transport object). Push ports are lists with the
+    input port of every downstream Processor: batches are spread among
+    them and each one receives an end of stream frame when the target is
+    exhausted. Finally, DONE is sent to the control channel of the ETL line
+    (control_port). Metrics are also sent every metrics_interval seconds
+    (STATS), if not 0. If profiling (a profiling.Profiling object) is given,
+    the process is profiled and results are written to a file named after
+    the process.
+
+    flow is an optional multiprocessing.Event used by a memory governor
+    (see governor.MemoryGovernor) to throttle the Producer: once every
+    batch of items, it waits until the event is set.
+
+    If revs_affinity is the name of a revision field (e.g. 'page_id'),
+    consecutive revisions with the same value go to the same Processor
+    (see comutils.AffinitySender), so revision workers see every revision
+    of a page in order. With shm transport, every revision Processor must
+    then have its own ring.
     """
     def __init__(self, group=None, target=None, name=None, args=None,
                  kwargs=None, consumers=0, push_pages_port=None,
                  push_revs_port=None, push_logs_port=None,
-                 control_port=None):
+                 control_port=None, transport=None, metrics_interval=0,
+                 profiling=None, flow=None, revs_affinity=None):
 
         super(Producer, self).__init__(name=name)
         self.target = target
@@ -54,58 +108,91 @@ class Producer(mp.Process):
         self.push_revs_port = push_revs_port
         self.push_logs_port = push_logs_port
         self.control_port = control_port
+        self.transport = transport if transport is not None else Transport()
+        self.metrics_interval = metrics_interval
+        self.profiling = profiling
+        self.flow = flow
+        self.revs_affinity = revs_affinity
+
+    def _sender(self, context, ports, affinity=None):
+        """
+        Return sender of items to channels identified by ports, keeping
+        items with the same value of field affinity on the same channel
+        """
+        if affinity is not None and len(_as_list(ports)) > 1:
+            return AffinitySender([self._sender(context, port)
+                                   for port in _as_list(ports)], affinity)
+        if self.transport.is_shm():
+            # All Processors read from the same ring
+            return self.transport.sender(_as_list(ports)[0])
+        channels = []
+        for port in _as_list(ports):
+            channel = self.transport.configure(context.socket(zmq.PUSH))
+            channel.connect(self.transport.endpoint(port))
+            channels.append(channel)
+        return self.transport.sender(channels)
 
     def run(self):
+        with profiled(self.name, self.profiling):
+            self.work()
+
+    def work(self):
         target = self.target
 
         # Set up sending ZMQ data and control channels
         context = zmq.Context()
+        senders = []
 
         if (self.push_pages_port):
-            channel_pages_send = context.socket(zmq.PUSH)
-            channel_pages_send.bind("tcp://127.0.0.1:%s" %
-                                    self.push_pages_port)
+            pages_send = self._sender(context, self.push_pages_port)
+            senders.append(pages_send)
 
         if (self.push_revs_port):
-            channel_revs_send = context.socket(zmq.PUSH)
-            channel_revs_send.bind("tcp://127.0.0.1:%s" %
-                                   self.push_revs_port)
+            revs_send = self._sender(context, self.push_revs_port,
+                                     affinity=self.revs_affinity)
+            senders.append(revs_send)
 
         if (self.push_logs_port):
-            channel_logs_send = context.socket(zmq.PUSH)
-            channel_logs_send.bind("tcp://127.0.0.1:%s" %
-                                   self.push_logs_port)
-
-        channel_control = context.socket(zmq.PUB)
-        channel_control.bind("tcp://127.0.0.1:%s" %
-                             self.control_port)
+            logs_send = self._sender(context, self.push_logs_port)
+            senders.append(logs_send)
 
-        # Wait a second to wake up and connect
-        time.sleep(1)
+        channel_control = context.socket(zmq.PUSH)
+        channel_control.connect(self.transport.endpoint(self.control_port))
+        metrics = ProcessMetrics(self.metrics_interval)
+        metrics.senders = senders
+        count = 0
 
         for item in target(*self.args, **self.kwargs):
             # Classify outcome elements in their corresponding queue
             # for later processing
             if isinstance(item, Page):
-                send_ujson(channel_pages_send, item)
+                pages_send.send(item)
 
             elif isinstance(item, Revision):
-                send_ujson(channel_revs_send, item)
+                revs_send.send(item)
 
             elif isinstance(item, LogItem):
-                send_ujson(channel_logs_send, item)
+                logs_send.send(item)
 
-        # Wait few seconds to let workers empty data pipeline
-        time.sleep(20)
-        #channel_pages_send.close()
-        #channel_revs_send.close()
+            count += 1
+            if (self.flow is not None and
+                    count % self.transport.batch_size == 0 and
+                    not self.flow.is_set()):
+                start = time.time()
+                self.flow.wait()
+                metrics.throttle_wait += time.time() - start
 
-        # Send STOP message to all workers and quit
-        if self.consumers > 0:
-            channel_control.send_string('STOP')
+            if metrics.due():
+                _notify(channel_control, self.name, STATS,
+                        metrics.snapshot())
 
-        time.sleep(5)
-        #channel_control.close()
+        # Send end of stream to all workers and quit
+        for sender in senders:
+            sender.send_stop()
+        _notify(channel_control, self.name, DONE, metrics.snapshot())
+
+        # Pending messages are delivered before terminating context
+        context.destroy(linger=-1)
 
 
 class Consumer(mp.Process):
@@ -115,9 +202,19 @@ class Consumer(mp.Process):
 
     The "target" must be a function which expects an iterable as it's
     only argument.  Therefore, the args value is not used here.
+
+    Items are consumed until an end of stream frame has been received from
+    each producer. READY and DONE are sent to the control channel of the
+    ETL line (control_port), as well as metrics every metrics_interval
+    seconds (STATS), if not 0. Processes are profiled as Producers if
+    profiling is given. With target_metrics, the ProcessMetrics of the
+    process are passed to the target (metrics keyword argument), so that it
+    can report its own waits (e.g. waits of chunk loaders).
     """
     def __init__(self, group=None, target=None, name=None, args=None,
-                 kwargs=None, producers=0, pull_port=None):
+                 kwargs=None, producers=0, pull_port=None,
+                 control_port=None, transport=None, metrics_interval=0,
+                 profiling=None, target_metrics=False):
 
         super(Consumer, self).__init__(name=name)
         self.target = target
@@ -125,32 +222,91 @@ class Consumer(mp.Process):
         self.kwargs = kwargs if kwargs is not None else {}
         self.producers = producers
         self.pull_port = pull_port
+        self.control_port = control_port
+        self.transport = transport if transport is not None else Transport()
+        self.metrics_interval = metrics_interval
+        self.profiling = profiling
+        self.target_metrics = target_metrics
+        self.items_in = 0
+        self.metrics = None
+        self.channel_control = None
+
+    def receiver(self, context):
+        """
+        Set up input channel and return its receiver
+        """
+        if self.transport.is_shm():
+            return self.transport.receiver(_as_list(self.pull_port)[0])
+        data_recv = self.transport.configure(context.socket(zmq.PULL))
+        data_recv.bind(self.transport.endpoint(self.pull_port))
+        return self.transport.receiver(data_recv)
+
+    def items(self, receiver):
+        """
+        Yield items received until all producers have sent end of stream.
+
+        If producers is None (persistent processes, serving several dump
+        files) the number of expected end of stream frames is only known
+        once a STOP control message arrives from the ETL line. FILE control
+        messages announce each new dump file, along with the number of end
+        of stream frames that will have been received when it is finished.
+        """
+        expected = self.producers
+        received = 0
+        files = []
+        while expected is None or received < expected:
+            batch = receiver.recv()
+            if batch is None:
+                received += 1
+                while files and received >= files[0]['eos']:
+                    print(self.name, "finished file", files.pop(0)['file'])
+            elif isinstance(batch, dict):
+                if batch['msg'] == FILE:
+                    print(self.name, "processing file", batch['file'])
+                    files.append(batch)
+                elif batch['msg'] == STOP:
+                    expected = batch['eos']
+            else:
+                self.items_in += len(batch)
+                if self.metrics.due():
+                    _notify(self.channel_control, self.name, STATS,
+                            self.metrics.snapshot(self.items_in))
+                for item in batch:
+                    yield item
+
+    def setup(self, context):
+        """
+        Connect control channel, set up input channel and metrics. Returns
+        receiver of input channel.
+        """
+        self.channel_control = context.socket(zmq.PUSH)
+        self.channel_control.connect(
+            self.transport.endpoint(self.control_port))
+        receiver = self.receiver(context)
+        self.metrics = ProcessMetrics(self.metrics_interval)
+        self.metrics.receiver = receiver
+        return receiver
 
-    def items(self):
-        context = zmq.Context()
-        data_recv = context.socket(zmq.PULL)
-        data_recv.bind("tcp://127.0.0.1:"+str(self.pull_port))
-
-        # Wait a second to wake up and connect
-        time.sleep(1)
+    def run(self):
+        with profiled(self.name, self.profiling):
+            self.work()
 
-        while self.producers > 0:
-            while True:
-                item = recv_ujson(data_recv)
-                if item == 'STOP':
-                    break
-                yield item
-            self.producers -= 1
+    def work(self):
+        context = zmq.Context()
+        receiver = self.setup(context)
+        _notify(self.channel_control, self.name, READY)
 
-        time.sleep(1)
-        #data_recv.close()
+        kwargs = dict(self.kwargs)
+        if self.target_metrics:
+            kwargs['metrics'] = self.metrics
+        self.target(self.items(receiver), **kwargs)
 
-    def run(self):
-        target = self.target
-        target(self.items(), **self.kwargs)
+        _notify(self.channel_control, self.name, DONE,
+                self.metrics.snapshot(self.items_in))
+        context.destroy(linger=-1)
 
 
-class Processor(mp.Process):
+class Processor(Consumer):
     """
     Consumes items from a ZMQ pipeline, coming from a Producer and sent them
     downstream to a Consumer.
@@ -158,70 +314,48 @@ class Processor(mp.Process):
     The "target" must be a generator function which yields
     pickable items derived from DataItems and which expects an iterable as its
     only argument.  Therefore, the args value is not used here.
+
+    Each Processor binds its own pull_port, to which all Producers (e.g.
+    shards of the same dump file) connect. With shared memory rings, all
+    Processors of the same type read from the same ring. Items are consumed
+    until an end of stream frame has been received from each producer,
+    then end of stream is sent downstream. With producers=None, the
+    Processor stays alive across dump files until the ETL line sends STOP.
     """
     def __init__(self, group=None, target=None, name=None, args=None,
                  kwargs=None, producers=0, consumers=0,
-                 pull_port=None, push_port=None, control_port=None):
-        super(Processor, self).__init__(name=name)
-        self.target = target  # String with method name, not method itself
-        self.args = args if args is not None else []
-        self.kwargs = kwargs if kwargs is not None else {}
-        self.producers = producers
+                 pull_port=None, push_port=None, control_port=None,
+                 transport=None, metrics_interval=0, profiling=None):
+        super(Processor, self).__init__(name=name, target=target,
+                                        kwargs=kwargs, producers=producers,
+                                        pull_port=pull_port,
+                                        control_port=control_port,
+                                        transport=transport,
+                                        metrics_interval=metrics_interval,
+                                        profiling=profiling)
         self.consumers = consumers
-        self.pull_port = pull_port
         self.push_port = push_port
-        self.control_port = control_port
-
-    def items(self):
-        context = zmq.Context()
-        data_recv = context.socket(zmq.PULL)
-        data_recv.connect("tcp://127.0.0.1:%s" % self.pull_port)
-
-        control_sub = context.socket(zmq.SUB)
-        control_sub.connect("tcp://127.0.0.1:%s" % self.control_port)
-        control_sub.setsockopt_string(zmq.SUBSCRIBE, "STOP")
 
-        # Wait a second to wake up and connect
-        time.sleep(1)
-
-        # Initialize poll set
-        poller = zmq.Poller()
-        poller.register(data_recv, zmq.POLLIN)
-        poller.register(control_sub, zmq.POLLIN)
-
-        while self.producers > 0:
-            # Work on requests from pipelining and control channel
-            while True:
-                socks = dict(poller.poll())
-                if data_recv in socks and socks[data_recv] == zmq.POLLIN:
-                    yield(recv_ujson(data_recv))
-
-                if control_sub in socks and socks[control_sub] == zmq.POLLIN:
-                    message = control_sub.recv_string()
-                    if message == "STOP":
-                        print("Received STOP %s" % self.name)
-                        break  # Exit poll loop
-
-            self.producers -= 1
-
-        time.sleep(1)
-        #data_recv.close()
-        #control_sub.close()
-
-    def run(self):
+    def work(self):
         target = self.target
         context = zmq.Context()
-        channel_send = context.socket(zmq.PUSH)
-        channel_send.connect("tcp://127.0.0.1:" + str(self.push_port))
-
-        # Wait a second to wake up and connect
-        time.sleep(1)
-
-        for item in target(self.items(), **self.kwargs):
-            send_ujson(channel_send, item)
-
-        for x in range(self.consumers):
-            send_ujson(channel_send, 'STOP')
 
-        time.sleep(1)
-        #channel_send.close()
+        if self.transport.is_shm():
+            sender = self.transport.sender(self.push_port)
+        else:
+            channel_send = self.transport.configure(
+                context.socket(zmq.PUSH))
+            channel_send.connect(self.transport.endpoint(self.push_port))
+            sender = self.transport.sender(channel_send)
+
+        receiver = self.setup(context)
+        self.metrics.senders = [sender]
+        _notify(self.channel_control, self.name, READY)
+
+        for item in target(self.items(receiver), **self.kwargs):
+            sender.send(item)
+        sender.send_stop()
+
+        _notify(self.channel_control, self.name, DONE,
+                self.metrics.snapshot(self.items_in))
+        context.destroy(linger=-1)
@@ -4,14 +4,16 @@ Created on Sat Mar 29 22:13:42 2014
 
 @author: jfelipe
 """
+import collections
 import hashlib
 import time
-from wikidat.utils import maps
 from .data_item import DataItem
-import csv
-import os
-import redis
+from .userstore import UserStore
+from .templates import get_detector
+from .linediff import PageDiffer
+from wikidat.utils.loader import BulkLoad
 import ipaddress
+import itertools
 import logging
 
 
@@ -44,16 +46,9 @@ def process_revs(rev_iter, con=None, lang=None):
         - lang: identifier of Wikipedia language edition from which this
         element comes from (e.g. frwiki, eswiki, dewiki...)
     """
-    # Get tags to identify Featured Articles, Featured Lists and
-    # Good Articles
-
-    if ((lang in maps.FA_RE) and (lang in maps.FLIST_RE) and
-            (lang in maps.GA_RE)):
-        fa_pat = maps.FA_RE[lang]
-        flist_pat = maps.FLIST_RE[lang]
-        ga_pat = maps.GA_RE[lang]
-    else:
-        raise RuntimeError('Unsupported language ' + lang)
+    # Detector of templates of Featured Articles, Featured Lists and
+    # Good Articles (raises RuntimeError for unsupported languages)
+    detector = get_detector(lang)
 
     for rev in rev_iter:
         contrib_dict = rev['contrib_dict']
@@ -81,35 +76,18 @@ def process_revs(rev_iter, con=None, lang=None):
             if rev['text'][0:9].upper() == '#REDIRECT':
                 rev['redirect'] = '1'
 
-            # FA and FList detection
+            # FA, FList and GA detection, all templates in one pass
             # Currently 39 languages are supported regarding FA detection
             # We only enter pattern matching for revisions of pages in
             # main namespace
             if rev['ns'] == '0':
-                if fa_pat is not None:
-                    mfa = fa_pat.search(rev['text'])
-                    # Case of standard language, one type of FA template
-                    if (mfa is not None and len(mfa.groups()) == 1):
-                        rev['is_fa'] = '1'
-                    # Case of fawiki or cawiki, 2 types of FA templates
-                    # Possible matches: (A, None) or (None, B)
-                    if lang == 'fawiki' or lang == 'cawiki':
-                        if (mfa is not None and len(mfa.groups()) == 2 and
-                                (mfa.groups()[1] is None or
-                                 mfa.groups()[0] is None)):
-                                    rev['is_fa'] = '1'
-
-                # Check if FLIST is supported in this language, detect if so
-                if flist_pat is not None:
-                    mflist = flist_pat.search(rev['text'])
-                    if mflist is not None and len(mflist.groups()) == 1:
-                        rev['is_flist'] = '1'
-
-                # Check if GA is supported in this language, detect if so
-                if ga_pat is not None:
-                    mga = ga_pat.search(rev['text'])
-                    if mga is not None and len(mga.groups()) == 1:
-                        rev['is_ga'] = '1'
+                is_fa, is_flist, is_ga = detector.detect(rev['text'])
+                if is_fa:
+                    rev['is_fa'] = '1'
+                if is_flist:
+                    rev['is_flist'] = '1'
+                if is_ga:
+                    rev['is_ga'] = '1'
         # Compute hash for empty text here instead of in default block above
         # This way, we avoid computing the hash twice for revisions with text
         else:
@@ -255,37 +233,190 @@ def process_revs(rev_iter, con=None, lang=None):
         text_hash = None
 
 
-def revs_to_file(rev_iter, lang=None):
+# Supported modes to compute hashes of revision text stored in revision_hash
+# - sha256: SHA-256 hex digest of text (default)
+# - sha1: SHA-1 in base36, as provided by dump files
+# - sha1_hex: SHA-1 hex digest, converted from dump files
+HASH_MODES = ('sha256', 'sha1', 'sha1_hex')
+
+BASE36_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def sha1_to_base36(digest):
+    """
+    Convert SHA-1 hex digest to base36 format used in dump files
+    (31 digits, padded with zeros)
+    """
+    num = int(digest, 16)
+    digits = []
+    while num:
+        num, rem = divmod(num, 36)
+        digits.append(BASE36_DIGITS[rem])
+    return ''.join(reversed(digits)).rjust(31, '0')
+
+
+def rev_hash_value(rev, text=None, hash_mode='sha256'):
+    """
+    Return hash of revision text to be stored in revision_hash table.
+
+    In sha1 modes the SHA-1 provided by the dump is reused, and a digest
+    is only computed when the dump value is missing.
+
+    Arguments:
+        - rev: Revision object
+        - text: text of revision encoded in UTF-8 (encoded here if needed)
+        - hash_mode: one of HASH_MODES
+    """
+    if hash_mode == 'sha256' or not rev.get('sha1'):
+        if text is None:
+            text = rev['text'].encode() if rev['text'] is not None else b''
+        if hash_mode == 'sha256':
+            return hashlib.sha256(text).hexdigest()
+        elif hash_mode == 'sha1':
+            return sha1_to_base36(hashlib.sha1(text).hexdigest())
+        elif hash_mode == 'sha1_hex':
+            return hashlib.sha1(text).hexdigest()
+    elif hash_mode == 'sha1':
+        return rev['sha1']
+    elif hash_mode == 'sha1_hex':
+        return '%040x' % int(rev['sha1'], 36)
+    raise RuntimeError('Unsupported hash mode ' + str(hash_mode))
+
+
+class TextCache(object):
+    """
+    Bounded LRU of fields derived from the text of revisions of the current
+    page (len_text, redirect, is_fa, is_flist, is_ga and hash of text).
+    Reverts and vandalism cycles restore the same text many times in a
+    page, so these fields are only computed once for each distinct text.
+
+    Texts are identified by the SHA-1 provided by the dump or, if it is
+    missing, by their length and Python hash. The cache is emptied when
+    revisions of a new page arrive.
+
+    Arguments:
+        - size = Max. number of distinct texts kept
+    """
+    def __init__(self, size=64):
+        self.size = size
+        self.page_id = None
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(rev):
+        if rev.get('sha1'):
+            return rev['sha1']
+        return (len(rev['text']), hash(rev['text']))
+
+    def get(self, page_id, key):
+        """
+        Return cached fields of text key in page page_id, None if missing
+        """
+        if page_id != self.page_id:
+            self.entries.clear()
+            self.page_id = page_id
+        fields = self.entries.get(key)
+        if fields is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return fields
+
+    def put(self, key, fields):
+        self.entries[key] = fields
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def rev_user(rev, contrib_dict, users):
+    """
+    Return user id of the author of a revision, storing user info in the
+    user store (see userstore): usernames and usernames without user id
+    """
+    # Case of known user
+    if len(contrib_dict) > 0:
+        # Anonymous user, IP address is returned by rev_ip
+        if 'ip' in contrib_dict:
+            user = 0
+        # Registered user
+        else:
+            user = int(contrib_dict['id'])
+            username = contrib_dict['username']
+            # Case of missing user id but w/ username
+            # The username is probably invalid now,
+            # insert in separate table
+            if user == 0:
+                user = -2  # Special value for case: (NULL, username)
+                users.add_user_zero(int(rev['id']), username)
+            # Username is known. Strange cases of user ID w/o username
+            # are stored w/o username, unless the user is already known
+            users.add_user(user, username)
+    # Case of unknown user: neither user_id nor user_name
+    else:
+        user = -1  # Special value
+    return user
+
+
+def rev_ip(rev, contrib_dict):
+    """
+    Return tuple of revision_IP values (rev_id, IP address as integer) for
+    revisions of anonymous editors, None for other revisions
+    """
+    if 'ip' not in contrib_dict:
+        return None
+    return (int(rev['id']),
+            int(ipaddress.ip_address(str(contrib_dict['ip']))))
+
+
+def revs_to_file(rev_iter, lang=None, hash_mode='sha256', user_store=None,
+                 text_cache=64, rev_diff=False):
     """
     Process iterator of Revision objects extracted from dump files
+
+    Yields tuples (rev_insert, rev_hash, rev_ip, rev_diff) with values of
+    revision, revision_hash, revision_IP (None if revision is not
+    anonymous) and revision_diff (None if disabled). Revisions of each
+    page must arrive in order to compute diffs (see linediff).
     :Parameters:
         - rev_iter: iterator of Revision objects
         - lang: identifier of Wikipedia language edition from which this
         element comes from (e.g. frwiki, eswiki, dewiki...)
+        - hash_mode: hash of revision text stored in revision_hash (see
+        HASH_MODES). In sha1 modes, length of text is also taken from the
+        dump, so text is not encoded.
+        - user_store: store of user info (userstore.UserStore), Redis on
+        localhost by default
+        - text_cache: max. number of distinct texts of each page whose
+        derived fields are cached (see TextCache), 0 disables the cache
+        - rev_diff: compute lines and bytes added and removed with respect
+        to the previous revision of the page (see linediff)
     """
-    # Initialize connections to Redis DBs
-    redis_cache = redis.Redis(host='localhost')
-
-    # Get tags to identify Featured Articles, Featured Lists and
-    # Good Articles
-    if ((lang in maps.FA_RE) and (lang in maps.FLIST_RE) and
-            (lang in maps.GA_RE)):
-        fa_pat = maps.FA_RE[lang]
-        flist_pat = maps.FLIST_RE[lang]
-        ga_pat = maps.GA_RE[lang]
-    else:
-        raise RuntimeError('Unsupported language ' + lang)
+    # Initialize connection to store of user info
+    if user_store is None:
+        user_store = UserStore()
+    users = user_store.open(lang)
+
+    # Detector of templates of Featured Articles, Featured Lists and
+    # Good Articles (raises RuntimeError for unsupported languages)
+    detector = get_detector(lang)
+    cache = TextCache(text_cache) if text_cache else None
+    differ = PageDiffer() if rev_diff else None
 
     for rev in rev_iter:
         contrib_dict = rev['contrib_dict']
 
         # ### TEXT-RELATED OPERATIONS ###
-        # Calculate SHA-256 hash, length of revision text and check
+        # Calculate hash, length of revision text and check
         # for REDIRECT
         # TODO: Inspect why there are pages without text
-
-        # Stores SHA-256 hash of revision text
-        text_hash = hashlib.sha256()
+        text = None
         # Default values to 0. These fields will be set below if any of the
         # target patterns is detected
         rev['redirect'] = '0'
@@ -293,83 +424,52 @@ def revs_to_file(rev_iter, lang=None):
         rev['is_flist'] = '0'
         rev['is_ga'] = '0'
 
-        if rev['text'] is not None:
-            text = rev['text'].encode()
-            text_hash.update(text)
-            rev['len_text'] = str(len(text))
+        if rev['text'] is not None and cache is not None:
+            # Same text seen in a previous revision of this page
+            cache_key = TextCache.key(rev)
+            fields = cache.get(rev['page_id'], cache_key)
+        else:
+            fields = None
+
+        if fields is not None:
+            (rev['len_text'], rev['redirect'], rev['is_fa'],
+             rev['is_flist'], rev['is_ga'], text_hash) = fields
+        elif rev['text'] is not None:
+            # Length of text is already provided by the dump
+            if hash_mode != 'sha256' and rev.get('text_bytes') is not None:
+                rev['len_text'] = rev['text_bytes']
+            else:
+                text = rev['text'].encode()
+                rev['len_text'] = str(len(text))
 
             # Detect pattern for redirect pages
             if rev['text'][0:9].upper() == '#REDIRECT':
                 rev['redirect'] = '1'
 
-            # FA and FList detection
+            # FA, FList and GA detection, all templates in one pass
             # Currently 39 languages are supported regarding FA detection
             # We only enter pattern matching for revisions of pages in
             # main namespace
             if rev['ns'] == '0':
-                if fa_pat is not None:
-                    mfa = fa_pat.search(rev['text'])
-                    # Case of standard language, one type of FA template
-                    if (mfa is not None and len(mfa.groups()) == 1):
-                        rev['is_fa'] = '1'
-                    # Case of fawiki or cawiki, 2 types of FA templates
-                    # Possible matches: (A, None) or (None, B)
-                    if lang == 'fawiki' or lang == 'cawiki':
-                        if (mfa is not None and len(mfa.groups()) == 2 and
-                                (mfa.groups()[1] is None or
-                                 mfa.groups()[0] is None)):
-                                    rev['is_fa'] = '1'
-
-                # Check if FLIST is supported in this language, detect if so
-                if flist_pat is not None:
-                    mflist = flist_pat.search(rev['text'])
-                    if mflist is not None and len(mflist.groups()) == 1:
-                        rev['is_flist'] = '1'
-
-                # Check if GA is supported in this language, detect if so
-                if ga_pat is not None:
-                    mga = ga_pat.search(rev['text'])
-                    if mga is not None and len(mga.groups()) == 1:
-                        rev['is_ga'] = '1'
-        # Compute hash for empty text here instead of in default block above
-        # This way, we avoid computing the hash twice for revisions with text
+                is_fa, is_flist, is_ga = detector.detect(rev['text'])
+                if is_fa:
+                    rev['is_fa'] = '1'
+                if is_flist:
+                    rev['is_flist'] = '1'
+                if is_ga:
+                    rev['is_ga'] = '1'
+
+            text_hash = rev_hash_value(rev, text=text, hash_mode=hash_mode)
+            if cache is not None:
+                cache.put(cache_key, (rev['len_text'], rev['redirect'],
+                                      rev['is_fa'], rev['is_flist'],
+                                      rev['is_ga'], text_hash))
         else:
             rev['len_text'] = '0'
-            text_hash.update(b'')
+            text_hash = rev_hash_value(rev, hash_mode=hash_mode)
 
         # USER PROCESSING
-        # Case of known user
-        if len(contrib_dict) > 0:
-            # Anonymous user
-            if 'ip' in contrib_dict:
-                user = 0
-                ip = str(contrib_dict['ip'])
-                redis_cache.hset(lang + ':revsanon', int(rev['id']),
-                                 int(ipaddress.ip_address(ip)))
-            # Registered user
-            else:
-                user = int(contrib_dict['id'])
-                username = contrib_dict['username']
-                # Case of missing user id but w/ username
-                # The username is probably invalid now,
-                # insert in separate table
-                if user == 0:
-                    user = -2  # Special value for case: (NULL, username)
-                    redis_cache.hset(lang + ':userzero', int(rev['id']),
-                                     username)
-                # Username is known
-                if username is not None:
-                    redis_cache.hset(lang + ':users', user, username)
-                # Handle strange cases of user ID w/o username
-                else:
-                    stored_name = redis_cache.hget(lang + ':users', user)
-                    # If user is not known, then insert entry w/o username
-                    # Otherwise, skip and wait for other entry w/ username
-                    if not stored_name:
-                        redis_cache.hset(lang + ':users', user, '')
-        # Case of unknown user: neither user_id nor user_name
-        else:
-            user = -1  # Special value
+        user = rev_user(rev, contrib_dict, users)
 
         # Tuple of revision values
         rev_insert = (int(rev['id']), int(rev['page_id']), int(user),
@@ -387,33 +487,111 @@ def revs_to_file(rev_iter, lang=None):
 
         # Tuple of revision_hash values
         rev_hash = (int(rev['id']), int(rev['page_id']), int(user),
-                    text_hash.hexdigest(),
+                    text_hash,
                     )
 
-        yield (rev_insert, rev_hash)
+        yield (rev_insert, rev_hash, rev_ip(rev, contrib_dict),
+               differ.diff(rev, rev['text']) if differ is not None else None)
 
         rev = None
         contrib_dict = None
         text = None
-        text_hash = None
         # TODO: Handle disconnection of clients from Redis server??
+    users.close()
+    if cache is not None and cache.hits + cache.misses:
+        print("Text cache: %s hits, %s misses (hit rate %.1f%%)" % (
+              cache.hits, cache.misses, 100.0 * cache.hit_rate()))
+    if differ is not None and differ.missing:
+        print("Diffs: %s revisions without previous revision of their "
+              "page" % differ.missing)
+
+
+def revs_meta_to_file(rev_iter, lang=None, hash_mode='sha1',
+                      user_store=None):
+    """
+    Process iterator of Revision objects extracted from stub-meta-history
+    dump files (metadata only, without revision text)
+
+    Yields the same tuples as revs_to_file. Length of revisions is read
+    from the bytes attribute of text elements and revision_hash stores the
+    SHA-1 provided by the dump. Redirects, FA, FLIST and GA cannot
+    be detected without text, so they are always set to 0, and there are
+    no diffs.
+    :Parameters:
+        - rev_iter: iterator of Revision objects
+        - lang: identifier of Wikipedia language edition from which this
+        element comes from (e.g. frwiki, eswiki, dewiki...)
+        - hash_mode: 'sha1' (base36) or 'sha1_hex'. SHA-256 cannot be
+        computed without text, so 'sha256' falls back to 'sha1'.
+        - user_store: store of user info (userstore.UserStore), Redis on
+        localhost by default
+    """
+    if hash_mode == 'sha256':
+        hash_mode = 'sha1'
+    # Initialize connection to store of user info
+    if user_store is None:
+        user_store = UserStore()
+    users = user_store.open(lang)
+
+    for rev in rev_iter:
+        contrib_dict = rev['contrib_dict']
+
+        # USER PROCESSING
+        user = rev_user(rev, contrib_dict, users)
+
+        # Tuple of revision values
+        rev_insert = (int(rev['id']), int(rev['page_id']), int(user),
+                      rev['timestamp'].replace('Z', '').replace('T', ' '),
+                      int(rev.get('text_bytes') or 0),
+                      (int(rev['rev_parent_id'])
+                       if rev['rev_parent_id'] is not None else u'NULL'),
+                      0,
+                      (0 if 'minor' in rev else 1),
+                      0, 0, 0,
+                      (rev['comment'] if 'comment' in rev and
+                       rev['comment'] is not None else u'NULL'),
+                      )
+
+        # Tuple of revision_hash values
+        rev_hash = (int(rev['id']), int(rev['page_id']), int(user),
+                    (rev_hash_value(rev, hash_mode=hash_mode)
+                     if rev.get('sha1') else ''),
+                    )
+
+        yield (rev_insert, rev_hash, rev_ip(rev, contrib_dict), None)
+
+        rev = None
+        contrib_dict = None
+    users.close()
 
 
 def revs_file_to_db(rev_iter, con=None, log_file=None,
-                    tmp_dir=None, file_rows=1000000, etl_prefix=None):
+                    tmp_dir=None, file_rows=1000000, etl_prefix=None,
+                    bulk_load=None, metrics=None):
     """
     Processor to insert revision info in DB
 
-    This version uses an intermediate temp data file to speed up bulk data
-    loading in MySQL/MariaDB, using LOAD DATA INFILE.
+    This version uses intermediate chunks (files or in-memory buffers) to
+    speed up bulk data loading in MySQL/MariaDB, using LOAD DATA INFILE
+    (see loader.BulkLoad). Chunks of each table
+    are loaded in the background while the next ones are written, and
+    different tables are loaded concurrently (see loader.ChunkLoader). IP
+    addresses of anonymous revisions and diff statistics are loaded in
+    revision_IP and revision_diff along with each chunk of revisions.
 
     Arguments:
-        - rev_iter: Iterator providing tuples (rev_insert, rev_hash_insert)
+        - rev_iter: Iterator providing tuples (rev_insert, rev_hash_insert,
+          rev_ip_insert, rev_diff_insert), rev_ip_insert None for
+          non-anonymous revisions and rev_diff_insert None if there is no
+          diff
         - con: Connection to local DB
         - log_file: Log file to track progress of data loading operations
         - tmp_dir: Directory to store temporary data files
-        - file_rows: Number of rows to store in each tmp file
+        - file_rows: Number of rows to store in each chunk
         - etl_prefix: Identifies the ETL process for this worker
+        - bulk_load: Settings of loading of chunks (loader.BulkLoad)
+        - metrics: ProcessMetrics of this process, reporting waits of
+          the loader
     """
     insert_rows = 0
     total_revs = 0
@@ -426,46 +604,30 @@ def revs_file_to_db(rev_iter, con=None, log_file=None,
                  time.strftime("%Y-%m-%d %H:%M:%S %Z",
                                time.localtime())))
 
-    # LOAD REVISION DATA
-    insert_rev = """LOAD DATA INFILE '%s' INTO TABLE revision
-                    FIELDS OPTIONALLY ENCLOSED BY '"'
-                    TERMINATED BY '\t' ESCAPED BY '"'
-                    LINES TERMINATED BY '\n'"""
-
-    insert_rev_hash = """LOAD DATA INFILE '%s' INTO TABLE revision_hash
-                         FIELDS OPTIONALLY ENCLOSED BY '"'
-                         TERMINATED BY '\t' ESCAPED BY '"'
-                         LINES TERMINATED BY '\n'"""
-
-    path_file_rev = os.path.join(tmp_dir, etl_prefix + '_revision.csv')
-    path_file_rev_hash = os.path.join(tmp_dir,
-                                      etl_prefix + '_revision_hash.csv')
-
-    # Delete previous versions of tmp files if present
-    if os.path.isfile(path_file_rev):
-        os.remove(path_file_rev)
-    if os.path.isfile(path_file_rev_hash):
-        os.remove(path_file_rev_hash)
-
-    for rev, rev_hash in rev_iter:
+    if bulk_load is None:
+        bulk_load = BulkLoad()
+    loader = bulk_load.loader(con)
+    if metrics is not None:
+        metrics.loaders.append(loader)
+    writer_rev = bulk_load.writer(loader, 'revision', tmp_dir, etl_prefix)
+    writer_hash = bulk_load.writer(loader, 'revision_hash', tmp_dir,
+                                   etl_prefix)
+    writer_ip = bulk_load.writer(loader, 'revision_IP', tmp_dir, etl_prefix)
+    writer_diff = bulk_load.writer(loader, 'revision_diff', tmp_dir,
+                                   etl_prefix)
+    writers = (writer_rev, writer_hash, writer_ip, writer_diff)
+
+    for rev, rev_hash, rev_ip, rev_diff in rev_iter:
         total_revs += 1
 
-        # Initialize new temp data file
-        if insert_rows == 0:
-            file_rev = open(path_file_rev, 'w')
-            file_rev_hash = open(path_file_rev_hash, 'w')
-            writer = csv.writer(file_rev, dialect='excel-tab',
-                                lineterminator='\n')
-            writer2 = csv.writer(file_rev_hash, dialect='excel-tab',
-                                 lineterminator='\n')
-
-        # Write data to tmp file
+        # Write data to chunk files
         try:
-            writer.writerow([s if isinstance(s, str)
-                             else str(s) for s in rev])
-
-            writer2.writerow([s if isinstance(s, str)
-                              else str(s) for s in rev_hash])
+            writer_rev.writerow(rev)
+            writer_hash.writerow(rev_hash)
+            if rev_ip is not None:
+                writer_ip.writerow(rev_ip)
+            if rev_diff is not None:
+                writer_diff.writerow(rev_diff)
         except Exception as e:
             print("Error writing CSV files with revision info...")
             print(e)
@@ -473,12 +635,10 @@ def revs_file_to_db(rev_iter, con=None, log_file=None,
 
         insert_rows += 1
 
-        # Call MySQL to load data from file and reset rows counter
+        # Hand chunks to loader and reset rows counter
         if insert_rows == file_rows:
-            file_rev.close()
-            file_rev_hash.close()
-            con.send_query(insert_rev % path_file_rev)
-            con.send_query(insert_rev_hash % path_file_rev_hash)
+            for writer in writers:
+                writer.rotate()
 
             logging.info("%s revisions %s." % (
                          total_revs,
@@ -486,155 +646,98 @@ def revs_file_to_db(rev_iter, con=None, log_file=None,
                                        time.localtime())))
             # Reset row counter
             insert_rows = 0
-            # No need to delete tmp files, as they are empty each time we
-            # open them again for writing
 
-    # Load remaining entries in last tmp files into DB
-    file_rev.close()
-    file_rev_hash.close()
-
-    con.send_query(insert_rev % path_file_rev)
-    con.send_query(insert_rev_hash % path_file_rev_hash)
-    # TODO: Clean tmp files, uncomment the following lines
-#    os.remove(path_file_rev)
-#    os.remove(path_file_rev_hash)
+    # Load remaining entries in last chunks into DB
+    for writer in writers:
+        writer.rotate()
+    loader.close()
 
     # Log end of tasks and exit
     logging.info("COMPLETED: %s revisions processed %s." % (
                  total_revs,
                  time.strftime("%Y-%m-%d %H:%M:%S %Z",
                                time.localtime())))
+    logging.info("COMPLETED: %s anonymous revisions processed %s." % (
+                 writer_ip.total,
+                 time.strftime("%Y-%m-%d %H:%M:%S %Z",
+                               time.localtime())))
+    logging.info("COMPLETED: %s revision diffs processed %s." % (
+                 writer_diff.total,
+                 time.strftime("%Y-%m-%d %H:%M:%S %Z",
+                               time.localtime())))
+    logging.info("Loader waits: %.2f s (%.2f s loading %s chunks)." % (
+                 loader.wait, loader.load_time, loader.chunks))
 
 
-def users_file_to_db(con=None, lang=None, log_file=None, tmp_dir=None):
+def users_file_to_db(con=None, lang=None, log_file=None, tmp_dir=None,
+                     user_store=None, bulk_load=None, file_rows=1000000):
     """
     Processor to insert revision info in DB
 
-    This version uses an intermediate temp data file to speed up bulk data
-    loading in MySQL/MariaDB, using LOAD DATA INFILE.
+    This version uses intermediate chunks (files or in-memory buffers) to
+    speed up bulk data loading in MySQL/MariaDB, using LOAD DATA INFILE
+    (see loader.BulkLoad). User info is streamed from the user store
+    straight into chunks of file_rows rows.
 
     Arguments:
         - con: Connection to local DB
         - log_file: Log file to track progress of data loading operations
         - tmp_dir: Directory to store temporary data files
+        - user_store: store of user info (userstore.UserStore), Redis on
+          localhost by default
+        - bulk_load: Settings of loading of chunks (loader.BulkLoad)
+        - file_rows: Number of rows to store in each chunk
     """
     logging.basicConfig(filename=log_file, level=logging.DEBUG)
-    # Initialize connections to Redis DBs
-    redis_cache = redis.Redis(host='localhost', decode_responses=True)
-
-    # Add special values to hash 'users'
-    redis_cache.hset(lang + ':users', 0, 'Anonymous user')
-    redis_cache.hset(lang + ':users', -1, 'NA')
-    redis_cache.hset(lang + ':users', -2, 'Missing ID')
+    # Initialize connection to store of user info
+    if user_store is None:
+        user_store = UserStore()
+    users = user_store.open(lang)
+    if bulk_load is None:
+        bulk_load = BulkLoad()
+    loader = bulk_load.loader(con)
+
+    # Special values of user ids
+    special_users = [(0, 'Anonymous user'), (-1, 'NA'), (-2, 'Missing ID')]
+
+    def write_rows(table, rows, label):
+        """
+        Write rows to chunks of table, returning number of rows
+        """
+        writer = bulk_load.writer(loader, table, tmp_dir, lang)
+        for row in rows:
+            try:
+                writer.writerow(row)
+            except Exception as e:
+                print("Error writing CSV file for %s..." % label)
+                print(e)
+            if writer.rows == file_rows:
+                writer.rotate()
+        writer.rotate()
+        return writer.total
 
     # LOAD USERS DATA
-    # Load user info from Redis cache into persistent DB storage
-    insert_anons = """LOAD DATA INFILE '%s' INTO TABLE revision_IP
-                      FIELDS OPTIONALLY ENCLOSED BY '"'
-                      TERMINATED BY '\t' ESCAPED BY '"'
-                      LINES TERMINATED BY '\n'"""
-
-    insert_users = """LOAD DATA INFILE '%s' INTO TABLE user
-                      FIELDS OPTIONALLY ENCLOSED BY '"'
-                      TERMINATED BY '\t' ESCAPED BY '"'
-                      LINES TERMINATED BY '\n'"""
-
-    insert_users_zero = """LOAD DATA INFILE '%s' INTO TABLE revision_user_zero
-                           FIELDS OPTIONALLY ENCLOSED BY '"'
-                           TERMINATED BY '\t' ESCAPED BY '"'
-                           LINES TERMINATED BY '\n'"""
-    # Anonymous IPs
-    path_file_anons = os.path.join(tmp_dir, lang + '_anon_IPs.csv')
-    # Delete previous versions of tmp files if present
-    if os.path.isfile(path_file_anons):
-        os.remove(path_file_anons)
-
-    file_anons = open(path_file_anons, 'w')
-    writer_anons = csv.writer(file_anons, dialect='excel-tab',
-                              lineterminator='\n')
-
-    list_anons = []
-    for rev_anon in redis_cache.hscan_iter(lang + ':revsanon', count=1000):
-        list_anons.append(rev_anon)  # Makes sure we do not have duplicates
-
-    total_anons = len(list_anons)
-
-    for rev_anon in list_anons:  # Save list of anonymous revs to tmp file
-        try:
-            writer_anons.writerow([s for s in rev_anon])
-        except Exception as e:
-            print("Error writing CSV file for anonymous users...")
-            print(e)
-    file_anons.close()
-    del list_anons
-
+    # Load user info from user store into persistent DB storage
     # Registered users
-    path_file_users = os.path.join(tmp_dir, lang + '_users.csv')
-    # Delete previous versions of tmp files if present
-    if os.path.isfile(path_file_users):
-        os.remove(path_file_users)
-    file_users = open(path_file_users, 'w')
-    writer_users = csv.writer(file_users, dialect='excel-tab',
-                              lineterminator='\n')
-
-    list_users = []
-    for item_user in redis_cache.hscan_iter(lang + ':users', count=1000):
-        list_users.append(item_user)
-
-    total_users = len(list_users)
-
-    for item_user in list_users:
-        try:
-            writer_users.writerow([s if isinstance(s, str)
-                                   else str(s) for s in item_user])
-        except Exception as e:
-            print("Error writing CSV file for registered users...")
-            print(e)
-    file_users.close()
-    del list_users
+    print("Inserting users info in DB")
+    total_users = write_rows(
+        'user',
+        itertools.chain(special_users,
+                        (item_user for item_user in users.users()
+                         if int(item_user[0]) not in (0, -1, -2))),
+        'registered users')
 
     # Users with ID = 0 in dump file
-    path_file_users_zero = os.path.join(tmp_dir,
-                                        lang + '_users_zero.csv')
-    file_users_zero = open(path_file_users_zero, 'w')
-    writer_users_zero = csv.writer(file_users_zero, dialect='excel-tab',
-                                   lineterminator='\n')
-
-    list_users_zero = []
-    for item_user_zero in redis_cache.hscan_iter(lang + ':userzero',
-                                                 count=1000):
-        list_users_zero.append(item_user_zero)
-
-    total_users_zero = len(list_users_zero)
-
-    for item_user_zero in list_users_zero:
-        try:
-            writer_users_zero.writerow([s if isinstance(s, str)
-                                        else str(s) for s in item_user_zero])
-        except Exception as e:
-            print(e)
-
-    file_users_zero.close()
-    del list_users_zero
-
-    print("Inserting anonymous revisions info in DB")
-    con.send_query(insert_anons % path_file_anons)
-    print("Inserting users info in DB")
-    con.send_query(insert_users % path_file_users)
     print("Inserting missing users info in DB")
     print()
-    con.send_query(insert_users_zero % path_file_users_zero)
-    # TODO: Clean tmp files, uncomment the following lines
-    # os.remove(path_file_anons)
-    # os.remove(path_file_users)
+    total_users_zero = write_rows('revision_user_zero', users.users_zero(),
+                                  'users with missing ID')
+    users.close()
+    loader.close()
     # Clean up Redis databases to free memory
-#    redis_cache.delete(lang + ':revsanon', lang + ':users')
+#    redis_cache.delete(lang + ':users')
 #    redis_cache.delete(lang + ':userzero')
 
-    logging.info("COMPLETED: %s anonymous revisions processed %s." % (
-                 total_anons,
-                 time.strftime("%Y-%m-%d %H:%M:%S %Z",
-                               time.localtime())))
     logging.info("COMPLETED: %s registered users processed %s." % (
                  total_users,
                  time.strftime("%Y-%m-%d %H:%M:%S %Z",
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Detection of quality templates (Featured Articles, Featured Lists and Good
+Articles) in revision text.
+
+QualityDetector gets the FA, FLIST and GA flags of a revision at once,
+with the same results as searching the regular expressions of maps.FA_RE,
+maps.FLIST_RE and maps.GA_RE, in a single pass over the text.
+
+Every template of maps starts with '{{', so the patterns of a language
+are compiled into one scanner anchored at '{{': it matches the first
+brace, and the rest of every template is tried with lookaheads, each one
+setting a named group (fa, flist, ga) when it matches. For example, the
+scanner of enwiki is
+
+    \\{(?=\\{)(?:(?=\\{(?:[Ff]eatured [Aa]rticle\\}\\}))(?P<fa>)|)
+    (?:(?=\\{(?:[Ff]eatured [Ll]ist\\}\\}))(?P<flist>)|)
+    (?:(?=\\{(?:[Gg]ood [Aa]rticle\\}\\}))(?P<ga>)|)
+    (?(fa)|(?(flist)|(?(ga)|(?!))))
+
+The final condition rejects positions where no template matches, so
+finditer only yields candidate templates, and the regex engine scans for
+'{' with its literal prefix search. Matches consume a single character,
+so templates starting inside other braces (e.g. '{{{') are not skipped,
+and all templates found at the same position are reported. Languages
+with a single pattern only need its first match, so their scanner is the
+template itself, starting with '{{'.
+
+@author: jfelipe
+"""
+import re
+from wikidat.utils import maps
+
+NO_FLAGS = (False, False, False)
+
+# Template regex of maps: one group with '{{' (escaped or not) and the
+# rest of the template
+_TEMPLATE_RE = re.compile(r'^\((?:\\\{\\\{|\{\{)(.*)\)$', re.DOTALL)
+
+
+def _split_alternatives(source):
+    """
+    Split regex source at top-level '|' (outside groups and classes)
+    """
+    parts = []
+    depth = 0
+    in_class = False
+    start = 0
+    pos = 0
+    while pos < len(source):
+        char = source[pos]
+        if char == '\\':
+            pos += 2
+            continue
+        if in_class:
+            if char == ']':
+                in_class = False
+        elif char == '[':
+            in_class = True
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            parts.append(source[start:pos])
+            start = pos + 1
+        pos += 1
+    parts.append(source[start:])
+    return parts
+
+
+def template_rest(source):
+    """
+    Return regex source of template source after its opening '{{', or None
+    if source is not a single group starting with '{{'
+    """
+    match = _TEMPLATE_RE.match(source)
+    if match is None:
+        return None
+    rest = match.group(1)
+    # The outer group must enclose the whole template
+    if len(_split_alternatives(rest)) != 1:
+        return None
+    try:
+        re.compile(rest)
+    except re.error:
+        return None
+    return rest
+
+
+class QualityDetector(object):
+    """
+    Detector of FA, FLIST and GA templates in texts of a language edition
+
+    Arguments:
+        - lang = Language edition (e.g. 'enwiki'), one of those in maps.FA_RE
+    """
+    FLAGS = ('fa', 'flist', 'ga')
+
+    def __init__(self, lang):
+        if ((lang not in maps.FA_RE) or (lang not in maps.FLIST_RE) or
+                (lang not in maps.GA_RE)):
+            raise RuntimeError('Unsupported language ' + str(lang))
+        self.lang = lang
+        self.patterns = (maps.FA_RE[lang], maps.FLIST_RE[lang],
+                         maps.GA_RE[lang])
+        # Flags found by the scanner, as (index, group name)
+        self.groups = []
+        # Patterns not starting with '{{' are searched on their own
+        self.others = []
+        lookaheads = []
+        for index, (flag, pattern) in enumerate(zip(self.FLAGS,
+                                                    self.patterns)):
+            if pattern is None:
+                continue
+            rests = [template_rest(alt)
+                     for alt in _split_alternatives(pattern.pattern)]
+            if pattern.flags != re.UNICODE or None in rests:
+                self.others.append((index, pattern))
+                continue
+            self.groups.append((index, flag))
+            lookaheads.append('(?:(?=\\{(?:%s))(?P<%s>)|)' % (
+                              '|'.join(rests), flag))
+        self.scanner = None
+        if len(self.groups) == 1:
+            # The first match is enough, the template is matched as such
+            # (its literal prefix speeds up the search)
+            self.scanner = re.compile('(?P<%s>\\{\\{(?:%s))' % (
+                                      self.groups[0][1], '|'.join(rests)))
+        elif self.groups:
+            condition = '(?!)'
+            for index, flag in reversed(self.groups):
+                condition = '(?(%s)|%s)' % (flag, condition)
+            self.scanner = re.compile('\\{(?=\\{)' + ''.join(lookaheads) +
+                                      condition)
+
+    def detect(self, text):
+        """
+        Return tuple of flags (is_fa, is_flist, is_ga) of text
+        """
+        match = None
+        if self.scanner is not None:
+            match = self.scanner.search(text)
+            if match is None and not self.others:
+                # Most texts have no quality templates
+                return NO_FLAGS
+        flags = [False, False, False]
+        if match is not None:
+            pending = len(self.groups)
+            for match in self.scanner.finditer(text, match.start()):
+                for index, flag in self.groups:
+                    if not flags[index] and match.group(flag) is not None:
+                        flags[index] = True
+                        pending -= 1
+                if not pending:
+                    break
+        for index, pattern in self.others:
+            flags[index] = pattern.search(text) is not None
+        return tuple(flags)
+
+    def detect_regex(self, text):
+        """
+        Return tuple of flags searching the regexes only (reference
+        results of detect)
+        """
+        return tuple(pattern is not None and
+                     pattern.search(text) is not None
+                     for pattern in self.patterns)
+
+
+_detectors = {}
+
+
+def get_detector(lang):
+    """
+    Return QualityDetector of language edition lang (shared by all callers
+    in this process)
+    """
+    if lang not in _detectors:
+        _detectors[lang] = QualityDetector(lang)
+    return _detectors[lang]
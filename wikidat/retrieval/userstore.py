@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Stores of user info collected by revision workers.
+
+Revision workers record, for every language edition:
+
+    - users: usernames of user ids (an empty name if only the id is known)
+    - userzero: usernames of revisions with user id 0 in dump files
+
+These are exported to the user and revision_user_zero tables once all ETL
+lines have finished (see revision.users_file_to_db). IP addresses of
+anonymous revisions are not stored, they are loaded in revision_IP by
+revision workers as they go (see revision.revs_file_to_db). Backends:
+
+    - redis: Redis server, with commands sent in pipelined batches
+    - memory: in-process map of users per worker, deduplicated in memory.
+      Workers write their info to files in path when they finish, which
+      are merged on export. No server is needed.
+    - sqlite: embedded on-disk KV store (SQLite file in path), shared by
+      all workers
+
+@author: jfelipe
+"""
+import csv
+import glob
+import heapq
+import itertools
+import os
+import sqlite3
+import redis
+
+USER_STORES = ('redis', 'memory', 'sqlite')
+
+
+class UserStore(object):
+    """
+    Settings of the store of user info, shared by all processes of a task
+
+    Arguments:
+        - backend = One of USER_STORES
+        - path = Directory of files of memory and sqlite stores
+        - host, port = Redis server (redis store)
+        - batch_size = Number of writes sent or committed at once
+    """
+    def __init__(self, backend='redis', path=None, host='localhost',
+                 port=6379, batch_size=1000):
+        if backend not in USER_STORES:
+            raise RuntimeError('Unsupported user store ' + str(backend))
+        self.backend = backend
+        self.path = path
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+
+    def __repr__(self):
+        return "UserStore(%s, path=%s)" % (self.backend, self.path)
+
+    def open(self, lang):
+        """
+        Return new connection to store of language edition lang. Each
+        process must open its own connection.
+        """
+        if self.backend == 'redis':
+            return RedisUsers(lang, host=self.host, port=self.port,
+                              batch_size=self.batch_size)
+        if self.path is None:
+            raise RuntimeError('User store %s requires a path' %
+                               self.backend)
+        if self.backend == 'memory':
+            return MemoryUsers(lang, self.path)
+        return SQLiteUsers(lang, self.path, batch_size=self.batch_size)
+
+    def prepare(self, lang):
+        """
+        Remove files left by previous runs of memory and sqlite stores.
+        Info in Redis is kept.
+        """
+        if self.backend == 'redis':
+            return
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        if self.backend == 'memory':
+            for path in glob.glob(os.path.join(self.path,
+                                               lang + '-users-*.csv')):
+                os.remove(path)
+        else:
+            for suffix in ('', '-wal', '-shm'):
+                path = SQLiteUsers.db_path(lang, self.path) + suffix
+                if os.path.isfile(path):
+                    os.remove(path)
+
+
+class RedisUsers(object):
+    """
+    User info in Redis hashes <lang>:users and <lang>:userzero. Writes are
+    queued in a pipeline and sent every batch_size commands. Usernames
+    already sent by this process are skipped.
+    """
+    def __init__(self, lang, host='localhost', port=6379, batch_size=1000,
+                 seen_size=100000):
+        self.lang = lang
+        self.cache = redis.Redis(host=host, port=port,
+                                 decode_responses=True)
+        self.pipe = self.cache.pipeline(transaction=False)
+        self.batch_size = batch_size
+        self.pending = 0
+        self.seen = {}
+        self.seen_size = seen_size
+
+    def _queued(self):
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def add_user(self, user, username):
+        """
+        Store username of user id. If username is None, an empty name is
+        stored unless the user is already known.
+        """
+        if user in self.seen and self.seen[user] == username:
+            return
+        if len(self.seen) >= self.seen_size:
+            self.seen = {}
+        self.seen[user] = username
+        if username is not None:
+            self.pipe.hset(self.lang + ':users', user, username)
+        else:
+            self.pipe.hsetnx(self.lang + ':users', user, '')
+        self._queued()
+
+    def add_user_zero(self, rev_id, username):
+        self.pipe.hset(self.lang + ':userzero', rev_id, username)
+        self._queued()
+
+    def flush(self):
+        if self.pending:
+            self.pipe.execute()
+            self.pending = 0
+
+    def close(self):
+        self.flush()
+
+    def _items(self, name):
+        for key, value in self.cache.hscan_iter(self.lang + name,
+                                                count=1000):
+            yield int(key), value
+
+    def users(self):
+        return self._items(':users')
+
+    def users_zero(self):
+        return self._items(':userzero')
+
+
+class MemoryUsers(object):
+    """
+    User info kept in memory by each worker. Users are deduplicated in a
+    dict and written to a file sorted by id when the worker closes the
+    store. User zero revisions are unique per worker, so they are streamed
+    to a file as they arrive. On export, files of all workers
+    are merged.
+    """
+    def __init__(self, lang, path):
+        self.lang = lang
+        self.path = path
+        self.user_names = {}
+        self.files = {}
+        self.writers = {}
+
+    def _file(self, kind, worker='*'):
+        return os.path.join(self.path, '%s-users-%s.%s.csv' % (
+                            self.lang, worker, kind))
+
+    def _writer(self, kind):
+        if kind not in self.writers:
+            self.files[kind] = open(self._file(kind, os.getpid()), 'w',
+                                    newline='')
+            self.writers[kind] = csv.writer(self.files[kind],
+                                            dialect='excel-tab',
+                                            lineterminator='\n')
+        return self.writers[kind]
+
+    def add_user(self, user, username):
+        if username is not None:
+            self.user_names[user] = username
+        elif user not in self.user_names:
+            self.user_names[user] = ''
+
+    def add_user_zero(self, rev_id, username):
+        self._writer('userzero').writerow((rev_id, username))
+
+    def flush(self):
+        for out in self.files.values():
+            out.flush()
+
+    def close(self):
+        if self.user_names:
+            writer = self._writer('users')
+            for user in sorted(self.user_names):
+                writer.writerow((user, self.user_names[user]))
+            self.user_names = {}
+        for out in self.files.values():
+            out.close()
+        self.files = {}
+        self.writers = {}
+
+    def _rows(self, path):
+        with open(path, newline='') as in_file:
+            for row in csv.reader(in_file, dialect='excel-tab'):
+                yield int(row[0]), row[1]
+
+    def _all_rows(self, kind):
+        return itertools.chain.from_iterable(
+            self._rows(path) for path in sorted(glob.glob(self._file(kind))))
+
+    def users(self):
+        """
+        Merge sorted files of users of all workers, keeping names over
+        empty names of the same user
+        """
+        merged = heapq.merge(*[self._rows(path) for path in
+                               sorted(glob.glob(self._file('users')))],
+                             key=lambda row: row[0])
+        for user, rows in itertools.groupby(merged, key=lambda row: row[0]):
+            username = ''
+            for row in rows:
+                username = row[1] or username
+            yield user, username
+
+    def users_zero(self):
+        return self._all_rows('userzero')
+
+
+class SQLiteUsers(object):
+    """
+    User info in a SQLite file shared by all workers (WAL mode). Writes are
+    committed every batch_size operations.
+    """
+    @staticmethod
+    def db_path(lang, path):
+        return os.path.join(path, lang + '-users.sqlite')
+
+    def __init__(self, lang, path, batch_size=1000):
+        self.lang = lang
+        self.batch_size = batch_size
+        self.con = sqlite3.connect(self.db_path(lang, path), timeout=600)
+        self.con.execute('PRAGMA journal_mode=WAL')
+        self.con.execute('PRAGMA synchronous=OFF')
+        for table in ('users', 'userzero'):
+            self.con.execute('CREATE TABLE IF NOT EXISTS %s '
+                             '(id INTEGER PRIMARY KEY, value)' % table)
+        self.con.commit()
+        self.pending = {'users': [], 'users_id': [], 'userzero': []}
+        self.count = 0
+
+    def _queued(self):
+        self.count += 1
+        if self.count >= self.batch_size:
+            self.flush()
+
+    def add_user(self, user, username):
+        if username is not None:
+            self.pending['users'].append((user, username))
+        else:
+            self.pending['users_id'].append((user,))
+        self._queued()
+
+    def add_user_zero(self, rev_id, username):
+        self.pending['userzero'].append((rev_id, username))
+        self._queued()
+
+    def flush(self):
+        if not self.count:
+            return
+        with self.con:
+            self.con.executemany('INSERT OR REPLACE INTO users VALUES '
+                                 '(?, ?)', self.pending['users'])
+            self.con.executemany("INSERT OR IGNORE INTO users VALUES "
+                                 "(?, '')", self.pending['users_id'])
+            self.con.executemany('INSERT OR REPLACE INTO userzero VALUES '
+                                 '(?, ?)', self.pending['userzero'])
+        for rows in self.pending.values():
+            del rows[:]
+        self.count = 0
+
+    def close(self):
+        self.flush()
+        self.con.close()
+
+    def _items(self, table):
+        return self.con.execute('SELECT id, value FROM %s ORDER BY id' %
+                                table)
+
+    def users(self):
+        return self._items('users')
+
+    def users_zero(self):
+        return self._items('userzero')
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Scheduling of dump files across the ETL lines of a task.
+
+ETL lines take work items from a shared queue, so they always pick the next
+item as soon as they are idle (list scheduling). Ordering items from the
+largest to the smallest estimated cost (LPT, longest processing time first)
+avoids long straggler tails caused by a huge file taken at the end.
+
+Work items are paths to dump files or, for bz2 multistream files with an
+offsets index, (path, byte_range) tuples covering a part of the file.
+"""
+import heapq
+import math
+import os
+from wikidat.retrieval.dump import DumpFile
+from wikidat.utils import misc
+
+# Order of work items: longest first or as found (glob order)
+SCHEDULES = ('lpt', 'fifo')
+# Estimation of cost of work items: compressed size or number of pages
+# listed in the offsets index of multistream files (one revision per page)
+COST_MODELS = ('size', 'index')
+
+
+def work_items(paths, split_size=0, cost='size'):
+    """
+    Create work items for a list of dump files, with their estimated cost.
+    Arguments:
+        - paths = List of paths to dump files
+        - split_size = Multistream files larger than this size (bytes) are
+          split in work items of similar size. 0 disables splitting.
+        - cost = Cost model, 'size' or 'index'. If any item cannot be
+          estimated with the index, compressed size is used for all items.
+
+    Returns list of (item, cost) tuples and the cost model actually used.
+    """
+    if cost not in COST_MODELS:
+        raise RuntimeError('Unknown cost model for scheduling: %s' % cost)
+
+    items = []
+    for path in paths:
+        file_size = os.path.getsize(path)
+        dump_file = DumpFile(path)
+        if (split_size and file_size > split_size and
+                dump_file.is_multistream()):
+            parts = int(math.ceil(file_size / float(split_size)))
+            for byte_range in dump_file.get_shards(parts):
+                items.append([dump_file, byte_range])
+        else:
+            items.append([dump_file, None])
+
+    use_index = (cost == 'index' and
+                 all(dump_file.is_multistream() for dump_file, r in items))
+    if cost == 'index' and not use_index:
+        print("Some dump files have no offsets index, "
+              "scheduling by compressed size.")
+
+    result = []
+    for dump_file, byte_range in items:
+        path = dump_file.path
+        start, end = byte_range if byte_range else (0, None)
+        if use_index:
+            # Items of the same file share its DumpFile, and the index
+            # read by get_shards
+            weight = sum(pages for offset, pages in dump_file.index_streams()
+                         if offset >= start and (end is None or offset < end))
+        else:
+            if end is None:
+                end = os.path.getsize(path)
+            weight = end - start
+        item = path if byte_range is None else (path, byte_range)
+        result.append((item, weight))
+    return result, 'index' if use_index else 'size'
+
+
+def schedule(items, lines, policy='lpt'):
+    """
+    Order work items for ETL lines and predict the resulting makespan.
+    Arguments:
+        - items = List of (item, cost) tuples (see work_items)
+        - lines = Number of ETL lines taking items from the queue
+        - policy = 'lpt' (longest first) or 'fifo' (keep order)
+
+    Returns (ordered list of (item, cost), predicted loads of every line).
+    Loads are in the units of the cost model; the predicted makespan is the
+    maximum load.
+    """
+    if policy not in SCHEDULES:
+        raise RuntimeError('Unknown scheduling policy: %s' % policy)
+    if policy == 'lpt':
+        items = sorted(items, key=lambda item: item[1], reverse=True)
+    # Simulate list scheduling: next item goes to the first idle line
+    loads = [(0, line) for line in range(lines)]
+    for item, weight in items:
+        load, line = heapq.heappop(loads)
+        heapq.heappush(loads, (load + weight, line))
+    return items, [load for load, line in sorted(loads,
+                                                  key=lambda l: l[1])]
+
+
+def describe_item(item):
+    """
+    Return printable name of work item
+    """
+    if isinstance(item, tuple):
+        path, (start, end) = item
+        return '%s [%s-%s]' % (path, start, '' if end is None else end)
+    return item
+
+
+def report_makespan(items, loads, finish_times, cost='size'):
+    """
+    Print predicted versus actual makespan of a task.
+    Arguments:
+        - items = Scheduled list of (item, cost) tuples
+        - loads = Predicted load of every line (see schedule)
+        - finish_times = Seconds taken by every line
+        - cost = Cost model used for predictions
+
+    Predicted times are calibrated with the actual throughput of all lines
+    (total cost over total busy time).
+    """
+    total = sum(weight for item, weight in items)
+    predicted = max(loads) if loads else 0
+    actual = max(finish_times) if finish_times else 0.0
+    busy = sum(finish_times)
+    unit = 'pages' if cost == 'index' else 'bytes'
+
+    def show(weight):
+        if unit == 'bytes':
+            return misc.hfile_size(weight)
+        return '%s pages' % weight
+
+    print("Schedule: %s work items, total cost %s, %s lines" % (
+          len(items), show(total), len(loads)))
+    print("Predicted makespan: %s (lower bound %s)" % (
+          show(predicted), show(total // len(loads) if loads else 0)))
+    if total and busy:
+        rate = busy / float(total)
+        print("Predicted makespan: %.2f sec., actual: %.2f sec." % (
+              predicted * rate, actual))
+    print("Finish time of lines (sec.): %s" % ', '.join(
+          '%.2f' % t for t in finish_times))
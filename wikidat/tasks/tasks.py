@@ -13,16 +13,22 @@ processes with Wikipedia data:
 @author: jfelipe
 """
 
-from wikidat.retrieval.etl import RevisionHistoryETL, LoggingETL, SQLDumpsETL
+from wikidat.retrieval.etl import (RevisionHistoryETL, RevisionMetaETL,
+                                  LoggingETL, SQLDumpsETL)
 from wikidat.retrieval.revision import users_file_to_db
+from wikidat.retrieval.userstore import UserStore
 from wikidat.retrieval.dump import DumpFile
-from .download import (RevHistDownloader, LoggingDownloader,
+from .scheduler import work_items, schedule, describe_item, report_makespan
+from .download import (RevHistDownloader, RevMetaDownloader,
+                       LoggingDownloader,
                        UserGroupsDownloader, IWLinksDownloader,
                        TemplateLinksDownloader, PageRestrDownloader,
                        CategoryDownloader, CatLinksDownloader,
                        ExtLinksDownloader, PagesLinksDownloader,
                        ImageLinksDownloader)
-from wikidat.utils.dbutils import MySQLDB
+from wikidat.utils.dbutils import get_db_class
+from wikidat.utils.loader import BulkLoad
+from wikidat.utils.governor import MemoryGovernor
 import multiprocessing as mp
 import os
 import sys
@@ -36,12 +42,14 @@ class Task(object):
     """
 
     def __init__(self, lang, db_user, db_passw, db_name, db_engine,
-                 date=None, host='localhost', port=3306):
+                 date=None, host='localhost', port=3306, db_backend='mysql'):
         """
         Builder method of class RevisionHistoryRetrieval.
         Arguments:
             - language: code of the Wikipedia language to be processed
             - date: publication date of target dump files collection
+            - db_backend: DB backend, 'mysql' or 'postgresql' (see
+              dbutils.DB_BACKENDS)
         """
         self.lang = lang
         self.date = date
@@ -51,10 +59,20 @@ class Task(object):
         self.db_passw = db_passw
         self.db_name = db_name
         self.db_engine = db_engine
+        self.db_backend = db_backend
+
+    def db_connection(self, db=None, load_profile=None):
+        """
+        Return new (not connected) connection to DB db (server only if
+        None) in the DB backend of this task
+        """
+        return get_db_class(self.db_backend)(host=self.host, port=self.port,
+                                             user=self.db_user,
+                                             passwd=self.db_passw, db=db,
+                                             load_profile=load_profile)
 
     def DB_exists(self):
-        db_check = MySQLDB(host=self.host, port=self.port, user=self.db_user,
-                           passwd=self.db_passw)
+        db_check = self.db_connection()
         db_check.connect()
         db_exists = db_check.db_exists(self.db_name)
         db_check.close()
@@ -65,9 +83,18 @@ class RevHistoryTask(Task):
     """
     A complete, multiprocessing parser of full revision history dump files
     """
+    # Name of this task, description and file patterns of its dump files
+    # (in order of preference), downloader and class of ETL lines
+    task_name = 'ETL:RevHistory'
+    dump_type = 'revision-history'
+    dump_patterns = ['*pages-meta-history*.7z', '*pages-meta-history*.xml',
+                     '*multistream*.xml*.bz2']
+    downloader = RevHistDownloader
+    etl_class = RevisionHistoryETL
 
     def __init__(self, host, port, db_name, db_user, db_passw, db_engine,
-                 lang='scowiki', date=None, etl_lines=1):
+                 lang='scowiki', date=None, etl_lines=1,
+                 db_backend='mysql'):
         """
         Builder method of class RevisionHistoryTask.
         Arguments:
@@ -78,19 +105,18 @@ class RevHistoryTask(Task):
                                              port=port, db_name=db_name,
                                              db_user=db_user,
                                              db_passw=db_passw,
-                                             db_engine=db_engine)
+                                             db_engine=db_engine,
+                                             db_backend=db_backend)
         self.etl_lines = etl_lines
         self.etl_list = []
 
     def create_DB(self, complete=False):
         if complete:
-            db_create = MySQLDB(host=self.host, port=self.port,
-                                user=self.db_user, passwd=self.db_passw)
+            db_create = self.db_connection()
             db_create.connect()
             db_create.create_database(self.db_name)
             db_create.close()
-        db_schema = MySQLDB(host=self.host, port=self.port, user=self.db_user,
-                            passwd=self.db_passw, db=self.db_name)
+        db_schema = self.db_connection(db=self.db_name)
         db_schema.connect()
         db_schema.create_schema_revhist(engine=self.db_engine)
         db_schema.close()
@@ -99,19 +125,65 @@ class RevHistoryTask(Task):
     # and implement flow control in process_revision
     def execute(self, page_fan, rev_fan, page_cache_size, rev_cache_size,
                 mirror, download_files, base_ports, control_ports,
-                dumps_dir=None, debug=False):
+                dumps_dir=None, debug=False, xml_shards=1,
+                xml_parser='lxml', decompressor='auto', decomp_threads=None,
+                hash_mode='sha256', transport=None, schedule_policy='lpt',
+                schedule_cost='size', split_size=0, metrics_interval=0,
+                profiling=None, memory_budget=0, user_store=None,
+                text_cache=64, rev_diff=False, bulk_load=None,
+                index_workers=4, index_combine=False):
         """
         Run data retrieval and loading actions.
         Arguments:
             - page_fan = Number of workers to fan out page elements parsing
             - rev_fan = Number of workers to fan out rev elements parsing
+            - xml_shards = Number of parallel XML readers for each bz2
+              multistream dump file
+            - xml_parser = XML parser engine, 'lxml' or 'expat'
+            - decompressor = Decompression tool ('auto', 'python' or name
+              of an installed tool, e.g. 'lbzip2')
+            - decomp_threads = Number of threads for parallel decompressors
+            - transport = Settings of channels between processes
+              (comutils.Transport)
+            - hash_mode = Hash of revision text stored in revision_hash,
+              'sha256', 'sha1' (from dump, base36) or 'sha1_hex'
+            - schedule_policy = Order of dump files taken by ETL lines,
+              'lpt' (largest first) or 'fifo' (see scheduler)
+            - schedule_cost = Estimation of cost of dump files, 'size'
+              (compressed size) or 'index' (pages in multistream index)
+            - split_size = Split multistream dump files larger than this
+              size (in bytes) in several work items. 0 disables splitting.
+            - metrics_interval = Seconds between updates of metrics files
+              of ETL lines (0 disables metrics)
+            - profiling = Settings of profiling of all processes
+              (profiling.Profiling), None to disable it
+            - memory_budget = Memory budget of all processes of the task
+              in MB. XML readers are paused while it is exceeded (see
+              governor.MemoryGovernor). 0 disables it.
+            - user_store = Store of user info (userstore.UserStore), Redis
+              by default. Files of memory and sqlite stores go to the tmp
+              dir of dump files unless a path is given.
+            - text_cache = Max. number of distinct texts of each page whose
+              derived fields are cached by revision workers (0 disables
+              the cache)
+            - rev_diff = Compute lines and bytes added and removed by
+              every revision, stored in revision_diff (off by default,
+              revisions of each page then go to the same revision worker)
+            - bulk_load = Settings of loading of chunks of rows in DB
+              (loader.BulkLoad), chunk files read by the DB server by
+              default, or columnar.ParquetSink to write Parquet datasets
+              without a DB
+            - index_workers = Number of tables whose indexes are built at
+              once, on separate DB connections
+            - index_combine = Build all indexes of each table in a single
+              ALTER TABLE
             - db_user = User name to connect to local database
             - db_passw = Password for database user
             - mirror = Base URL of site hosting XML dumps
         """
         print("----------------------------------------------------------")
-        print(("""Executing ETL:RevHistory on lang: {0} date: {1}"""
-               .format(self.lang, self.date)))
+        print(("""Executing {0} on lang: {1} date: {2}"""
+               .format(self.task_name, self.lang, self.date)))
         print(("ETL lines = {0} page_fan = {1} rev_fan = {2}"
                .format(self.etl_lines, page_fan, rev_fan)))
         print("Download files =", download_files)
@@ -124,7 +196,7 @@ class RevHistoryTask(Task):
             # Choose corresponding file downloader and etl wrapper
             print("Downloading new dump files from %s, for language %s" % (
                   mirror, self.lang))
-            self.down = RevHistDownloader(mirror, self.lang, dumps_dir)
+            self.down = self.downloader(mirror, self.lang, dumps_dir)
             # Donwload latest set of dump files
             self.paths, self.date = self.down.download(self.date)
             if not self.paths:
@@ -137,7 +209,7 @@ class RevHistoryTask(Task):
             print()
 
         else:
-            print("Looking for revision-history dump file(s) in data dir")
+            print("Looking for %s dump file(s) in data dir" % self.dump_type)
             # Case of dumps folder provided explicity
             if dumps_dir:
                 # Allow specifying relative paths, as well
@@ -150,73 +222,95 @@ class RevHistoryTask(Task):
                     print("Please, specify a valid path to local folder containing dump files.")
                     print("Program will exit now.")
                     sys.exit()
-
-                else:
-                    # Attempt to find list of .7z or .xml files to be processed
-                    self.paths = glob.glob(os.path.join(dumps_path,
-                                                        '*pages-meta-history*.7z'))
-                    if not self.paths:
-                        self.paths = glob.glob(os.path.join(dumps_path,
-                                                            '*pages-meta-history*.xml'))
-                        if not self.paths:
-                            print("Directory %s does not contain any valid dump file." % dumps_path)
-                            print("Program will exit now.")
-                            sys.exit()
             # If not provided explicitly, look for default location of
             # dumps directory
             else:
-                dumps_dir = os.path.join("data", self.lang + '_dumps',
-                                         self.date)
+                dumps_path = os.path.join("data", self.lang + '_dumps',
+                                          self.date)
                 # Look up dump files in default directory name
-                if not os.path.exists(dumps_dir):
-                    print("Default directory %s containing dump files not found." % dumps_dir)
+                if not os.path.exists(dumps_path):
+                    print("Default directory %s containing dump files not found." % dumps_path)
                     print ("Program will exit now.")
                     sys.exit()
 
-                else:
-                    self.paths = glob.glob(os.path.join(dumps_dir, '*pages-meta-history*.7z'))
-                    if not self.paths:
-                        self.paths = glob.glob(os.path.join(dumps_dir,
-                                                            '*pages-meta-history*.xml'))
-                        if not self.paths:
-                            print("Directory %s does not contain any valid dump file." % dumps_dir)
-                            print("Program will exit now.")
-                            sys.exit()
-            print("Found revision-history dump file(s) to process.")
+            # Attempt to find list of dump files to be processed,
+            # in order of preference of file patterns
+            self.paths = []
+            for pattern in self.dump_patterns:
+                self.paths = glob.glob(os.path.join(dumps_path, pattern))
+                if self.paths:
+                    break
+            if not self.paths:
+                print("Directory %s does not contain any valid dump file." % dumps_path)
+                print("Program will exit now.")
+                sys.exit()
+            print("Found %s dump file(s) to process." % self.dump_type)
             print()
         # Print list of file paths in debug mode
         if debug:
             print("paths: ", str(self.paths))
             print()
 
-        # Create database
-        # TODO: Empty correspoding tables if DB already exists
-        # or let the user select behaviour with config argument
-        if self.DB_exists():
-            self.create_DB(complete=False)
-        else:
-            self.create_DB(complete=True)
-
-        # First insert namespace info in DB
+        if bulk_load is None:
+            bulk_load = BulkLoad()
+        data_dir = os.path.join(os.getcwd(), os.path.split(self.paths[0])[0])
         dump = DumpFile(self.paths[0])
-        db_schema = MySQLDB(host=self.host, port=self.port, user=self.db_user,
-                            passwd=self.db_passw, db=self.db_name)
-        db_schema.connect()
-        db_schema.insert_namespaces(nsdict=dump.get_namespaces())
-        db_schema.close()
+        if bulk_load.uses_db():
+            # Create database
+            # TODO: Empty correspoding tables if DB already exists
+            # or let the user select behaviour with config argument
+            if self.DB_exists():
+                self.create_DB(complete=False)
+            else:
+                self.create_DB(complete=True)
+
+            # First insert namespace info in DB
+            db_schema = self.db_connection(db=self.db_name)
+            db_schema.connect()
+            db_schema.insert_namespaces(nsdict=dump.get_namespaces())
+            db_schema.close()
+        else:
+            # Namespace info goes to the same sink as other tables
+            loader = bulk_load.loader(None)
+            writer = bulk_load.writer(loader, 'namespaces',
+                                      os.path.join(data_dir, 'tmp'),
+                                      self.lang)
+            for row in dump.get_namespaces().items():
+                writer.writerow(row)
+            writer.rotate()
+            loader.close()
 
         # Complete the queue of paths to be processed and STOP flags for
-        # each ETL subprocess
+        # each ETL subprocess, in the order given by the scheduler
+        items, schedule_cost = work_items(self.paths, split_size=split_size,
+                                          cost=schedule_cost)
+        items, loads = schedule(items, self.etl_lines,
+                                policy=schedule_policy)
+        if debug:
+            print("work items: ", [describe_item(item) for item, c in items])
+            print()
         paths_queue = mp.JoinableQueue()
-        for path in self.paths:
-            paths_queue.put(path)
+        for item, weight in items:
+            paths_queue.put(item)
 
         for x in range(self.etl_lines):
             paths_queue.put('STOP')
 
+        governor = None
+        if memory_budget:
+            governor = MemoryGovernor(
+                memory_budget, log_file=os.path.join(
+                    os.path.split(self.paths[0])[0], 'logs', 'memory.log'))
+
+        if user_store is None:
+            user_store = UserStore()
+        if user_store.path is None:
+            user_store.path = os.path.join(data_dir, 'tmp')
+        user_store.prepare(self.lang)
+
         for x in range(self.etl_lines):
-            new_etl = RevisionHistoryETL(
-                name="[ETL:RevHistory-%s]" % x,
+            new_etl = self.etl_class(
+                name="[%s-%s]" % (self.task_name, x),
                 paths_queue=paths_queue, lang=self.lang,
                 page_fan=page_fan, rev_fan=rev_fan,
                 page_cache_size=page_cache_size,
@@ -224,59 +318,122 @@ class RevHistoryTask(Task):
                 db_name=self.db_name,
                 db_user=self.db_user, db_passw=self.db_passw,
                 base_port=base_ports[x]+(20*x),
-                control_port=control_ports[x]+(20*x)
+                control_port=control_ports[x]+(20*x),
+                xml_shards=xml_shards, xml_parser=xml_parser,
+                decompressor=decompressor, decomp_threads=decomp_threads,
+                hash_mode=hash_mode, transport=transport,
+                metrics_interval=metrics_interval,
+                profiling=profiling,
+                flow=governor.flow if governor is not None else None,
+                user_store=user_store, text_cache=text_cache,
+                rev_diff=rev_diff, bulk_load=bulk_load,
+                db_backend=self.db_backend
                 )
             self.etl_list.append(new_etl)
 
-        print("ETL:RevHistory task defined OK.")
+        print("%s task defined OK." % self.task_name)
         print("Proceeding with ETL workflows. This may take time...")
         print()
+        # Global settings of load profile, while ETL lines load data
+        db_load = None
+        if bulk_load.uses_db():
+            db_load = self.db_connection(
+                db=self.db_name, load_profile=bulk_load.profile)
+            db_load.connect()
+            db_load.begin_server_load()
+            db_load.close()
         # Extract, process and load information in local DB
+        etl_start = time.time()
         for etl in self.etl_list:
             etl.start()
             # Wait a second for new ETL process to start all subprocesses
             time.sleep(1)
 
-        # Wait for ETL lines to finish
+        # Wait for ETL lines to finish, tracking their finish times
+        finish_times = {}
+        while len(finish_times) < len(self.etl_list):
+            for etl in self.etl_list:
+                if etl.name not in finish_times and not etl.is_alive():
+                    finish_times[etl.name] = time.time() - etl_start
+            if governor is not None:
+                governor.check()
+            time.sleep(0.5)
         for etl in self.etl_list:
             etl.join()
+        if governor is not None:
+            governor.release()
+        failed = [etl.name for etl in self.etl_list if etl.exitcode != 0]
+        if failed:
+            # Do not build indexes on incomplete data
+            if db_load is not None:
+                db_load.connect()
+                db_load.end_server_load()
+                db_load.close()
+            print("Error: ETL lines failed: %s" % ', '.join(failed))
+            print("Program will exit now.")
+            sys.exit(1)
+        report_makespan(items, loads,
+                        [finish_times[etl.name] for etl in self.etl_list],
+                        cost=schedule_cost)
+        print()
 
         # Insert user info after all ETL lines have finished
-        # to ensure that all metadata are stored in Redis cache
+        # to ensure that all metadata are stored in user store
         # disregarding of the execution order
-        data_dir = os.path.join(os.getcwd(), os.path.split(self.paths[0])[0])
-        db_users = MySQLDB(host=self.host, port=self.port, user=self.db_user,
-                           passwd=self.db_passw, db=self.db_name)
-        db_users.connect()
+        db_users = None
+        if db_load is not None:
+            db_users = self.db_connection(db=self.db_name)
+            db_users.connect()
         users_file_to_db(con=db_users, lang=self.lang,
                          log_file=os.path.join(data_dir, 'logs', 'users.log'),
-                         tmp_dir=os.path.join(data_dir, 'tmp')
+                         tmp_dir=os.path.join(data_dir, 'tmp'),
+                         user_store=user_store, bulk_load=bulk_load
                          )
-        db_users.close()
+        if db_load is not None:
+            db_users.close()
+            db_load.connect()
+            db_load.end_server_load()
+            db_load.close()
         # TODO: logger; ETL step completed, proceeding with data
         # analysis and visualization
-        print("ETL:RevHistory task finished for language %s and date %s" % (
-              self.lang, self.date))
+        print("%s task finished for language %s and date %s" % (
+              self.task_name, self.lang, self.date))
         print()
-        # Create primary keys for all tables
+        if db_load is None:
+            print("Rows written by %r" % bulk_load)
+            return
+        # Create primary keys and indexes for all tables
         # TODO: This must also be tracked by main logging module
-        print("Now creating primary key indexes in database tables.")
+        print("Now creating primary keys and indexes in database tables.")
         print("This may take a while...")
         print()
-        db_pks = MySQLDB(host='localhost', port=3306, user=self.db_user,
-                         passwd=self.db_passw, db=self.db_name)
+        db_pks = self.db_connection(db=self.db_name)
         db_pks.connect()
-        db_pks.create_pks_revhist()
+        db_pks.create_pks_revhist(workers=index_workers,
+                                  combine=index_combine)
         db_pks.close()
 
 
+class RevMetaTask(RevHistoryTask):
+    """
+    A complete, multiprocessing parser of stub-meta-history dump files
+    (metadata of pages and revisions, without revision text)
+    """
+    task_name = 'ETL:RevMeta'
+    dump_type = 'stub-meta-history'
+    dump_patterns = ['*stub-meta-history*.xml.gz', '*stub-meta-history*.xml']
+    downloader = RevMetaDownloader
+    etl_class = RevisionMetaETL
+
+
 class PagesLoggingTask(Task):
     """
     A complete, multiprocessing parser of page-logging dump files
     """
 
     def __init__(self, host, port, db_name, db_user, db_passw, db_engine,
-                 lang='scowiki', date=None, etl_lines=1):
+                 lang='scowiki', date=None, etl_lines=1,
+                 db_backend='mysql'):
         """
         Builder method of class RevisionHistoryRetrieval.
         Arguments:
@@ -287,30 +444,53 @@ class PagesLoggingTask(Task):
                                                port=port, db_name=db_name,
                                                db_user=db_user,
                                                db_passw=db_passw,
-                                               db_engine=db_engine)
+                                               db_engine=db_engine,
+                                               db_backend=db_backend)
         self.etl_lines = etl_lines
         self.etl_list = []
 
     def create_DB(self, complete=False):
         if complete:
-            db_create = MySQLDB(host=self.host, port=self.port,
-                                user=self.db_user, passwd=self.db_passw)
+            db_create = self.db_connection()
             db_create.connect()
             db_create.create_database(self.db_name)
             db_create.close()
-        db_schema = MySQLDB(host=self.host, port=self.port, user=self.db_user,
-                            passwd=self.db_passw, db=self.db_name)
+        db_schema = self.db_connection(db=self.db_name)
         db_schema.connect()
         db_schema.create_schema_logitem(engine=self.db_engine)
         db_schema.close()
 
     def execute(self, log_fan, log_cache_size,
                 mirror, download_files, base_ports, control_ports,
-                dumps_dir=None, debug=False):
+                dumps_dir=None, debug=False, xml_parser='lxml',
+                decompressor='auto', decomp_threads=None, transport=None,
+                metrics_interval=0, profiling=None, memory_budget=0,
+                bulk_load=None, index_workers=4, index_combine=False):
         """
         Run data retrieval and loading actions.
         Arguments:
             - log_fan = Number of workers to fan out logitem elements parsing
+            - xml_parser = XML parser engine, 'lxml' or 'expat'
+            - decompressor = Decompression tool ('auto', 'python' or name
+              of an installed tool, e.g. 'lbzip2')
+            - decomp_threads = Number of threads for parallel decompressors
+            - transport = Settings of channels between processes
+              (comutils.Transport)
+            - metrics_interval = Seconds between updates of metrics files
+              of ETL line (0 disables metrics)
+            - profiling = Settings of profiling of all processes
+              (profiling.Profiling), None to disable it
+            - memory_budget = Memory budget of all processes of the task
+              in MB. XML readers are paused while it is exceeded (see
+              governor.MemoryGovernor). 0 disables it.
+            - bulk_load = Settings of loading of chunks of rows in DB
+              (loader.BulkLoad), chunk files read by the DB server by
+              default, or columnar.ParquetSink to write Parquet datasets
+              without a DB
+            - index_workers = Number of tables whose indexes are built at
+              once, on separate DB connections
+            - index_combine = Build all indexes of each table in a single
+              ALTER TABLE
             - db_user = User name to connect to local database
             - db_passw = Password for database user
             - mirror = Base URL of site hosting XML dumps
@@ -392,12 +572,21 @@ class PagesLoggingTask(Task):
             print("paths: ", str(self.paths))
             print()
 
-        # Create database if it does not exist
-        # empty logging table otherwise
-        if self.DB_exists():
-            self.create_DB(complete=False)
-        else:
-            self.create_DB(complete=True)
+        if bulk_load is None:
+            bulk_load = BulkLoad()
+        if bulk_load.uses_db():
+            # Create database if it does not exist
+            # empty logging table otherwise
+            if self.DB_exists():
+                self.create_DB(complete=False)
+            else:
+                self.create_DB(complete=True)
+
+        governor = None
+        if memory_budget:
+            governor = MemoryGovernor(
+                memory_budget, log_file=os.path.join(
+                    os.path.split(self.paths[0])[0], 'logs', 'memory.log'))
 
         new_etl = LoggingETL(name="[ETL:PagesLogging-0]",
                              path=self.paths, lang=self.lang,
@@ -406,29 +595,64 @@ class PagesLoggingTask(Task):
                              db_name=self.db_name,
                              db_user=self.db_user, db_passw=self.db_passw,
                              base_port=base_ports[0]+(30),
-                             control_port=control_ports[0]+(30)
+                             control_port=control_ports[0]+(30),
+                             xml_parser=xml_parser,
+                             decompressor=decompressor,
+                             decomp_threads=decomp_threads,
+                             transport=transport,
+                             metrics_interval=metrics_interval,
+                             profiling=profiling,
+                             flow=(governor.flow if governor is not None
+                                   else None),
+                             bulk_load=bulk_load,
+                             db_backend=self.db_backend
                              )
         print("ETL:Logging task for administrative records defined OK.")
         print("Proceeding with ETL workflow. This may take time...")
         print()
+        # Global settings of load profile, while the ETL line loads data
+        db_load = None
+        if bulk_load.uses_db():
+            db_load = self.db_connection(
+                db=self.db_name, load_profile=bulk_load.profile)
+            db_load.connect()
+            db_load.begin_server_load()
+            db_load.close()
         # Extract, process and load information in local DB
         new_etl.start()
         # Wait for ETL line to finish
+        if governor is not None:
+            while new_etl.is_alive():
+                governor.check()
+                time.sleep(0.5)
+            governor.release()
         new_etl.join()
+        if db_load is not None:
+            db_load.connect()
+            db_load.end_server_load()
+            db_load.close()
+        if new_etl.exitcode != 0:
+            # Do not build indexes on incomplete data
+            print("Error: ETL line %s failed" % new_etl.name)
+            print("Program will exit now.")
+            sys.exit(1)
         # TODO: logger; ETL step completed, proceeding with data
         # analysis and visualization
         print("ETL:Logging task finished for lang %s and date %s" % (
               self.lang, self.date))
         print()
+        if db_load is None:
+            print("Rows written by %r" % bulk_load)
+            return
         # Create primary keys for all tables
         # TODO: This must also be tracked by official logging module
         print("Now creating primary key indexes in database tables.")
         print("This may take a while...")
         print()
-        db_pks = MySQLDB(host='localhost', port=3306, user=self.db_user,
-                         passwd=self.db_passw, db=self.db_name)
+        db_pks = self.db_connection(db=self.db_name)
         db_pks.connect()
-        db_pks.create_pks_logitem()
+        db_pks.create_pks_logitem(workers=index_workers,
+                                  combine=index_combine)
         db_pks.close()
 
 
@@ -437,7 +661,7 @@ class SQLDumpsTask(Task):
     Class docstring
     """
     def __init__(self, host, port, db_name, db_user, db_passw, db_engine,
-                 lang='scowiki', date=None):
+                 lang='scowiki', date=None, db_backend='mysql'):
         """
         Builder method of class SQLDumpsTask.
         Arguments:
@@ -448,14 +672,14 @@ class SQLDumpsTask(Task):
                                            port=port, db_name=db_name,
                                            db_user=db_user,
                                            db_passw=db_passw,
-                                           db_engine=db_engine)
+                                           db_engine=db_engine,
+                                           db_backend=db_backend)
 
     def createDB(self):
         """
         Creates new DB to load SQL dump files if required
         """
-        db_create = MySQLDB(host=self.host, port=self.port,
-                            user=self.db_user, passwd=self.db_passw)
+        db_create = self.db_connection()
         db_create.connect()
         db_create.create_database(self.db_name)
         db_create.close()
@@ -474,6 +698,11 @@ class SQLDumpsTask(Task):
                                                        time.localtime())))
         print("----------------------------------------------------------")
         print()
+        if self.db_backend != 'mysql':
+            # SQL dump files are written by mysqldump, with MySQL syntax
+            print("ETL:SQLDumps requires the mysql DB backend, skipped.")
+            print()
+            return
         if download_files:
             # TODO: Use proper logging module to track execution progress
             # Choose corresponding file downloader and etl wrapper
@@ -562,8 +791,8 @@ class SQLDumpsTask(Task):
         # Beware that, by default, all dumps include drop/create table queries
         # and ENGINE is hard set to InnoDB
         # Primary keys and indexes are also defined by default
-        # TODO: Explore possible options to load data into PostgreSQL
-        # and other different DB backends
+        # TODO: Translate MySQL syntax of SQL dump files to load them into
+        # PostgreSQL (other tasks support it, see utils.pgutils)
         new_etl = SQLDumpsETL(name="[ETL:SQLDumps-0]",
                               path=self.paths, lang=self.lang,
                               db_name=self.db_name,
@@ -575,6 +804,11 @@ class SQLDumpsTask(Task):
         # Extract, process and load information in local DB
         new_etl.start()
         # Wait for ETL line to finish
+        if governor is not None:
+            while new_etl.is_alive():
+                governor.check()
+                time.sleep(0.5)
+            governor.release()
         new_etl.join()
         # TODO: logger; ETL step completed, proceeding with data
         # analysis and visualization
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Combine profiles of pipeline processes per stage.
+
+Profile files written by processes of ETL lines run with --profile_dir
+(one per process, e.g. [ETL:RevHistory-0]-process_revision-2.pstats) are
+grouped by stage (process_revision), regardless of ETL line, worker or
+shard number. For every stage, a merged profile is written to the output
+dir (<stage>.pstats or <stage>.collapsed) and the top functions are
+printed. Example:
+
+    python -m wikidat.tools.profmerge profiles --output merged --top 20
+
+@author: jfelipe
+"""
+import argparse
+import collections
+import os
+import pstats
+from wikidat.utils.profiling import stage_name, EXTENSIONS
+
+
+def group_files(profile_dir):
+    """
+    Return dict {(stage, extension): [paths of profile files]}
+    """
+    groups = collections.defaultdict(list)
+    for file_name in sorted(os.listdir(profile_dir)):
+        name, ext = os.path.splitext(file_name)
+        if ext in EXTENSIONS.values():
+            groups[(stage_name(name), ext)].append(
+                os.path.join(profile_dir, file_name))
+    return groups
+
+
+def merge_pstats(paths, output=None):
+    """
+    Merge pstats files, writing result to output if given. Returns
+    pstats.Stats object.
+    """
+    stats = pstats.Stats(paths[0])
+    for path in paths[1:]:
+        stats.add(path)
+    if output is not None:
+        stats.dump_stats(output)
+    return stats
+
+
+def merge_collapsed(paths, output=None):
+    """
+    Merge collapsed stacks files, writing result to output if given.
+    Returns Counter {stack: samples}.
+    """
+    stacks = collections.Counter()
+    for path in paths:
+        with open(path) as in_file:
+            for line in in_file:
+                stack, count = line.rstrip('\n').rsplit(' ', 1)
+                stacks[stack] += int(count)
+    if output is not None:
+        with open(output, 'w') as out:
+            for stack, count in stacks.most_common():
+                out.write('%s %s\n' % (stack, count))
+    return stacks
+
+
+def print_collapsed(stacks, top):
+    """
+    Print top functions of collapsed stacks by own (leaf) and total
+    samples
+    """
+    total = sum(stacks.values())
+    own = collections.Counter()
+    cumulative = collections.Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for frame in set(frames):
+            cumulative[frame] += count
+    print("{0:>10} {1:>7} {2:>10} {3:>7}  function".format(
+          'own', '%', 'total', '%'))
+    for frame, count in own.most_common(top):
+        print("{0:>10} {1:6.1f}% {2:>10} {3:6.1f}%  {4}".format(
+              count, 100.0 * count / total, cumulative[frame],
+              100.0 * cumulative[frame] / total, frame))
+
+
+def merge(profile_dir, output_dir=None, top=20, sort='cumulative'):
+    """
+    Merge profile files in profile_dir per stage, writing merged profiles
+    to output_dir (if given) and printing the top functions of each stage
+    """
+    if output_dir is not None and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    groups = group_files(profile_dir)
+    for (stage, ext), paths in sorted(groups.items()):
+        output = None
+        if output_dir is not None:
+            output = os.path.join(output_dir, stage + ext)
+        print("=" * 70)
+        print("Stage %s: %s profile files" % (stage, len(paths)))
+        if ext == EXTENSIONS['cprofile']:
+            stats = merge_pstats(paths, output)
+            stats.sort_stats(sort).print_stats(top)
+        else:
+            print_collapsed(merge_collapsed(paths, output), top)
+    return groups
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.
+                                     RawDescriptionHelpFormatter)
+    parser.add_argument('profile_dir', help='Dir with profile files')
+    parser.add_argument('--output', metavar='DIR',
+                        help='Write merged profiles per stage to DIR')
+    parser.add_argument('--top', type=int, default=20,
+                        help='Number of functions printed per stage')
+    parser.add_argument('--sort', default='cumulative',
+                        help='Sort key of pstats profiles (cumulative, '
+                             'tottime, ncalls...)')
+    args = parser.parse_args()
+    merge(args.profile_dir, output_dir=args.output, top=args.top,
+          sort=args.sort)
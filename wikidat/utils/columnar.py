@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar output of ETL workflows, as Parquet datasets (requires pyarrow).
+
+ParquetSink is an alternative to loader.BulkLoad with the same interface
+(loader and writer), so consumers write rows of each table to typed,
+compressed Parquet files instead of loading them in MySQL/MariaDB. No DB
+server is needed. Every table goes to a dataset dir
+<out_dir>/<table>, partitioned in Hive style (key=value dirs) by the
+columns in PARQUET_TABLES:
+
+    - page by namespace (namespace=<page_namespace>)
+    - revision, logging, block, user_new and user_level by year of their
+      timestamp (year=<YYYY>)
+    - other tables (revision_hash, revision_IP, revision_diff, user,
+      revision_user_zero, namespaces) are not partitioned
+
+Each consumer writes its own file in every partition,
+<prefix>.parquet, so ETL lines never share files. Rows are buffered by
+the writer of each table and flushed as a new row group of every
+partition when the consumer rotates its chunk (every file_rows rows).
+Partition keys are not stored in files, they are read from dir names
+(e.g. pyarrow.dataset.dataset(path, partitioning='hive')).
+
+Values 'NULL' (NULL in chunk files) are stored as nulls, as well as empty
+strings of numeric and timestamp columns.
+"""
+import glob
+import os
+import re
+import time
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+PARQUET_COMPRESSIONS = ('zstd', 'snappy', 'gzip', 'lz4', 'none')
+
+# Columns (name, type) and partitions (key, column) of every table, with
+# the same columns as base_schema
+PARQUET_TABLES = {
+    'page': ([('page_id', 'uint32'), ('page_namespace', 'int16'),
+              ('page_title', 'string'), ('page_restrictions', 'string')],
+             [('namespace', 'page_namespace')]),
+    'revision': ([('rev_id', 'uint32'), ('rev_page', 'uint32'),
+                  ('rev_user', 'int32'), ('rev_timestamp', 'timestamp'),
+                  ('rev_len', 'uint32'), ('rev_parent_id', 'uint32'),
+                  ('rev_is_redirect', 'uint8'), ('rev_minor_edit', 'uint8'),
+                  ('rev_fa', 'uint8'), ('rev_flist', 'uint8'),
+                  ('rev_ga', 'uint8'), ('rev_comment', 'string')],
+                 [('year', 'rev_timestamp')]),
+    'revision_hash': ([('rev_id', 'uint32'), ('rev_page', 'uint32'),
+                       ('rev_user', 'int32'), ('rev_hash', 'string')], []),
+    'revision_IP': ([('rev_id', 'uint32'), ('ip', 'uint32')], []),
+    'revision_diff': ([('rev_id', 'uint32'), ('rev_page', 'uint32'),
+                       ('rev_prev', 'uint32'), ('lines_added', 'uint32'),
+                       ('lines_removed', 'uint32'), ('bytes_added', 'uint32'),
+                       ('bytes_removed', 'uint32')], []),
+    'user': ([('user_id', 'int32'), ('user_name', 'string')], []),
+    'namespaces': ([('code', 'int16'), ('name', 'string')], []),
+    'revision_user_zero': ([('rev_id', 'uint32'), ('user_name', 'string')],
+                           []),
+    'logging': ([('log_id', 'uint32'), ('log_type', 'string'),
+                 ('log_action', 'string'), ('log_timestamp', 'timestamp'),
+                 ('log_user', 'int32'), ('log_username', 'string'),
+                 ('log_namespace', 'int32'), ('log_title', 'string'),
+                 ('log_comment', 'string'), ('log_params', 'string'),
+                 ('log_new_flag', 'uint32'), ('log_old_flag', 'uint32')],
+                [('year', 'log_timestamp')]),
+    'block': ([('block_id', 'uint32'), ('block_action', 'string'),
+               ('block_user', 'int32'), ('block_timestamp', 'timestamp'),
+               ('block_target', 'string'), ('block_ip', 'uint32'),
+               ('block_duration', 'float64')],
+              [('year', 'block_timestamp')]),
+    'user_new': ([('user_log_id', 'uint32'), ('user_id', 'int32'),
+                  ('user_name', 'string'), ('user_timestamp', 'timestamp'),
+                  ('user_action', 'string')],
+                 [('year', 'user_timestamp')]),
+    'user_level': ([('level_log_id', 'uint32'),
+                    ('level_granter_id', 'int32'),
+                    ('level_username', 'string'),
+                    ('level_timestamp', 'timestamp'),
+                    ('level_old', 'string'), ('level_new', 'string')],
+                   [('year', 'level_timestamp')]),
+}
+
+
+def _arrow_type(kind):
+    if kind == 'timestamp':
+        return pa.timestamp('s')
+    return getattr(pa, kind)()
+
+
+def _is_null(value):
+    return value is None or value == 'NULL'
+
+
+def column_array(values, kind):
+    """
+    Return Arrow array of type kind (see PARQUET_TABLES) of values of a
+    column in chunk rows
+    """
+    if kind == 'string':
+        return pa.array([None if _is_null(v) else
+                         v if isinstance(v, str) else str(v)
+                         for v in values], pa.string())
+    if kind == 'timestamp':
+        return pa.array([None if _is_null(v) or v == '' else v
+                         for v in values],
+                        pa.string()).cast(pa.timestamp('s'))
+    convert = float if kind.startswith('float') else int
+    return pa.array([None if _is_null(v) or v == '' else convert(v)
+                     for v in values], _arrow_type(kind))
+
+
+def _file_name(prefix):
+    # Prefixes are names of ETL lines, e.g. [ETL:RevHistory-0]
+    return re.sub(r'[^\w.-]+', '_', prefix).strip('_') or 'part'
+
+
+def dataset_files(out_dir, table):
+    """
+    Return list of paths of Parquet files of dataset of table in out_dir
+    """
+    return sorted(glob.glob(os.path.join(glob.escape(os.path.join(out_dir,
+                                                                  table)),
+                                         '**', '*.parquet'), recursive=True))
+
+
+def dataset_rows(out_dir, table):
+    """
+    Return number of rows of dataset of table in out_dir (from metadata
+    of its files)
+    """
+    return sum(pq.ParquetFile(path).metadata.num_rows
+               for path in dataset_files(out_dir, table))
+
+
+class ParquetSink(object):
+    """
+    Settings of columnar output of ETL workflows, shared by all consumers
+    of a task (used instead of loader.BulkLoad)
+
+    Arguments:
+        - out_dir = Directory of Parquet datasets (dir parquet next to the
+          tmp dir of dump files if None)
+        - compression = One of PARQUET_COMPRESSIONS
+    """
+    # Load profiles of DB sessions do not apply (see dbutils.LoadProfile)
+    profile = None
+
+    def __init__(self, out_dir=None, compression='zstd'):
+        if pa is None:
+            raise RuntimeError('Parquet output requires package pyarrow')
+        if compression not in PARQUET_COMPRESSIONS:
+            raise RuntimeError('Unsupported Parquet compression ' +
+                               str(compression))
+        self.out_dir = out_dir
+        self.compression = compression
+
+    def __repr__(self):
+        return "ParquetSink(%s, compression=%s)" % (self.out_dir,
+                                                     self.compression)
+
+    def uses_db(self):
+        return False
+
+    def is_local(self):
+        return False
+
+    def loader(self, con):
+        """
+        Return new ParquetDatasets of a consumer (con is not used)
+        """
+        return ParquetDatasets(compression=self.compression)
+
+    def writer(self, loader, table, tmp_dir, prefix):
+        """
+        Return new ParquetTableWriter of table, writing to the dataset of
+        table in out_dir (or dir parquet next to tmp_dir)
+        """
+        out_dir = (os.path.abspath(self.out_dir) if self.out_dir else
+                   os.path.join(os.path.dirname(tmp_dir.rstrip(os.sep)),
+                                'parquet'))
+        return ParquetTableWriter(loader, table, out_dir, prefix)
+
+
+class ParquetDatasets(object):
+    """
+    Parquet files written by a consumer, one for each partition of every
+    table, kept open until close. Counters as in loader.ChunkLoader: time
+    blocked flushing row groups (wait, the same as load_time, as flushes
+    are synchronous) and number of row groups written (chunks).
+
+    Arguments:
+        - compression = One of PARQUET_COMPRESSIONS
+    """
+    def __init__(self, compression='zstd'):
+        self.compression = compression
+        self.files = {}
+        self.chunks = 0
+        self.wait = 0.0
+        self.load_time = 0.0
+
+    def write(self, path, table):
+        """
+        Write Arrow table as a new row group of Parquet file in path
+        """
+        out = self.files.get(path)
+        if out is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            out = pq.ParquetWriter(path, table.schema,
+                                   compression=self.compression)
+            self.files[path] = out
+        out.write_table(table, row_group_size=max(table.num_rows, 1))
+        self.chunks += 1
+
+    def close(self):
+        """
+        Close all Parquet files (writing their footers)
+        """
+        start = time.time()
+        for out in self.files.values():
+            out.close()
+        self.files = {}
+        elapsed = time.time() - start
+        self.wait += elapsed
+        self.load_time += elapsed
+
+
+class ParquetTableWriter(object):
+    """
+    Writes rows of a table to its Parquet dataset in out_dir/<table>, with
+    one file <prefix>.parquet in every partition. Rows are buffered until
+    rotate, which writes them as new row groups.
+
+    Arguments:
+        - datasets = ParquetDatasets of the consumer
+        - table = Name of table, one of PARQUET_TABLES
+        - out_dir = Directory of Parquet datasets
+        - prefix = Prefix of file names (e.g. name of ETL line)
+    """
+    def __init__(self, datasets, table, out_dir, prefix):
+        if table not in PARQUET_TABLES:
+            raise RuntimeError('Unsupported Parquet table ' + str(table))
+        self.datasets = datasets
+        self.table = table
+        columns, partitions = PARQUET_TABLES[table]
+        self.columns = columns
+        self.schema = pa.schema([(name, _arrow_type(kind))
+                                 for name, kind in columns])
+        names = [name for name, kind in columns]
+        self.partitions = [(key, names.index(column),
+                            dict(columns)[column] == 'timestamp')
+                           for key, column in partitions]
+        self.path = os.path.join(out_dir, table)
+        self.file_name = _file_name(prefix) + '.parquet'
+        self.buffer = []
+        self.rows = 0
+        self.total = 0
+        # Delete files of previous runs in all partitions
+        for path in glob.glob(os.path.join(glob.escape(self.path), '**',
+                                           glob.escape(self.file_name)),
+                              recursive=True):
+            os.remove(path)
+
+    def writerow(self, row):
+        self.buffer.append(row)
+        self.rows += 1
+        self.total += 1
+
+    def partition(self, row):
+        """
+        Return dir of partition of row, relative to the dataset dir
+        """
+        keys = []
+        for key, index, year in self.partitions:
+            value = row[index]
+            if _is_null(value) or value == '':
+                value = '__HIVE_DEFAULT_PARTITION__'
+            elif year:
+                value = str(value)[:4]
+            keys.append('%s=%s' % (key, value))
+        return os.path.join(*keys) if keys else ''
+
+    def arrow_table(self, rows):
+        """
+        Return Arrow table with rows
+        """
+        return pa.Table.from_arrays(
+            [column_array([row[index] for row in rows], kind)
+             for index, (name, kind) in enumerate(self.columns)],
+            schema=self.schema)
+
+    def rotate(self):
+        """
+        Write buffered rows as a new row group of the file of each
+        partition
+        """
+        if not self.buffer:
+            return
+        start = time.time()
+        groups = {}
+        for row in self.buffer:
+            groups.setdefault(self.partition(row), []).append(row)
+        for partition, rows in groups.items():
+            self.datasets.write(os.path.join(self.path, partition,
+                                             self.file_name),
+                                self.arrow_table(rows))
+        self.buffer = []
+        self.rows = 0
+        elapsed = time.time() - start
+        self.datasets.wait += elapsed
+        self.datasets.load_time += elapsed
@@ -4,8 +4,28 @@ Created on Thu May 29 00:33:50 2014
 
 @author: jfelipe
 """
+import os
+import pickle
+import struct
+import tempfile
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
 import ujson
 import zlib
+import zmq
+
+# Supported serializers and compression codecs for data frames
+SERIALIZERS = ('ujson', 'msgpack', 'pickle')
+COMPRESSORS = ('zlib', 'lz4', 'zstd', 'none')
+# Supported transports: ZMQ endpoints or shared memory rings
+TRANSPORTS = ('tcp', 'ipc', 'shm')
+
+# Types of multipart frames: data (batch of items), end of stream and
+# control messages (dicts) sent by ETL lines to their workers
+DATA_FRAME = b'D'
+STOP_FRAME = b'S'
+CONTROL_FRAME = b'C'
 
 
 def send_ujson(socket, obj, flags=0):
@@ -20,3 +40,544 @@ def recv_ujson(socket, flags=0):
     z = socket.recv(flags)
     m = zlib.decompress(z).decode()
     return ujson.loads(m)
+
+
+def get_serializer(name):
+    """
+    Return functions (dumps, loads) for serializer name, converting
+    objects to bytes and back
+    """
+    if name == 'ujson':
+        return (lambda obj: ujson.dumps(obj).encode(),
+                lambda data: ujson.loads(bytes(data).decode()))
+    elif name == 'msgpack':
+        try:
+            import msgpack
+        except ImportError:
+            raise RuntimeError('Serializer msgpack requires package msgpack')
+        return (lambda obj: msgpack.packb(obj, use_bin_type=True),
+                lambda data: msgpack.unpackb(data, raw=False))
+    elif name == 'pickle':
+        return (lambda obj: pickle.dumps(obj, pickle.HIGHEST_PROTOCOL),
+                pickle.loads)
+    else:
+        raise RuntimeError('Unsupported serializer ' + str(name))
+
+
+def get_compressor(name):
+    """
+    Return functions (compress, decompress) for compression codec name
+    """
+    if name == 'zlib':
+        return (lambda data: zlib.compress(data, 1), zlib.decompress)
+    elif name == 'lz4':
+        try:
+            import lz4.frame
+        except ImportError:
+            raise RuntimeError('Compression lz4 requires package lz4')
+        return lz4.frame.compress, lz4.frame.decompress
+    elif name == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError('Compression zstd requires package zstandard')
+        return (zstandard.ZstdCompressor().compress,
+                zstandard.ZstdDecompressor().decompress)
+    elif name == 'none':
+        return None, None
+    else:
+        raise RuntimeError('Unsupported compression ' + str(name))
+
+
+class Transport(object):
+    """
+    Settings of communication channels between processes in ETL lines.
+
+    Items are sent downstream in batches of up to batch_size items per
+    frame. Each frame is serialized and compressed with the selected codecs.
+    Ports identify channels for all transports: 'tcp' binds them on
+    localhost, 'ipc' maps them to Unix domain sockets in ipc_dir and 'shm'
+    to shared memory rings (see ShmRing) of ring_size MB. Rings must be
+    created with create_ring() before starting processes using them.
+
+    Items queued in ZMQ channels are bounded by high-water marks set on
+    data sockets with configure(): up to hwm_items items on each side of a
+    channel (rounded up to whole batches). Senders block when a channel is
+    full. This bounds the number of items, not their size: with large
+    revision texts, each channel may still hold hwm_items items of any
+    length (see MemoryGovernor for a budget in bytes). sock_buffer only
+    sets the size of kernel socket buffers, on top of ZMQ queues. Queues
+    of shm channels are always bounded by ring_size.
+
+    Arguments:
+        - serializer = One of SERIALIZERS
+        - compression = One of COMPRESSORS ('none' suits localhost links)
+        - batch_size = Max. number of items per data frame
+        - transport = One of TRANSPORTS
+        - ipc_dir = Directory for ipc endpoints (defaults to tmp dir)
+        - ring_size = Size of shm rings in MB
+        - hwm_items = Max. number of items queued on each side of ZMQ
+          channels (0 keeps ZMQ default of 1000 frames)
+        - sock_buffer = Size in bytes of kernel send and receive buffers of
+          ZMQ channels (0 keeps OS default). It does not bound ZMQ queues.
+    """
+    def __init__(self, serializer='ujson', compression='zlib',
+                 batch_size=100, transport='tcp', ipc_dir=None,
+                 ring_size=64, hwm_items=0, sock_buffer=0):
+        if transport not in TRANSPORTS:
+            raise RuntimeError('Unsupported transport ' + str(transport))
+        self.serializer = serializer
+        self.compression = compression
+        self.batch_size = max(1, batch_size)
+        self.transport = transport
+        self.ipc_dir = ipc_dir or tempfile.gettempdir()
+        self.ring_size = ring_size
+        self.hwm_items = hwm_items
+        self.sock_buffer = sock_buffer
+        self.rings = {}
+        # Check codecs are available before starting any process
+        get_serializer(serializer)
+        get_compressor(compression)
+
+    def __repr__(self):
+        return "Transport(%s, %s, batch_size=%s, %s)" % (
+            self.serializer, self.compression, self.batch_size,
+            self.transport)
+
+    def endpoint(self, port):
+        """
+        Return ZMQ endpoint for channel identified by port
+        """
+        if self.transport == 'ipc':
+            return "ipc://%s" % os.path.join(self.ipc_dir,
+                                             'wikidat-%s.ipc' % port)
+        return "tcp://127.0.0.1:%s" % port
+
+    def is_shm(self):
+        return self.transport == 'shm'
+
+    def configure(self, socket):
+        """
+        Set high-water marks and kernel buffer size of ZMQ data socket,
+        before binding or connecting it
+        """
+        if self.hwm_items:
+            frames = max(1, -(-self.hwm_items // self.batch_size))
+            socket.setsockopt(zmq.SNDHWM, frames)
+            socket.setsockopt(zmq.RCVHWM, frames)
+        if self.sock_buffer:
+            socket.setsockopt(zmq.SNDBUF, self.sock_buffer)
+            socket.setsockopt(zmq.RCVBUF, self.sock_buffer)
+        return socket
+
+    def create_ring(self, port, readers=1):
+        """
+        Create shared memory ring for channel identified by port, read by
+        a number of readers (processes competing for its items)
+        """
+        if port not in self.rings:
+            self.rings[port] = ShmRing(self.ring_size << 20, readers=readers)
+        return self.rings[port]
+
+    def close_rings(self):
+        """
+        Release all shared memory rings created by this process
+        """
+        for ring in self.rings.values():
+            ring.close(unlink=True)
+        self.rings = {}
+
+    def sender(self, channel):
+        """
+        Return new sender writing to channel (ZMQ socket, list of ZMQ
+        sockets or port of a shm ring) with these settings
+        """
+        if self.is_shm():
+            return RingSender(self.rings[channel], self.serializer,
+                              self.compression, self.batch_size)
+        return FrameSender(channel, self.serializer, self.compression,
+                           self.batch_size)
+
+    def receiver(self, channel):
+        """
+        Return new receiver reading from channel (ZMQ socket or port of a
+        shm ring) with these settings
+        """
+        if self.is_shm():
+            return RingReceiver(self.rings[channel], self.serializer,
+                                self.compression)
+        return FrameReceiver(channel, self.serializer, self.compression)
+
+
+class FrameSender(object):
+    """
+    Accumulates items and sends them in batches as multipart frames
+    [DATA_FRAME, payload]. End of stream is signalled with [STOP_FRAME].
+
+    Sockets can be a single socket or a list of sockets, one for every
+    reader. Batches go to the next reader able to take them without
+    blocking (round-robin), and end of stream is sent to all of them.
+
+    Counters: items sent, payload bytes sent and time (sec.) blocked
+    waiting for readers (wait).
+    """
+    def __init__(self, sockets, serializer='ujson', compression='zlib',
+                 batch_size=100):
+        if not isinstance(sockets, (list, tuple)):
+            sockets = [sockets]
+        self.sockets = sockets
+        self.dumps = get_serializer(serializer)[0]
+        self.compress = get_compressor(compression)[0]
+        self.batch_size = batch_size
+        self.batch = []
+        self.next = 0
+        self.sent = 0
+        self.bytes = 0
+        self.wait = 0.0
+
+    def send(self, item):
+        """
+        Add item to current batch, sending it if full
+        """
+        self.batch.append(item)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def _encode(self, obj):
+        payload = self.dumps(obj)
+        if self.compress is not None:
+            payload = self.compress(payload)
+        return payload
+
+    def flush(self):
+        """
+        Send pending items in current batch (if any)
+        """
+        if not self.batch:
+            return
+        self._send_data(self._encode(self.batch))
+        self.sent += len(self.batch)
+        self.batch = []
+
+    def _send_data(self, payload):
+        self.bytes += len(payload)
+        frames = [DATA_FRAME, payload]
+        num = len(self.sockets)
+        for k in range(num):
+            socket = self.sockets[(self.next + k) % num]
+            try:
+                socket.send_multipart(frames, flags=zmq.NOBLOCK, copy=False)
+                self.next = (self.next + k + 1) % num
+                return
+            except zmq.Again:
+                continue
+        # All readers are busy, wait for the next one
+        start = time.time()
+        self.sockets[self.next].send_multipart(frames, copy=False)
+        self.wait += time.time() - start
+        self.next = (self.next + 1) % num
+
+    def send_stop(self):
+        """
+        Flush pending items and send end of stream frame to all readers
+        """
+        self.flush()
+        for socket in self.sockets:
+            socket.send_multipart([STOP_FRAME])
+
+    def send_control(self, message):
+        """
+        Send control message (dict) to all readers
+        """
+        payload = self._encode(message)
+        for socket in self.sockets:
+            socket.send_multipart([CONTROL_FRAME, payload])
+
+
+class FrameReceiver(object):
+    """
+    Receives multipart frames sent by FrameSender
+
+    Counters: payload bytes received and time (sec.) blocked waiting for
+    new frames (wait).
+    """
+    def __init__(self, socket, serializer='ujson', compression='zlib'):
+        self.socket = socket
+        self.loads = get_serializer(serializer)[1]
+        self.decompress = get_compressor(compression)[1]
+        self.bytes = 0
+        self.wait = 0.0
+
+    def queued(self):
+        """
+        Bytes waiting to be read in input channel, if known (None otherwise)
+        """
+        return None
+
+    def _decode(self, payload):
+        if self.decompress is not None:
+            payload = self.decompress(payload)
+        return self.loads(payload)
+
+    def recv(self, flags=0):
+        """
+        Return list of items in next data frame, None for end of stream or
+        dict with a control message
+        """
+        start = time.time()
+        frames = self.socket.recv_multipart(flags, copy=False)
+        self.wait += time.time() - start
+        if frames[0].bytes == STOP_FRAME:
+            return None
+        self.bytes += len(frames[1])
+        return self._decode(frames[1].buffer)
+
+
+class ShmRing(object):
+    """
+    Ring buffer in shared memory, carrying records (serialized batches of
+    items) between processes on the same host. Several processes can write
+    to and read from the same ring: each record is read by only one of
+    them, like items sent through ZMQ PUSH/PULL sockets.
+
+    Records are copied once into the ring by writers and readers decode them
+    directly from a view of the shared buffer, without any copy through the
+    kernel. Writers and readers only block each other to update positions,
+    so a writer can copy a new record while a reader is decoding another.
+
+    Layout: header with write (head) and read (tail) positions, followed by
+    records [length, payload] aligned to 8 bytes. A record of length 0
+    marks the end of stream and WRAP marks the end of data before the
+    buffer wraps around.
+    """
+    HEADER = struct.Struct('<QQ')
+    LENGTH = struct.Struct('<I')
+    WRAP = 0xFFFFFFFF
+
+    def __init__(self, size, readers=1):
+        self.size = size - (size % 8)
+        self.readers = readers
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=self.HEADER.size + self.size)
+        self.HEADER.pack_into(self.shm.buf, 0, 0, 0)
+        self.cond = mp.Condition(mp.Lock())
+        self.write_lock = mp.Lock()
+        self.read_lock = mp.Lock()
+
+    def _align(self, length):
+        return (self.LENGTH.size + length + 7) & ~7
+
+    def max_record(self):
+        """
+        Max. length of records, so they always fit in the ring
+        """
+        return self.size // 2 - self.LENGTH.size
+
+    def used(self):
+        """
+        Bytes taken by records not read yet
+        """
+        head, tail = self.HEADER.unpack_from(self.shm.buf, 0)
+        return head - tail
+
+    def write(self, payload):
+        """
+        Write record to ring, waiting for free space if it is full.
+        Empty payloads mark the end of stream.
+        """
+        length = len(payload)
+        if length > self.max_record():
+            raise RuntimeError('Record of %s bytes does not fit in ring' %
+                               length)
+        need = self._align(length)
+        buf = self.shm.buf
+        with self.write_lock:
+            with self.cond:
+                while True:
+                    head, tail = self.HEADER.unpack_from(buf, 0)
+                    pos = head % self.size
+                    # Skip end of buffer if record does not fit in it
+                    skip = self.size - pos if self.size - pos < need else 0
+                    if self.size - (head - tail) >= skip + need:
+                        break
+                    self.cond.wait()
+            # Copy record into free space, only readable after moving head
+            offset = self.HEADER.size
+            if skip:
+                self.LENGTH.pack_into(buf, offset + pos, self.WRAP)
+                pos = 0
+            self.LENGTH.pack_into(buf, offset + pos, length)
+            buf[offset + pos + 4:offset + pos + 4 + length] = payload
+            with self.cond:
+                tail = self.HEADER.unpack_from(buf, 0)[1]
+                self.HEADER.pack_into(buf, 0, head + skip + need, tail)
+                self.cond.notify_all()
+
+    def read(self, decode):
+        """
+        Wait for next record and return decode(view) of its payload, or
+        None for end of stream. Space is released once decode returns.
+        """
+        buf = self.shm.buf
+        offset = self.HEADER.size
+        with self.read_lock:
+            with self.cond:
+                while True:
+                    head, tail = self.HEADER.unpack_from(buf, 0)
+                    if head != tail:
+                        break
+                    self.cond.wait()
+            pos = tail % self.size
+            length = self.LENGTH.unpack_from(buf, offset + pos)[0]
+            skip = 0
+            if length == self.WRAP:
+                skip = self.size - pos
+                pos = 0
+                length = self.LENGTH.unpack_from(buf, offset)[0]
+            if length == 0:
+                result = None
+            else:
+                view = buf[offset + pos + 4:offset + pos + 4 + length]
+                try:
+                    result = decode(view)
+                finally:
+                    view.release()
+            with self.cond:
+                head = self.HEADER.unpack_from(buf, 0)[0]
+                self.HEADER.pack_into(buf, 0, head,
+                                      tail + skip + self._align(length))
+                self.cond.notify_all()
+        return result
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class RingSender(FrameSender):
+    """
+    Sends batches of items to a ShmRing. End of stream is signalled with
+    one empty record for every reader of the ring.
+    """
+    def __init__(self, ring, serializer='ujson', compression='zlib',
+                 batch_size=100):
+        super(RingSender, self).__init__(None, serializer, compression,
+                                         batch_size)
+        self.ring = ring
+
+    def flush(self):
+        if not self.batch:
+            return
+        self._write(self.batch)
+        self.sent += len(self.batch)
+        self.batch = []
+
+    def _write(self, batch):
+        payload = self._encode(batch)
+        # Split batches too large for the ring
+        if len(payload) > self.ring.max_record() and len(batch) > 1:
+            half = len(batch) // 2
+            self._write(batch[:half])
+            self._write(batch[half:])
+        else:
+            self.bytes += len(payload)
+            start = time.time()
+            self.ring.write(payload)
+            self.wait += time.time() - start
+
+    def send_stop(self):
+        self.flush()
+        for x in range(self.ring.readers):
+            self.ring.write(b'')
+
+    def send_control(self, message):
+        """
+        Write control message (dict) once for every reader. Readers compete
+        for records, so each reader is only guaranteed to get one of them
+        if it stops reading afterwards (e.g. STOP messages).
+        """
+        payload = self._encode(message)
+        for x in range(self.ring.readers):
+            self.ring.write(payload)
+
+
+class RingReceiver(FrameReceiver):
+    """
+    Receives batches of items sent by RingSender
+    """
+    def __init__(self, ring, serializer='ujson', compression='zlib'):
+        super(RingReceiver, self).__init__(None, serializer, compression)
+        self.ring = ring
+        self.start = None
+
+    def queued(self):
+        return self.ring.used()
+
+    def _decode_record(self, view):
+        # Waiting time ends when a record is available
+        self.wait += time.time() - self.start
+        self.start = None
+        self.bytes += len(view)
+        return self._decode(view)
+
+    def recv(self, flags=0):
+        """
+        Return list of items in next record, None for end of stream or dict
+        with a control message
+        """
+        self.start = time.time()
+        result = self.ring.read(self._decode_record)
+        if self.start is not None:
+            self.wait += time.time() - self.start
+        return result
+
+
+class AffinitySender(object):
+    """
+    Sends items to several channels (one for every reader) keeping
+    consecutive items with the same key on the same channel, e.g. all
+    revisions of a page go to the same revision worker. A new channel is
+    taken in turn (round-robin) every time the key changes. Each channel
+    has its own sender (FrameSender or RingSender) and batches.
+
+    Arguments:
+        - senders = List of senders, one for every reader
+        - key = Name of the item field used as key (e.g. 'page_id')
+    """
+    def __init__(self, senders, key):
+        self.senders = senders
+        self.key = key
+        self.last_key = None
+        self.current = -1
+
+    def send(self, item):
+        key = item[self.key]
+        if key != self.last_key or self.current < 0:
+            self.last_key = key
+            self.current = (self.current + 1) % len(self.senders)
+        self.senders[self.current].send(item)
+
+    def flush(self):
+        for sender in self.senders:
+            sender.flush()
+
+    def send_stop(self):
+        for sender in self.senders:
+            sender.send_stop()
+
+    def send_control(self, message):
+        for sender in self.senders:
+            sender.send_control(message)
+
+    @property
+    def sent(self):
+        return sum(sender.sent for sender in self.senders)
+
+    @property
+    def bytes(self):
+        return sum(sender.bytes for sender in self.senders)
+
+    @property
+    def wait(self):
+        return sum(sender.wait for sender in self.senders)
@@ -4,12 +4,232 @@ Created on Sat Mar 29 22:27:02 2014
 
 @author: jfelipe
 """
+import logging
 import pymysql
 import warnings
 import wikidat.retrieval.db.base_schema as bs
+from wikidat.utils.indexes import IndexBuilder, table_queries
+from wikidat.utils.loader import LOAD_QUERY, load_fifo
 
 
-class MySQLDB(object):
+class LoadProfile(object):
+    """
+    Settings of DB sessions loading data in bulk. Previous values of
+    session variables are saved in user variables of the session changing
+    them (@wikidat_<variable>) and restored afterwards. Previous values of
+    global variables are kept by MySQLDB.begin_server_load. Keys are not
+    disabled while loading: tables are loaded without secondary indexes,
+    which are built afterwards (see create_indexes).
+
+    Arguments:
+        - name = Name of profile
+        - session = List of (variable, value) set in every loader
+          connection before LOAD DATA
+        - server = List of (variable, value) set globally while a task
+          loads data (requires SUPER or SYSTEM_VARIABLES_ADMIN)
+        - optional = List of (variable, value) set in loader connections
+          only if their privileges allow it (e.g. sql_log_bin requires
+          SUPER or BINLOG ADMIN), left as is otherwise
+    """
+    def __init__(self, name, session=None, server=None, optional=None):
+        self.name = name
+        self.session = session if session is not None else []
+        self.server = server if server is not None else []
+        self.optional = optional if optional is not None else []
+
+    def __repr__(self):
+        settings = ['%s=%s' % item for item in self.session]
+        settings.extend('%s=%s if allowed' % item for item in self.optional)
+        settings.extend('GLOBAL %s=%s' % item for item in self.server)
+        return "LoadProfile(%s: %s)" % (self.name,
+                                        ', '.join(settings) or 'no changes')
+
+    def _setup(self, scope, settings):
+        queries = []
+        for variable, value in settings:
+            queries.append('SET @wikidat_%s = @@%s.%s' % (variable, scope,
+                                                          variable))
+            queries.append('SET %s %s = %s' % (scope, variable, value))
+        return queries
+
+    def _restore(self, scope, settings):
+        return ['SET %s %s = @wikidat_%s' % (scope, variable, variable)
+                for variable, value in reversed(settings)]
+
+    def session_setup(self):
+        return self._setup('SESSION', self.session)
+
+    def session_restore(self):
+        return self._restore('SESSION', self.session)
+
+
+# Checks skipped by every profile
+_SESSION_CHECKS = [('unique_checks', 0), ('foreign_key_checks', 0)]
+# No binary logging of loaded rows, if the DB user has admin privileges
+_SESSION_LOG_BIN = [('sql_log_bin', 0)]
+
+LOAD_PROFILES = {
+    'none': LoadProfile('none'),
+    'aria': LoadProfile('aria', session=_SESSION_CHECKS + [
+                        ('bulk_insert_buffer_size', 256 * 1024 * 1024),
+                        ('aria_sort_buffer_size', 512 * 1024 * 1024)],
+                        optional=_SESSION_LOG_BIN),
+    'myisam': LoadProfile('myisam', session=_SESSION_CHECKS + [
+                          ('bulk_insert_buffer_size', 256 * 1024 * 1024),
+                          ('myisam_sort_buffer_size', 512 * 1024 * 1024)],
+                          optional=_SESSION_LOG_BIN),
+    'innodb': LoadProfile('innodb', session=_SESSION_CHECKS,
+                          server=[('innodb_flush_log_at_trx_commit', 2)],
+                          optional=_SESSION_LOG_BIN),
+}
+
+
+def get_load_profile(name):
+    """
+    Return LoadProfile of name (one of LOAD_PROFILES, case insensitive)
+    """
+    if name is None:
+        return LOAD_PROFILES['none']
+    if name.lower() not in LOAD_PROFILES:
+        raise RuntimeError('Unsupported load profile ' + str(name))
+    return LOAD_PROFILES[name.lower()]
+
+
+DB_BACKENDS = ('mysql', 'postgresql')
+
+
+def get_db_class(name):
+    """
+    Return class of connections of DB backend name (one of DB_BACKENDS)
+    """
+    if name == 'mysql':
+        return MySQLDB
+    if name == 'postgresql':
+        # pgutils builds on this module
+        from wikidat.utils.pgutils import PostgresDB
+        return PostgresDB
+    raise RuntimeError('Unsupported DB backend ' + str(name))
+
+
+class DBBackend(object):
+    """
+    Abstract class defining common interface of connections to DB
+    backends (MySQLDB, pgutils.PostgresDB). Tasks, ETL lines, loaders and
+    index builders only use these methods:
+
+        - connect, close and clone (new connection with the same settings)
+        - send_query, insert_many and execute_query
+        - db_exists, create_database, create_schema_revhist,
+          create_schema_logitem and insert_namespaces
+        - load_chunk and chunk_encoder (bulk loading of chunks, see loader)
+        - index_queries and table_sizes (index builds after loading, see
+          create_indexes)
+        - begin_load, end_load, begin_server_load and end_server_load
+          (settings of sessions and server while loading, no changes by
+          default)
+    """
+    def connect(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def clone(self, local_infile=None, load_profile=None):
+        raise NotImplementedError
+
+    def send_query(self, query):
+        raise NotImplementedError
+
+    def insert_many(self, query_template, values):
+        raise NotImplementedError
+
+    def execute_query(self, query):
+        raise NotImplementedError
+
+    def db_exists(self, db):
+        raise NotImplementedError
+
+    def create_database(self, db):
+        raise NotImplementedError
+
+    def create_schema_revhist(self, engine='ARIA'):
+        raise NotImplementedError
+
+    def create_schema_logitem(self, engine='ARIA'):
+        raise NotImplementedError
+
+    def insert_namespaces(self, nsdict):
+        raise NotImplementedError
+
+    def load_chunk(self, table, path, data=None, local=False):
+        """
+        Load chunk file in path in table, read by the DB server or by the
+        client if local. In fifo mode, data are the contents of the chunk
+        (see loader.ChunkLoader). Errors are raised.
+        """
+        raise NotImplementedError
+
+    def chunk_encoder(self, table):
+        """
+        Return encoder of rows of table in chunk files, None for CSV
+        chunks (see loader.ChunkWriter)
+        """
+        return None
+
+    def index_queries(self, table, indexes, combine=False):
+        """
+        Return list of (names of indexes, query) adding indexes
+        [(index, columns), ...] to table (see indexes.IndexBuilder)
+        """
+        raise NotImplementedError
+
+    def table_sizes(self):
+        """
+        Return dict {table: size in bytes of data} of tables in current DB
+        """
+        return {}
+
+    def create_indexes(self, plan, workers=4, combine=False):
+        """
+        Create primary keys and indexes of index plan (see
+        base_schema.index_plan_revhist), building indexes of different
+        tables concurrently on up to workers connections. Returns list of
+        timings (see indexes.IndexBuilder).
+        """
+        builder = IndexBuilder(self, workers=workers, combine=combine)
+        timings = builder.build(plan, sizes=self.table_sizes())
+        builder.report()
+        return timings
+
+    def create_pks_revhist(self, workers=4, combine=False):
+        """
+        Create primary keys and indexes for baselines database tables in
+        revision history dumps
+        """
+        return self.create_indexes(bs.index_plan_revhist, workers=workers,
+                                   combine=combine)
+
+    def create_pks_logitem(self, workers=4, combine=False):
+        """
+        Create primary keys for baselines database tables in logging dump
+        """
+        return self.create_indexes(bs.index_plan_logitem, workers=workers,
+                                   combine=combine)
+
+    def begin_load(self):
+        pass
+
+    def end_load(self):
+        pass
+
+    def begin_server_load(self):
+        pass
+
+    def end_server_load(self):
+        pass
+
+
+class MySQLDB(DBBackend):
     """
     Models connections to MySQL database (convenience methods)
 
@@ -17,15 +237,23 @@ class MySQLDB(object):
     """
 
     def __init__(self, db=None, host='localhost', port=3306,
-                 user=None, passwd=None):
+                 user=None, passwd=None, local_infile=False,
+                 load_profile=None):
         """
-        Intilialize new MySQL DB connection object
+        Intilialize new MySQL DB connection object. local_infile allows
+        LOAD DATA LOCAL INFILE queries (files read by the client).
+        load_profile names the LoadProfile applied while loading data (see
+        begin_load).
         """
         self.db = db
         self.host = host
         self.port = port
         self.user = user
         self.passwd = passwd
+        self.local_infile = local_infile
+        self.load_profile = load_profile
+        self.saved_optional = []
+        self.saved_globals = []
         self.con = None  # Connection to DB
         self.cursor = None  # Cursor to DB
 
@@ -36,15 +264,31 @@ class MySQLDB(object):
         if self.db is None:
             self.con = pymysql.Connect(host=self.host, port=self.port,
                                        user=self.user, passwd=self.passwd,
-                                       charset="utf8", use_unicode=True)
+                                       charset="utf8", use_unicode=True,
+                                       local_infile=self.local_infile)
         else:
             # print "Connected to database: " + self.db
             self.con = pymysql.Connect(host=self.host, port=self.port,
                                        user=self.user, passwd=self.passwd,
                                        db=self.db, charset="utf8",
-                                       use_unicode=True)
+                                       use_unicode=True,
+                                       local_infile=self.local_infile)
         self.cursor = self.con.cursor()
 
+    def clone(self, local_infile=None, load_profile=None):
+        """
+        Return new (not connected) MySQLDB object with the same settings,
+        allowing local files if local_infile is given and with another
+        load profile if load_profile is given
+        """
+        if local_infile is None:
+            local_infile = self.local_infile
+        if load_profile is None:
+            load_profile = self.load_profile
+        return MySQLDB(db=self.db, host=self.host, port=self.port,
+                       user=self.user, passwd=self.passwd,
+                       local_infile=local_infile, load_profile=load_profile)
+
     def close(self):
         """
         Close existing connection to MySQL DB
@@ -88,6 +332,8 @@ class MySQLDB(object):
         self.send_query(bs.create_revision.format(**params))
         self.send_query(bs.drop_revision_hash)
         self.send_query(bs.create_revision_hash.format(**params))
+        self.send_query(bs.drop_revision_diff)
+        self.send_query(bs.create_revision_diff.format(**params))
         self.send_query(bs.drop_namespaces)
         self.send_query(bs.create_namespaces.format(**params))
         self.send_query(bs.drop_user)
@@ -114,34 +360,98 @@ class MySQLDB(object):
         self.send_query(bs.drop_user_level)
         self.send_query(bs.create_user_level.format(**params))
 
-    def create_pks_revhist(self):
+    def table_sizes(self):
         """
-        Create primary keys for baselines database tables in revision
-        history dumps
+        Return dict {table: size in bytes of data} of tables in current DB
         """
-        print("Creating primary key for table page...")
-        self.send_query(bs.pk_page)
-        print("Creating primary key for table revision...")
-        self.send_query(bs.pk_revision)
-        print("Creating primary key for table namespaces...")
-        self.send_query(bs.pk_namespaces)
-        print("Creating primary key for table user and others...")
-        print()
-        self.send_query(bs.pk_user)
-        self.send_query(bs.pk_revision_IP)
-        self.send_query(bs.pk_IP_country)
+        results = self.execute_query(bs.table_sizes)
+        if results is None:
+            return {}
+        return {table: size or 0 for table, size in results}
 
-    def create_pks_logitem(self):
+    def load_chunk(self, table, path, data=None, local=False):
         """
-        Create primary keys for baselines database tables in logging dump
+        Load CSV chunk in table with LOAD DATA [LOCAL] INFILE. In fifo
+        mode, data are streamed through a named pipe in path.
+        """
+        if data is None:
+            self.load_query(LOAD_QUERY % ('LOCAL ' if local else '', path,
+                                          table))
+        else:
+            load_fifo(path, data, lambda: self.load_query(
+                LOAD_QUERY % ('LOCAL ', path, table)))
+
+    def index_queries(self, table, indexes, combine=False):
+        """
+        Return list of (names of indexes, ALTER TABLE query) adding indexes
+        to table, a single ALTER TABLE with combine
+        """
+        return table_queries(table, indexes, combine=combine)
+
+    def begin_load(self):
+        """
+        Apply session settings of load profile before loading data.
+        Optional settings are skipped (with an error in the log) if the
+        DB user lacks privileges to change them.
+        """
+        profile = get_load_profile(self.load_profile)
+        logging.info("Load profile of connection: %r" % profile)
+        for query in profile.session_setup():
+            self.send_query(query)
+        self.saved_optional = []
+        for variable, value in profile.optional:
+            try:
+                self.cursor.execute('SELECT @@SESSION.%s' % variable)
+                previous = self.cursor.fetchone()[0]
+                self.cursor.execute('SET SESSION %s = %s' % (variable,
+                                                             value))
+            except Exception as e:
+                print("Load profile: %s not changed (%s)" % (variable, e))
+                logging.warning("Load profile: %s not changed (%s)" % (
+                                variable, e))
+                continue
+            self.saved_optional.append((variable, previous))
+
+    def end_load(self):
+        """
+        Restore settings changed by begin_load
         """
-        print("Creating primary key for table logging and block...")
-        print()
-        self.send_query(bs.pk_logging)
-        # PKs for additional tables used in data processing
-        self.send_query(bs.pk_block)
-        self.send_query(bs.pk_user_new)
-        self.send_query(bs.pk_user_level)
+        profile = get_load_profile(self.load_profile)
+        for variable, value in reversed(self.saved_optional):
+            self.send_query('SET SESSION %s = %s' % (variable,
+                                                     self.con.escape(value)))
+        self.saved_optional = []
+        for query in profile.session_restore():
+            self.send_query(query)
+
+    def begin_server_load(self):
+        """
+        Apply global settings of load profile while a task loads data,
+        recording them in the log. Previous values are kept in this object,
+        so the connection may be closed and opened again for
+        end_server_load.
+        """
+        profile = get_load_profile(self.load_profile)
+        print("Load profile:", profile)
+        logging.info("Load profile: %r" % profile)
+        self.saved_globals = []
+        for variable, value in profile.server:
+            try:
+                self.cursor.execute('SELECT @@GLOBAL.%s' % variable)
+            except Exception as e:
+                print("Exception in begin_server_load method: ", e)
+                continue
+            self.saved_globals.append((variable, self.cursor.fetchone()[0]))
+            self.send_query('SET GLOBAL %s = %s' % (variable, value))
+
+    def end_server_load(self):
+        """
+        Restore global settings changed by begin_server_load
+        """
+        for variable, value in reversed(self.saved_globals):
+            self.send_query('SET GLOBAL %s = %s' % (variable,
+                                                    self.con.escape(value)))
+        self.saved_globals = []
 
     def insert_namespaces(self, nsdict):
         """
@@ -169,6 +479,15 @@ class MySQLDB(object):
                 print("Exception in send_query method: ", e)
                 print(query)
 
+    def load_query(self, query):
+        """
+        Send bulk load query to DB. Unlike send_query, errors are raised,
+        so that chunks failing to load are not lost (see loader.ChunkLoader)
+        """
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', pymysql.Warning)
+            self.cursor.execute(query)
+
     def insert_many(self, query_template, values):
         """
         Send multiple statements to DB. Typically used in bulk data inserts.
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Memory governor of ETL tasks.
+
+Watches the memory taken by all processes of a task (the main process,
+its ETL lines and all their workers) and pauses XML readers while it
+exceeds a budget. Readers stop at the next batch boundary, so downstream
+workers and DB consumers can drain the queues. They are resumed once memory
+drops below a low watermark, or after max_stall seconds (memory held by
+processes other than queues, e.g. caches, may never be released). Stall
+events are printed and appended to a log file.
+
+Memory is measured as the proportional set size (PSS) of processes, so
+pages shared by several of them (e.g. shm rings) are only counted once.
+It is read from /proc (Linux only); if not available, RSS is used.
+"""
+import multiprocessing as mp
+import os
+import time
+
+
+def _proc_children():
+    """
+    Return dict {pid: [child pids]} of all processes in /proc
+    """
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as stat_file:
+                stat = stat_file.read()
+        except (IOError, OSError):
+            continue
+        # Process name in stat may contain spaces, ppid follows it
+        ppid = int(stat[stat.rfind(')') + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def process_tree(pid):
+    """
+    Return list with pid and pids of all its descendants
+    """
+    children = _proc_children()
+    pids = [pid]
+    pos = 0
+    while pos < len(pids):
+        pids.extend(children.get(pids[pos], []))
+        pos += 1
+    return pids
+
+
+def process_memory(pid):
+    """
+    Return memory taken by process pid in bytes (PSS, or RSS if PSS is
+    not available), 0 if process is gone
+    """
+    try:
+        with open('/proc/%s/smaps_rollup' % pid) as smaps:
+            for line in smaps:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    try:
+        with open('/proc/%s/statm' % pid) as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError):
+        return 0
+
+
+class MemoryGovernor(object):
+    """
+    Pauses XML readers of a task while its processes exceed a memory budget
+
+    Readers are given the flow event (see processors.Producer), set while
+    they can run. The task calls check() periodically.
+
+    Arguments:
+        - budget = Memory budget of all processes in MB
+        - low = Fraction of budget below which readers are resumed
+        - max_stall = Max. seconds readers are paused in a row
+        - log_file = Path of log file of stall events
+        - pid = Root of process tree (defaults to current process)
+    """
+    def __init__(self, budget, low=0.9, max_stall=60, log_file=None,
+                 pid=None):
+        self.budget = budget << 20
+        self.low = low
+        self.max_stall = max_stall
+        self.log_file = log_file
+        self.pid = pid if pid is not None else os.getpid()
+        self.flow = mp.Event()
+        self.flow.set()
+        self.stalls = 0
+        self.stall_start = None
+        self.stall_time = 0.0
+        self.peak = 0
+        self.enabled = os.path.isdir('/proc')
+        if not self.enabled:
+            print("Warning: /proc not available, memory governor disabled")
+
+    def usage(self):
+        """
+        Return memory taken by all processes of the task in bytes
+        """
+        return sum(process_memory(pid) for pid in process_tree(self.pid))
+
+    def _log(self, message):
+        message = "[%s] memory governor: %s" % (
+            time.strftime("%Y-%m-%d %H:%M:%S"), message)
+        print(message)
+        if self.log_file is not None:
+            log_dir = os.path.dirname(self.log_file)
+            if log_dir and not os.path.isdir(log_dir):
+                os.makedirs(log_dir, exist_ok=True)
+            with open(self.log_file, 'a') as log:
+                log.write(message + '\n')
+
+    def check(self):
+        """
+        Measure memory usage, pausing or resuming XML readers. Returns
+        memory usage in bytes.
+        """
+        if not self.enabled:
+            return 0
+        used = self.usage()
+        self.peak = max(self.peak, used)
+        if self.flow.is_set() and used > self.budget:
+            self.flow.clear()
+            self.stalls += 1
+            self.stall_start = time.time()
+            self._log("%.1f MB used, budget %.1f MB exceeded, pausing XML "
+                      "readers" % (used / 2.0**20, self.budget / 2.0**20))
+        elif not self.flow.is_set():
+            stall = time.time() - self.stall_start
+            if used < self.budget * self.low or stall >= self.max_stall:
+                self.flow.set()
+                self.stall_time += stall
+                self.stall_start = None
+                self._log("%.1f MB used, resuming XML readers after %.1f "
+                          "sec.%s" % (used / 2.0**20, stall,
+                                      '' if used < self.budget * self.low
+                                      else ' (max. stall time)'))
+        return used
+
+    def release(self):
+        """
+        Resume XML readers if paused and log summary of stall events
+        """
+        if not self.flow.is_set():
+            self.flow.set()
+            self.stall_time += time.time() - self.stall_start
+            self.stall_start = None
+        if self.enabled:
+            self._log("peak memory %.1f MB, %s stalls (%.1f sec.)" % (
+                      self.peak / 2.0**20, self.stalls, self.stall_time))
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Build of primary keys and indexes of DB tables after data loading.
+
+An index plan is a list of tuples (table, index, columns), see
+base_schema.index_plan_revhist. Index PRIMARY is the primary key of the
+table. IndexBuilder runs the plan on several DB connections at once:
+
+    - indexes of different tables are built concurrently, one worker
+      thread and connection per table at a time
+    - indexes of the same table are built in plan order by the same
+      worker, one ALTER TABLE for each index (or a single ALTER TABLE for
+      all of them with combine, so Aria/MyISAM tables are rebuilt only
+      once). Queries come from the DB backend (index_queries of DB
+      connections, see table_queries for MySQL).
+    - larger tables are taken first, if their sizes are known, so that
+      the longest builds do not start last
+
+Elapsed time of each ALTER TABLE is reported as it finishes, and a
+summary at the end (see IndexBuilder.report).
+"""
+import threading
+import time
+
+
+def index_clause(index, columns):
+    """
+    Return ALTER TABLE clause adding index on columns
+    """
+    if index == 'PRIMARY':
+        return 'ADD PRIMARY KEY (%s)' % columns
+    return 'ADD INDEX %s (%s)' % (index, columns)
+
+
+def table_queries(table, indexes, combine=False):
+    """
+    Return list of (names of indexes, ALTER TABLE query) adding indexes
+    [(index, columns), ...] to table, a single query for all of them with
+    combine
+    """
+    clauses = [(index, index_clause(index, columns))
+               for index, columns in indexes]
+    if combine:
+        return [([index for index, clause in clauses],
+                 'ALTER TABLE %s %s' % (table, ', '.join(
+                     clause for index, clause in clauses)))]
+    return [([index], 'ALTER TABLE %s %s' % (table, clause))
+            for index, clause in clauses]
+
+
+def plan_tables(plan, sizes=None):
+    """
+    Return list of (table, [(index, columns), ...]) of index plan, in plan
+    order or by decreasing size if sizes {table: bytes} are given (names of
+    tables in sizes may be in lower case)
+    """
+    tables = {}
+    order = []
+    for table, index, columns in plan:
+        if table not in tables:
+            tables[table] = []
+            order.append(table)
+        tables[table].append((index, columns))
+    if sizes:
+        order.sort(key=lambda table: sizes.get(table,
+                                               sizes.get(table.lower(), 0)),
+                   reverse=True)
+    return [(table, tables[table]) for table in order]
+
+
+class IndexBuilder(object):
+    """
+    Builds indexes of an index plan on concurrent DB connections
+
+    Arguments:
+        - con = DB connection (e.g. MySQLDB). Workers use new connections
+          with the same settings (con.clone())
+        - workers = Max. number of tables whose indexes are built at once
+        - combine = Build all indexes of each table in a single ALTER TABLE
+          (or a single round trip, depending on the DB backend)
+    """
+    def __init__(self, con, workers=4, combine=False):
+        self.con = con
+        self.workers = max(workers, 1)
+        self.combine = combine
+        self.lock = threading.Lock()
+        self.pending = []
+        self.timings = []
+        self.elapsed = 0.0
+
+    def _worker(self):
+        con = self.con.clone()
+        con.connect()
+        try:
+            while True:
+                with self.lock:
+                    if not self.pending:
+                        break
+                    table, indexes = self.pending.pop(0)
+                for names, query in con.index_queries(table, indexes,
+                                                      self.combine):
+                    start = time.time()
+                    con.send_query(query)
+                    elapsed = time.time() - start
+                    with self.lock:
+                        self.timings.append((table, names, elapsed))
+                    print("Index %s of table %s built in %.2f sec." % (
+                          ', '.join(names), table, elapsed))
+        finally:
+            con.close()
+
+    def build(self, plan, sizes=None):
+        """
+        Build all indexes of plan, taking larger tables first if sizes
+        {table: bytes} are given. Returns list of timings (table, names of
+        indexes, elapsed seconds), in order of completion.
+        """
+        self.pending = plan_tables(plan, sizes)
+        self.timings = []
+        start = time.time()
+        threads = [threading.Thread(target=self._worker,
+                                    name='index-builder-%s' % n)
+                   for n in range(min(self.workers, len(self.pending)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.time() - start
+        return self.timings
+
+    def report(self):
+        """
+        Print summary of last build: elapsed time and time of each table
+        """
+        tables = {}
+        for table, names, elapsed in self.timings:
+            tables[table] = tables.get(table, 0.0) + elapsed
+        print("Indexes of %s tables built in %.2f sec. (%.2f sec. adding "
+              "up all tables)" % (len(tables), self.elapsed,
+                                  sum(tables.values())))
+        for table in sorted(tables, key=tables.get, reverse=True):
+            print("    %-20s %10.2f sec." % (table, tables[table]))
+        print()
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk loading of data files in DB tables.
+
+Consumers write rows of each table to rotating chunk files in tmp dir
+(<prefix>_<table>.<number>.csv, see ChunkWriter). Closed chunks are
+handed to a ChunkLoader, which loads them with LOAD DATA INFILE (or the
+bulk load of the DB backend, see load_chunk of DB connections) in
+background threads while the consumer keeps writing the next chunk:
+
+    - each table has its own thread and DB connection, so independent
+      tables (e.g. revision and revision_hash) are loaded concurrently
+    - chunks of the same table are loaded in order
+    - at most max_pending closed chunks of each table wait to be loaded.
+      Beyond that, the consumer blocks until the loader catches up.
+    - chunk files are removed once loaded. Chunks failing to load are
+      kept, as well as chunks still pending in the table, and the error is
+      raised by the next submit of the consumer (or ChunkLoader.close)
+
+With max_pending=0 chunks are loaded synchronously by the consumer
+(previous behaviour). Counters: time blocked waiting for loaders (wait)
+and time spent loading chunks, added up for all tables (load_time).
+
+Load modes (see BulkLoad):
+
+    - file: chunk files are read by the DB server (LOAD DATA INFILE), so
+      it must see the same filesystem
+    - local: chunk files are read by the client and streamed to the server
+      (LOAD DATA LOCAL INFILE)
+    - fifo: chunks are kept in memory and streamed to the server through a
+      named pipe (LOAD DATA LOCAL INFILE), so rows never touch the disk.
+      Up to max_pending + 1 chunks of each table are kept in memory.
+      Chunks failing to load are written to chunk files named like their
+      pipes, with the suffix of chunk files.
+
+Chunk files and named pipes go to a staging dir if given (e.g. a tmpfs
+such as /dev/shm, so they do not compete with decompression of dump
+files for the same disks), or to the tmp dir of dump files. Local modes
+require local_infile enabled in the DB server.
+
+DB backends with their own chunk format (e.g. binary COPY files of
+pgutils.PostgresDB) return an encoder of rows in chunk_encoder, and chunks
+get its suffix instead of csv. In fifo mode, such backends may stream the
+contents of chunks without named pipes.
+
+Loader connections may apply a named load profile of the DB engine (see
+dbutils.LOAD_PROFILES) before loading chunks, and restore previous
+settings once they are done.
+"""
+import csv
+import glob
+import io
+import os
+import queue
+import threading
+import time
+
+LOAD_QUERY = """LOAD DATA %sINFILE '%s' INTO TABLE %s
+                FIELDS OPTIONALLY ENCLOSED BY '"'
+                TERMINATED BY '\t' ESCAPED BY '"'
+                LINES TERMINATED BY '\n'"""
+
+LOAD_MODES = ('file', 'local', 'fifo')
+
+
+def load_fifo(path, data, load):
+    """
+    Stream data (bytes) through a named pipe in path, created for a call
+    to load, which reads it (e.g. sending LOAD DATA LOCAL INFILE for
+    path). The pipe is removed afterwards.
+    """
+    def feed():
+        try:
+            with open(path, 'wb') as fifo:
+                fifo.write(data)
+        except BrokenPipeError:
+            pass
+
+    if os.path.exists(path):
+        os.remove(path)
+    os.mkfifo(path)
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        load()
+    finally:
+        while feeder.is_alive():
+            # Unblock the feeder if the server did not read the pipe
+            # (writes fail once this reader is closed)
+            fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            feeder.join(0.01)
+            os.close(fd)
+        feeder.join()
+        os.remove(path)
+
+
+class BulkLoad(object):
+    """
+    Settings of bulk loading of data files in DB, shared by all consumers
+    of a task
+
+    Arguments:
+        - mode = One of LOAD_MODES
+        - staging_dir = Directory of chunk files and named pipes (tmp dir of
+          dump files if None)
+        - max_pending = Max. number of closed chunks of each table waiting
+          to be loaded (0 loads them synchronously)
+        - profile = Name of load profile of loader connections (one of
+          dbutils.LOAD_PROFILES, None for no profile)
+    """
+    def __init__(self, mode='file', staging_dir=None, max_pending=1,
+                 profile=None):
+        if mode not in LOAD_MODES:
+            raise RuntimeError('Unsupported load mode ' + str(mode))
+        if mode == 'fifo' and not hasattr(os, 'mkfifo'):
+            raise RuntimeError('Load mode fifo requires named pipes')
+        self.mode = mode
+        self.staging_dir = staging_dir
+        self.max_pending = max_pending
+        self.profile = profile
+
+    def __repr__(self):
+        return "BulkLoad(%s, staging_dir=%s, max_pending=%s, profile=%s)" % (
+            self.mode, self.staging_dir, self.max_pending, self.profile)
+
+    def uses_db(self):
+        return True
+
+    def is_local(self):
+        return self.mode != 'file'
+
+    def loader(self, con):
+        """
+        Return new ChunkLoader with these settings on connection con
+        """
+        return ChunkLoader(con, max_pending=self.max_pending, mode=self.mode,
+                           profile=self.profile)
+
+    def writer(self, loader, table, tmp_dir, prefix):
+        """
+        Return new ChunkWriter of table, with chunks in staging dir (or
+        tmp_dir if there is no staging dir)
+        """
+        staging_dir = (os.path.abspath(self.staging_dir) if self.staging_dir
+                       else tmp_dir)
+        if not os.path.isdir(staging_dir):
+            os.makedirs(staging_dir)
+        return ChunkWriter(loader, table, staging_dir, prefix,
+                           encoder=loader.con.chunk_encoder(table))
+
+
+class ChunkLoader(object):
+    """
+    Loads chunk files in DB tables, in background threads
+
+    Arguments:
+        - con = DB connection of the consumer (e.g. MySQLDB). Background
+          threads use new connections with the same settings (con.clone())
+        - max_pending = Max. number of closed chunks of each table waiting
+          to be loaded (0 loads them synchronously with con)
+        - mode = One of LOAD_MODES
+        - profile = Name of load profile of loader connections (None keeps
+          the profile of con)
+    """
+    def __init__(self, con, max_pending=1, mode='file', profile=None):
+        self.con = con
+        self.max_pending = max_pending
+        self.mode = mode
+        self.local = mode != 'file'
+        self.profile = profile
+        self.own_con = (self.local or profile is not None) and not max_pending
+        if self.own_con:
+            # con may not allow local files or have other session
+            # settings, use a new connection
+            self.con = con.clone(local_infile=self.local,
+                                 load_profile=profile)
+            self.con.connect()
+            self.con.begin_load()
+        self.queues = {}
+        self.threads = {}
+        self.errors = []
+        self.lock = threading.Lock()
+        self.chunks = 0
+        self.wait = 0.0
+        self.load_time = 0.0
+
+    def _load(self, con, table, chunk):
+        start = time.time()
+        path, data = chunk
+        # Raises on errors, so that the chunk file is kept
+        con.load_chunk(table, path, data, local=self.local)
+        if data is None:
+            os.remove(path)
+        with self.lock:
+            self.chunks += 1
+            self.load_time += time.time() - start
+
+    def _keep(self, table, chunk):
+        """
+        Write contents of chunk in memory (fifo mode) to a chunk file
+        named like its pipe, so that its rows are not lost
+        """
+        path, data = chunk
+        if data is None:
+            return
+        encoder = self.con.chunk_encoder(table)
+        path = '%s.%s' % (os.path.splitext(path)[0],
+                          encoder.suffix if encoder is not None else 'csv')
+        try:
+            with open(path, 'wb') as out:
+                out.write(data)
+        except Exception as e:
+            self.errors.append((table, e))
+
+    def _worker(self, table, chunks):
+        con = self.con.clone(local_infile=self.local,
+                             load_profile=self.profile)
+        chunk = None
+        try:
+            con.connect()
+            con.begin_load()
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                self._load(con, table, chunk)
+        except Exception as e:
+            self.errors.append((table, e))
+            # Keep failed and pending chunks, unblocking the consumer (its
+            # next submit raises the error)
+            if chunk is None:
+                # Failed before getting any chunk
+                chunk = chunks.get()
+            while chunk is not None:
+                self._keep(table, chunk)
+                chunk = chunks.get()
+        finally:
+            try:
+                con.end_load()
+            except Exception as e:
+                self.errors.append((table, e))
+            con.close()
+
+    def submit(self, table, path, data=None):
+        """
+        Load chunk file in path in table. In fifo mode, data are the
+        contents of the chunk and path is the named pipe to create. Errors
+        of synchronous loads are raised here. Once a background thread
+        fails, the next chunk is kept and close is called, which raises the
+        error.
+        """
+        chunk = (path, data)
+        if not self.max_pending:
+            start = time.time()
+            try:
+                self._load(self.con, table, chunk)
+            except Exception:
+                self._keep(table, chunk)
+                raise
+            self.wait += time.time() - start
+            return
+        if self.errors:
+            # Stop feeding loaders as soon as one of them fails
+            self._keep(table, chunk)
+            self.close()
+        if table not in self.threads:
+            self.queues[table] = queue.Queue(maxsize=self.max_pending)
+            self.threads[table] = threading.Thread(
+                target=self._worker, args=(table, self.queues[table]),
+                name='loader-' + table, daemon=True)
+            self.threads[table].start()
+        start = time.time()
+        self.queues[table].put(chunk)
+        self.wait += time.time() - start
+
+    def close(self):
+        """
+        Wait until all chunks are loaded and stop background threads.
+        Raises RuntimeError if any of them failed.
+        """
+        start = time.time()
+        for table, chunks in self.queues.items():
+            chunks.put(None)
+        for thread in self.threads.values():
+            thread.join()
+        self.wait += time.time() - start
+        self.queues = {}
+        self.threads = {}
+        if self.own_con:
+            try:
+                self.con.end_load()
+            except Exception as e:
+                self.errors.append(('session', e))
+            self.con.close()
+        if self.errors:
+            raise RuntimeError('Error loading chunk files in %s' % (
+                               ', '.join('%s (%s)' % error
+                                         for error in self.errors)))
+
+
+class ChunkWriter(object):
+    """
+    Writes rows of a table to rotating chunk files in tmp_dir, named
+    <prefix>_<table>.<number>.csv. Closed chunks are loaded by loader. In
+    fifo mode, chunks are written to memory and streamed to the DB through
+    named pipes <prefix>_<table>.<number>.fifo.
+
+    Arguments:
+        - loader = ChunkLoader
+        - table = Name of DB table
+        - tmp_dir = Directory of chunk files
+        - prefix = Prefix of chunk files (e.g. name of ETL line)
+        - encoder = Encoder of rows in the chunk format of the DB backend,
+          with methods header, encode(row) and trailer and attribute
+          suffix (e.g. pgutils.CopyEncoder). None writes CSV chunks.
+    """
+    def __init__(self, loader, table, tmp_dir, prefix, encoder=None):
+        self.loader = loader
+        self.table = table
+        self.tmp_dir = tmp_dir
+        self.prefix = prefix
+        self.number = 0
+        self.rows = 0
+        self.total = 0
+        self.fifo = loader.mode == 'fifo'
+        self.encoder = encoder
+        self.suffix = encoder.suffix if encoder is not None else 'csv'
+        self.out = None
+        self.writer = None
+        # Delete chunk files and named pipes of previous runs
+        for path in glob.glob(os.path.join(glob.escape(tmp_dir),
+                                           glob.escape(prefix + '_' + table) +
+                                           '.*.*')):
+            if path.endswith(('.' + self.suffix, '.fifo')):
+                os.remove(path)
+
+    def path(self):
+        return os.path.join(self.tmp_dir, '%s_%s.%06d.%s' % (
+                            self.prefix, self.table, self.number,
+                            'fifo' if self.fifo else self.suffix))
+
+    def writerow(self, row):
+        if self.encoder is not None:
+            if self.out is None:
+                self.out = io.BytesIO() if self.fifo else open(self.path(),
+                                                              'wb')
+                self.out.write(self.encoder.header())
+            self.out.write(self.encoder.encode(row))
+            self.rows += 1
+            self.total += 1
+            return
+        if self.out is None:
+            if self.fifo:
+                self.out = io.TextIOWrapper(io.BytesIO(), encoding='utf-8',
+                                            newline='')
+            else:
+                self.out = open(self.path(), 'w')
+            self.writer = csv.writer(self.out, dialect='excel-tab',
+                                     lineterminator='\n')
+        self.writer.writerow([s if isinstance(s, str) else str(s)
+                              for s in row])
+        self.rows += 1
+        self.total += 1
+
+    def rotate(self):
+        """
+        Close current chunk (if it has any rows) and hand it to the loader
+        """
+        if self.out is None:
+            return
+        data = None
+        if self.encoder is not None:
+            self.out.write(self.encoder.trailer())
+            if self.fifo:
+                data = self.out.getvalue()
+        elif self.fifo:
+            self.out.flush()
+            data = self.out.buffer.getvalue()
+        self.out.close()
+        self.out = None
+        self.writer = None
+        path = self.path()
+        self.number += 1
+        self.rows = 0
+        self.loader.submit(self.table, path, data)
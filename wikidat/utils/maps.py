@@ -22,11 +22,40 @@ EXTENSIONS = {
     'gz': "zcat 2>/dev/null"
 }
 
+"""
+Decompression tools for every file extension, in order of preference.
+Parallel tools come first, followed by standard single-threaded ones.
+Commands read compressed data from STDIN and write decompressed data to
+STDOUT, unless they include '{path}' to take the dump file as argument.
+Placeholder '{threads}' is replaced by the number of threads to be used.
+"""
+DECOMPRESSORS = {
+    'bz2': [['lbzip2', '-dc', '-n', '{threads}'],
+            ['pbzip2', '-dc', '-p{threads}', '{path}'],
+            ['bzip2', '-dc']],
+    'gz': [['pigz', '-dc', '-p', '{threads}'],
+           ['gzip', '-dc']],
+    'xz': [['xz', '-dc', '-T', '{threads}']],
+    'lzma': [['xz', '-dc', '--format=lzma'],
+             ['lzcat']],
+    '7z': [['7za', 'e', '-so', '{path}'],
+           ['7z', 'e', '-so', '{path}']]
+}
+
 """
 A regular expression for extracting the final extension of a file.
 """
 EXT_RE = re.compile(r'\.([^\.]+)$')
 
+"""
+Regular expression matching bz2 multistream dump files, either complete
+(enwiki-20160501-pages-articles-multistream.xml.bz2) or split in
+several parts (enwiki-20160501-pages-articles-multistream1.xml-p1p30303.bz2),
+and template to build the path to their offsets index file from it.
+"""
+MULTISTREAM_RE = re.compile(r'(-multistream)(\d*)\.xml(-p\d+p\d+)?\.bz2$')
+MULTISTREAM_INDEX = r'\1-index\2.txt\3.bz2'
+
 """
 List of regular expressions for detection of Featured Articles,
 Featured Lists (if they exist in that language) and Good Articles
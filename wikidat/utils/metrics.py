@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics of pipeline processes in ETL lines.
+
+Every Producer, Processor and Consumer keeps counters of items and payload
+bytes received and sent, time blocked waiting on its input (recv_wait) and
+output (send_wait) channels, time paused by the memory governor
+(throttle_wait, XML readers only) and time spent in its target function.
+Consumers loading chunk files in DB also report time blocked waiting for
+their loaders (load_wait) and time spent loading chunks in background
+threads (load_time, can be larger than elapsed time). They
+are published periodically to the control channel of the ETL line, where
+a MetricsAggregator writes them to a JSON file and a Prometheus text file
+(e.g. for node_exporter's textfile collector).
+"""
+import json
+import os
+import re
+import time
+
+
+class ProcessMetrics(object):
+    """
+    Counters of a pipeline process, taken from its receiver and senders
+    (see comutils.FrameSender and comutils.FrameReceiver).
+
+    Arguments:
+        - interval = Min. number of seconds between two snapshots returned
+          by due(). 0 disables periodic snapshots.
+    """
+    def __init__(self, interval=0):
+        self.interval = interval
+        self.start = time.time()
+        self.next_time = self.start + interval
+        self.receiver = None
+        self.senders = []
+        self.loaders = []
+        self.throttle_wait = 0.0
+
+    def due(self):
+        """
+        True if a new periodic snapshot should be published
+        """
+        if not self.interval:
+            return False
+        now = time.time()
+        if now < self.next_time:
+            return False
+        self.next_time = now + self.interval
+        return True
+
+    def snapshot(self, items_in=0):
+        """
+        Return dict with current value of all counters
+        """
+        elapsed = time.time() - self.start
+        recv_wait = self.receiver.wait if self.receiver is not None else 0.0
+        send_wait = sum(sender.wait for sender in self.senders)
+        load_wait = sum(loader.wait for loader in self.loaders)
+        stats = {'in': items_in,
+                 'out': sum(sender.sent for sender in self.senders),
+                 'bytes_in': (self.receiver.bytes
+                              if self.receiver is not None else 0),
+                 'bytes_out': sum(sender.bytes for sender in self.senders),
+                 'recv_wait': recv_wait,
+                 'send_wait': send_wait,
+                 'throttle_wait': self.throttle_wait,
+                 'load_wait': load_wait,
+                 'load_time': sum(loader.load_time
+                                  for loader in self.loaders),
+                 'target_time': max(elapsed - recv_wait - send_wait -
+                                    self.throttle_wait - load_wait, 0.0),
+                 'elapsed': elapsed}
+        if self.receiver is not None and self.receiver.queued() is not None:
+            stats['queued_bytes'] = self.receiver.queued()
+        return stats
+
+
+# Counters published by processes, in Prometheus metric names
+PROM_COUNTERS = [('in', 'items_in_total'),
+                 ('out', 'items_out_total'),
+                 ('bytes_in', 'bytes_in_total'),
+                 ('bytes_out', 'bytes_out_total'),
+                 ('recv_wait', 'recv_wait_seconds_total'),
+                 ('send_wait', 'send_wait_seconds_total'),
+                 ('throttle_wait', 'throttle_wait_seconds_total'),
+                 ('load_wait', 'load_wait_seconds_total'),
+                 ('load_time', 'load_seconds_total'),
+                 ('target_time', 'target_seconds_total')]
+
+
+class MetricsAggregator(object):
+    """
+    Collects metrics published by the processes of an ETL line and writes
+    them to <path>.json and <path>.prom every interval seconds.
+
+    Arguments:
+        - line = Name of ETL line, prefix of the names of its processes
+        - path = Path of output files, without extension
+        - channels = List of (upstream stages, downstream stages) pairs,
+          used to compute the number of items queued between stages
+        - interval = Seconds between writes of output files
+    """
+    def __init__(self, line, path, channels=None, interval=10):
+        self.line = line
+        self.path = path
+        self.channels = channels if channels is not None else []
+        self.interval = interval
+        self.processes = {}
+        self.next_time = time.time() + interval
+        # Totals of stages in last write, to compute current rates
+        self.last_time = time.time()
+        self.last_totals = {}
+
+    def stage(self, name):
+        """
+        Return stage of a process, i.e. its name without the name of the
+        line and worker numbers ('process_revision' for
+        '[ETL:RevHistory-0]-process_revision-2')
+        """
+        if name.startswith(self.line):
+            name = name[len(self.line):].lstrip('-')
+        return re.sub(r'(-\d+)+$', '', name)
+
+    def update(self, msg):
+        """
+        Store last metrics published by a process (STATS or DONE messages)
+        """
+        if 'elapsed' in msg:
+            self.processes[msg['name']] = msg
+
+    def stages(self):
+        """
+        Return dict {stage: metrics} adding up metrics of its processes,
+        with rates (items/s, bytes/s) since last write
+        """
+        now = time.time()
+        period = max(now - self.last_time, 1e-6)
+        stages = {}
+        for name, msg in self.processes.items():
+            stage = stages.setdefault(self.stage(name), {'processes': 0})
+            stage['processes'] += 1
+            for key, prom in PROM_COUNTERS:
+                stage[key] = stage.get(key, 0) + msg.get(key, 0)
+            if 'queued_bytes' in msg:
+                # All workers of a stage may read from the same ring
+                stage['queued_bytes'] = max(stage.get('queued_bytes', 0),
+                                            msg['queued_bytes'])
+        for name, stage in stages.items():
+            last = self.last_totals.get(name, {})
+            for key in ('in', 'out', 'bytes_in', 'bytes_out'):
+                stage[key + '_rate'] = ((stage[key] - last.get(key, 0)) /
+                                        period)
+            self.last_totals[name] = stage
+        self.last_time = now
+
+        # Items sent by upstream stages not received yet by downstream ones
+        for upstream, downstream in self.channels:
+            sent = sum(stages[s]['out'] for s in upstream if s in stages)
+            received = sum(stages[s]['in'] for s in downstream
+                           if s in stages)
+            for s in downstream:
+                if s in stages:
+                    stages[s]['queued_items'] = max(sent - received, 0)
+        return stages
+
+    def tick(self):
+        """
+        Write output files if interval has elapsed since last write
+        """
+        if self.interval and time.time() >= self.next_time:
+            self.write()
+
+    def write(self):
+        """
+        Write current metrics to JSON and Prometheus text files
+        """
+        self.next_time = time.time() + self.interval
+        stages = self.stages()
+        data = {'line': self.line, 'time': time.time(),
+                'stages': stages, 'processes': self.processes}
+        self._write_file(self.path + '.json',
+                         json.dumps(data, indent=2, sort_keys=True))
+
+        lines = []
+        label = self.line.replace('\\', '\\\\').replace('"', '\\"')
+        metrics = (PROM_COUNTERS +
+                   [('queued_items', 'queued_items'),
+                    ('queued_bytes', 'queued_bytes'),
+                    ('in_rate', 'items_in_per_second'),
+                    ('out_rate', 'items_out_per_second'),
+                    ('bytes_in_rate', 'bytes_in_per_second'),
+                    ('bytes_out_rate', 'bytes_out_per_second')])
+        for key, prom in metrics:
+            kind = 'counter' if prom.endswith('_total') else 'gauge'
+            lines.append('# TYPE wikidat_%s %s' % (prom, kind))
+            for stage in sorted(stages):
+                if key in stages[stage]:
+                    lines.append('wikidat_%s{line="%s",stage="%s"} %s' % (
+                                 prom, label, stage, stages[stage][key]))
+        self._write_file(self.path + '.prom', '\n'.join(lines) + '\n')
+
+    def _write_file(self, path, content):
+        # Replace files atomically, so readers never see partial files
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as out_file:
+            out_file.write(content)
+        os.replace(tmp_path, path)
+
+
+def metrics_path(log_dir, line):
+    """
+    Return path (without extension) of metrics files of an ETL line
+    """
+    return os.path.join(log_dir,
+                        'metrics-' + re.sub(r'[^\w.-]+', '_', line).strip('_'))
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+PostgreSQL backend of ETL workflows (requires package psycopg2).
+
+PostgresDB has the same interface as dbutils.MySQLDB (see
+dbutils.DBBackend), with tables of pg_schema. Chunks of rows are written
+by consumers in the binary format of COPY (see CopyEncoder) and loaded
+with COPY ... FROM STDIN, so values are not parsed again by the server.
+Load modes (see loader):
+
+    - file: chunk files are read by the DB server (COPY ... FROM 'path',
+      requires superuser or pg_read_server_files)
+    - local: chunk files are read by the client and streamed to the server
+      (COPY ... FROM STDIN)
+    - fifo: chunks are kept in memory and streamed to the server (COPY ...
+      FROM STDIN), with no named pipes
+
+Tables are loaded without indexes, primary keys and indexes of the index
+plans of base_schema are built afterwards (see create_indexes), and
+tables are analyzed then. Load profiles (dbutils.LOAD_PROFILES) are
+settings of MySQL sessions and do not apply: loader connections turn off
+synchronous_commit instead.
+"""
+import datetime
+import io
+import struct
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+import wikidat.retrieval.db.pg_schema as pg
+from wikidat.utils.dbutils import DBBackend
+
+COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+COPY_TRAILER = struct.pack('>h', -1)
+COPY_NULL = struct.pack('>i', -1)
+
+PG_EPOCH = datetime.datetime(2000, 1, 1)
+MICROSECOND = datetime.timedelta(microseconds=1)
+
+# Length and value of fields of numeric types
+_NUMBERS = {'smallint': (struct.Struct('>ih'), 2, int),
+            'integer': (struct.Struct('>ii'), 4, int),
+            'bigint': (struct.Struct('>iq'), 8, int),
+            'double precision': (struct.Struct('>id'), 8, float)}
+
+
+def _is_null(value):
+    return value is None or value == 'NULL'
+
+
+def _number_field(kind, not_null):
+    packer, size, convert = _NUMBERS[kind]
+    default = packer.pack(size, 0)
+
+    def field(value):
+        if _is_null(value) or value == '':
+            return default if not_null else COPY_NULL
+        return packer.pack(size, convert(value))
+    return field
+
+
+def _text_field(not_null):
+    empty = struct.pack('>i', 0)
+
+    def field(value):
+        if _is_null(value):
+            return empty if not_null else COPY_NULL
+        if not isinstance(value, str):
+            value = str(value)
+        if '\x00' in value:
+            # Not allowed in PostgreSQL text
+            value = value.replace('\x00', '')
+        data = value.encode('utf-8')
+        return struct.pack('>i', len(data)) + data
+    return field
+
+
+def _timestamp_field():
+    packer = struct.Struct('>iq')
+
+    def field(value):
+        if _is_null(value) or value == '':
+            return COPY_NULL
+        try:
+            ts = datetime.datetime.fromisoformat(str(value))
+        except ValueError:
+            # Zero dates of MySQL
+            return COPY_NULL
+        if ts.tzinfo is not None:
+            ts = ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return packer.pack(8, (ts - PG_EPOCH) // MICROSECOND)
+    return field
+
+
+class CopyEncoder(object):
+    """
+    Encodes rows in the binary format of COPY: a header, every row as the
+    number of fields followed by length (-1 for NULL) and value of each
+    field, and a trailer. Values 'NULL' (NULL in CSV chunks) and empty
+    strings of numeric and timestamp columns are NULL, or the default of
+    the type in NOT NULL columns.
+
+    Arguments:
+        - columns = List of (name, type, not null) of table, see
+          pg_schema.TABLES
+    """
+    suffix = 'copy'
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.fields = []
+        for name, kind, not_null in columns:
+            if kind == 'timestamp':
+                self.fields.append(_timestamp_field())
+            elif kind == 'text':
+                self.fields.append(_text_field(not_null))
+            else:
+                self.fields.append(_number_field(kind, not_null))
+        self.count = struct.pack('>h', len(columns))
+
+    def header(self):
+        return COPY_HEADER
+
+    def trailer(self):
+        return COPY_TRAILER
+
+    def encode(self, row):
+        return self.count + b''.join([field(value) for field, value
+                                      in zip(self.fields, row)])
+
+
+class PostgresDB(DBBackend):
+    """
+    Models connections to PostgreSQL database (convenience methods, same
+    interface as dbutils.MySQLDB)
+    """
+
+    def __init__(self, db=None, host='localhost', port=5432,
+                 user=None, passwd=None, local_infile=False,
+                 load_profile=None):
+        """
+        Intilialize new PostgreSQL DB connection object. local_infile and
+        load_profile are kept for clones, but they have no effect (COPY
+        FROM STDIN is always allowed and load profiles are MySQL settings).
+        """
+        self.db = db
+        self.host = host
+        self.port = port
+        self.user = user
+        self.passwd = passwd
+        self.local_infile = local_infile
+        self.load_profile = load_profile
+        self.con = None  # Connection to DB
+        self.cursor = None  # Cursor to DB
+
+    def connect(self):
+        """
+        Establish a new connection to PostgreSQL DB (database postgres if
+        no DB is given) and initialize new cursor. Every query is committed
+        on its own (autocommit).
+        """
+        if psycopg2 is None:
+            raise RuntimeError('PostgreSQL backend requires package '
+                               'psycopg2')
+        self.con = psycopg2.connect(host=self.host, port=self.port,
+                                    user=self.user, password=self.passwd,
+                                    dbname=(self.db if self.db is not None
+                                            else 'postgres'))
+        self.con.set_client_encoding('UTF8')
+        self.con.autocommit = True
+        self.cursor = self.con.cursor()
+
+    def clone(self, local_infile=None, load_profile=None):
+        """
+        Return new (not connected) PostgresDB object with the same settings
+        """
+        if local_infile is None:
+            local_infile = self.local_infile
+        if load_profile is None:
+            load_profile = self.load_profile
+        return PostgresDB(db=self.db, host=self.host, port=self.port,
+                          user=self.user, passwd=self.passwd,
+                          local_infile=local_infile,
+                          load_profile=load_profile)
+
+    def close(self):
+        """
+        Close existing connection to PostgreSQL DB
+        """
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+            self.cursor = None
+
+    def __repr__(self):
+        return """wikidat.pgutils.PostgresDB object
+            to database %r in host %r at port %r""" % (
+            self.db, self.host, self.port)
+
+    def db_exists(self, db):
+        """
+        Check if DB already exists or not
+        """
+        params = {'dbname': db}
+        return self.execute_query(pg.check_database.format(**params))
+
+    def create_database(self, db):
+        """
+        Create new database (dropping it if it exists)
+        """
+        params = {'dbname': db}
+        self.send_query(pg.drop_database.format(**params))
+        self.send_query(pg.create_database.format(**params))
+
+    def create_schema(self, tables):
+        for table in tables:
+            self.send_query(pg.drop_table(table))
+            self.send_query(pg.create_table(table))
+
+    def create_schema_revhist(self, engine='ARIA'):
+        """
+        Create schema in local database for tables related to rev-history
+        dumps (engine is ignored)
+        """
+        self.create_schema(pg.TABLES_REVHIST)
+
+    def create_schema_logitem(self, engine='ARIA'):
+        """
+        Create schema in local database for tables related with logging
+        dump (engine is ignored)
+        """
+        self.create_schema(pg.TABLES_LOGITEM)
+
+    def table_sizes(self):
+        """
+        Return dict {table: size in bytes of data} of tables in current DB
+        (names in lower case)
+        """
+        results = self.execute_query(pg.table_sizes)
+        if results is None:
+            return {}
+        return {table: size or 0 for table, size in results}
+
+    def index_queries(self, table, indexes, combine=False):
+        """
+        Return list of (names of indexes, query) adding indexes to table:
+        ALTER TABLE ... ADD PRIMARY KEY for PRIMARY and CREATE INDEX
+        <table>_<index> for other indexes. With combine, all of them are
+        sent at once (one round trip, built one after another).
+        """
+        queries = []
+        for index, columns in indexes:
+            if index == 'PRIMARY':
+                query = 'ALTER TABLE %s ADD PRIMARY KEY (%s)' % (
+                    pg.quote(table), columns)
+            else:
+                query = 'CREATE INDEX %s ON %s (%s)' % (
+                    pg.quote(table + '_' + index), pg.quote(table), columns)
+            queries.append(([index], query))
+        if combine:
+            return [([index for names, query in queries for index in names],
+                     '; '.join(query for names, query in queries))]
+        return queries
+
+    def create_indexes(self, plan, workers=4, combine=False):
+        """
+        Create primary keys and indexes of index plan, as MySQLDB does, and
+        update statistics of its tables (ANALYZE)
+        """
+        timings = super(PostgresDB, self).create_indexes(plan,
+                                                         workers=workers,
+                                                         combine=combine)
+        for table in sorted(set(table for table, index, columns in plan)):
+            self.send_query('ANALYZE %s' % pg.quote(table))
+        return timings
+
+    def chunk_encoder(self, table):
+        """
+        Return CopyEncoder of rows of table
+        """
+        return CopyEncoder(pg.TABLES[table])
+
+    def load_chunk(self, table, path, data=None, local=False):
+        """
+        Load binary COPY chunk in table: file in path read by the DB
+        server, or streamed by the client if local. In fifo mode, data are
+        streamed from memory. Errors are raised.
+        """
+        if data is not None:
+            self.copy(table, io.BytesIO(data))
+        elif local:
+            with open(path, 'rb') as chunk:
+                self.copy(table, chunk)
+        else:
+            self.cursor.execute(pg.copy_file % (pg.quote(table),
+                                                path.replace("'", "''")))
+
+    def copy(self, table, chunk):
+        """
+        Stream binary COPY data in file object chunk to table
+        """
+        self.cursor.copy_expert(pg.copy_stdin % pg.quote(table), chunk,
+                                size=1 << 20)
+
+    def begin_load(self):
+        """
+        Do not wait for WAL flushes of commits while loading data
+        """
+        self.send_query('SET synchronous_commit TO off')
+
+    def end_load(self):
+        """
+        Restore settings changed by begin_load
+        """
+        self.send_query('RESET synchronous_commit')
+
+    def insert_namespaces(self, nsdict):
+        """
+        Insert namespace info (from RevHist or RevMeta dumps)
+        """
+        self.cursor.executemany(pg.insert_namespaces, nsdict.items())
+
+    def send_query(self, query):
+        """
+        Send query to DB
+        query: query to be sent to DB
+        """
+        try:
+            self.cursor.execute(query)
+        except Exception as e:
+            # TODO: Capture and log DB exceptions with logger library
+            print("Exception in send_query method: ", e)
+            print(query)
+
+    def insert_many(self, query_template, values):
+        """
+        Send multiple statements to DB. Typically used in bulk data inserts.
+        """
+        try:
+            self.cursor.executemany(query_template, values)
+        except Exception as e:
+            print("Exception in send_query method: ", e)
+
+    def execute_query(self, query):
+        """
+        Send query to DB, fetch all returned values (None if there are no
+        results)
+        """
+        self.cursor.execute(query)
+        if self.cursor.description is None:
+            return None
+        results = self.cursor.fetchall()
+        if not results:
+            return None
+        return results
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in profiling of pipeline processes.
+
+Each Producer, Processor and Consumer runs in its own process, so it must
+be profiled from inside. With profiling enabled, every process writes one
+file named after the process (e.g. [ETL:RevHistory-0]-process_revision-2)
+to the profile dir:
+
+    - cprofile: deterministic profile in pstats format (.pstats)
+    - sample: statistical profile taken every interval seconds of CPU
+      time, as collapsed stacks (.collapsed), ready for flamegraph tools
+
+Files of all processes of the same stage can be combined with
+wikidat.tools.profmerge.
+"""
+import cProfile
+import collections
+import contextlib
+import os
+import re
+import signal
+
+PROFILERS = ('cprofile', 'sample')
+EXTENSIONS = {'cprofile': '.pstats', 'sample': '.collapsed'}
+
+
+def stage_name(name):
+    """
+    Return stage of a process from its name, without the name of the ETL
+    line and numbers of workers and shards ('process_revision' for
+    '[ETL:RevHistory-0]-process_revision-2')
+    """
+    name = re.sub(r'^\[.*?\]-', '', name)
+    return re.sub(r'(-\d+)+$', '', name)
+
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler recording the call stack of the main thread every
+    interval seconds of CPU time (SIGPROF), aggregated as collapsed stacks
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%s)' % (code.co_name,
+                                         os.path.basename(code.co_filename),
+                                         code.co_firstlineno))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def enable(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def dump_stats(self, path):
+        with open(path, 'w') as out:
+            for stack, count in self.stacks.most_common():
+                out.write('%s %s\n' % (stack, count))
+
+
+class Profiling(object):
+    """
+    Settings of profiling of pipeline processes
+
+    Arguments:
+        - profile_dir = Directory of output files (created if missing)
+        - profiler = 'cprofile' or 'sample'
+        - interval = Sampling interval in seconds (sample profiler)
+    """
+    def __init__(self, profile_dir, profiler='cprofile', interval=0.005):
+        if profiler not in PROFILERS:
+            raise RuntimeError('Unsupported profiler ' + str(profiler))
+        self.profile_dir = profile_dir
+        self.profiler = profiler
+        self.interval = interval
+
+    def __repr__(self):
+        return "wikidat.utils.profiling.Profiling(%r, %r)" % (
+            self.profile_dir, self.profiler)
+
+    def path(self, name):
+        """
+        Return path to profile file of process name
+        """
+        return os.path.join(self.profile_dir,
+                            name + EXTENSIONS[self.profiler])
+
+    @contextlib.contextmanager
+    def profiled(self, name):
+        """
+        Profile code run in this context, writing results for process name
+        """
+        if self.profiler == 'cprofile':
+            profiler = cProfile.Profile()
+        else:
+            profiler = SamplingProfiler(self.interval)
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            if not os.path.isdir(self.profile_dir):
+                os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(self.path(name))
+
+
+@contextlib.contextmanager
+def profiled(name, profiling=None):
+    """
+    Profile code in this context if profiling (Profiling object) is given
+    """
+    if profiling is None:
+        yield
+    else:
+        with profiling.profiled(name):
+            yield